@@ -0,0 +1,65 @@
+"""Per-message auto-reply latency: compiled automaton vs the old keyword loop.
+
+Usage: python benchmarks/auto_reply_bench.py --rules 10 100 1000 10000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reply_matcher import Automaton, parse_rules
+
+
+def random_word(rng):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+
+
+def make_messages(rng, count):
+    return [' '.join(random_word(rng) for _ in range(rng.randint(3, 25))) for _ in range(count)]
+
+
+def linear_match(rules, text):
+    text = text.lower().strip()
+    for keyword, response in rules.items():
+        if keyword in text:
+            return keyword
+    return None
+
+
+def per_message(func, messages):
+    started = time.perf_counter()
+    for text in messages:
+        func(text)
+    return (time.perf_counter() - started) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    messages = make_messages(rng, args.messages)
+
+    print(f"{'rules':>8} {'linear (us)':>12} {'automaton (us)':>15} {'compile (ms)':>13}")
+    for count in args.rules:
+        rules = {}
+        while len(rules) < count:
+            rules[' '.join(random_word(rng) for _ in range(rng.randint(1, 2)))] = 'response'
+
+        started = time.perf_counter()
+        automaton = Automaton(parse_rules(rules))
+        compile_ms = (time.perf_counter() - started) * 1e3
+
+        linear = per_message(lambda text: linear_match(rules, text), messages)
+        compiled = per_message(lambda text: automaton.best_match(text.lower()), messages)
+        print(f"{count:>8} {linear * 1e6:>12.1f} {compiled * 1e6:>15.1f} {compile_ms:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
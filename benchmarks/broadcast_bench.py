@@ -0,0 +1,73 @@
+"""Compare the old sequential broadcast loop with BroadcastEngine.
+
+Usage: python benchmarks/broadcast_bench.py --users 300 --latency 0.05 --rate 30
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot
+from telegram.utils.request import Request
+
+from broadcaster import BroadcastEngine
+from fake_bot_api import FakeBotAPI
+
+
+def sequential(bot, users):
+    sent = 0
+    for user_id in users:
+        try:
+            bot.send_message(chat_id=user_id, text="📢 Broadcast Message:\n\nbenchmark")
+            sent += 1
+        except Exception:
+            pass
+    return sent
+
+
+def engine(bot, users, rate, workers):
+    engine = BroadcastEngine(rate=rate, workers=workers, per_chat_interval=1.0)
+    steps = [lambda chat_id: bot.send_message(chat_id=chat_id, text="📢 Broadcast Message:\n\nbenchmark")]
+    job = engine.submit("Benchmark", users, steps)
+    job.done.wait()
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake API latency per call (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with 429')
+    parser.add_argument('--rate', type=float, default=30.0, help='global token bucket rate (msg/s)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    server = FakeBotAPI(latency=args.latency, error_rate=args.error_rate).start()
+    bot = Bot('123:fake', base_url=server.base_url, request=Request(con_pool_size=args.workers + 2))
+    users = list(range(1000, 1000 + args.users))
+
+    try:
+        if not args.skip_sequential:
+            started = time.perf_counter()
+            sent = sequential(bot, users)
+            elapsed = time.perf_counter() - started
+            print(f"sequential: {sent}/{len(users)} sent in {elapsed:.2f}s ({sent / elapsed:.1f} msg/s)")
+
+        server.error_rate = args.error_rate
+        started = time.perf_counter()
+        job = engine(bot, users, args.rate, args.workers)
+        elapsed = time.perf_counter() - started
+        print(
+            f"engine:     {job.sent}/{len(users)} sent in {elapsed:.2f}s "
+            f"({job.sent / elapsed:.1f} msg/s, {job.failed} failed, {job.retries} retries, "
+            f"{server.throttled} throttled by fake API)"
+        )
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
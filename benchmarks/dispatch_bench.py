@@ -0,0 +1,96 @@
+"""Load test: sequential Dispatcher vs OrderedDispatcher against the fake Bot API.
+
+Every update triggers one outbound sendMessage, like most handlers in main.py.
+Also checks that updates from the same chat were handled in order.
+
+Usage: python benchmarks/dispatch_bench.py --updates 400 --chats 50 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from queue import Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update, Bot
+from telegram.ext import Dispatcher, MessageHandler, Filters
+from telegram.utils.request import Request
+
+from dispatch import KeyedExecutor, OrderedDispatcher
+from fake_bot_api import FakeBotAPI
+
+
+def make_updates(bot, count, chats):
+    updates = []
+    for i in range(count):
+        chat_id = 1000 + i % chats
+        updates.append(Update.de_json({
+            'update_id': i + 1,
+            'message': {
+                'message_id': i + 1,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'},
+                'text': f'message {i}'
+            }
+        }, bot))
+    return updates
+
+
+def run(dispatcher, updates):
+    seen = {}
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def handler(update, context):
+        context.bot.send_message(chat_id=update.effective_chat.id, text='ok')
+        with lock:
+            seen.setdefault(update.effective_chat.id, []).append(update.update_id)
+            if sum(len(ids) for ids in seen.values()) == len(updates):
+                done.set()
+
+    dispatcher.add_handler(MessageHandler(Filters.text, handler))
+    thread = threading.Thread(target=dispatcher.start, name='dispatcher')
+    thread.start()
+    started = time.perf_counter()
+    for update in updates:
+        dispatcher.update_queue.put(update)
+    done.wait()
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+    thread.join()
+
+    in_order = all(ids == sorted(ids) for ids in seen.values())
+    return elapsed, in_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=400)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--queue-depth', type=int, default=256)
+    args = parser.parse_args()
+
+    server = FakeBotAPI(latency=args.latency).start()
+    try:
+        for name in ('sequential', 'concurrent'):
+            bot = Bot('123:fake', base_url=server.base_url, request=Request(con_pool_size=args.workers + 4))
+            if name == 'sequential':
+                dispatcher = Dispatcher(bot, Queue(), use_context=True)
+            else:
+                dispatcher = OrderedDispatcher(
+                    bot, Queue(), use_context=True,
+                    executor=KeyedExecutor(args.workers, args.queue_depth)
+                )
+            elapsed, in_order = run(dispatcher, make_updates(bot, args.updates, args.chats))
+            print(f"{name:>10}: {args.updates / elapsed:8.1f} updates/s ({elapsed:.2f}s), per-chat order kept: {in_order}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Minimal local stand-in for the Telegram Bot API used by the benchmarks.
+
+Point a ``telegram.Bot`` at it with ``base_url=server.base_url``. Updates
+queued with ``push_update()`` are served to long-polling ``getUpdates`` calls.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeBotAPI:
+    """Threaded HTTP server answering Bot API calls with canned results.
+
+    Every call waits ``latency`` seconds; a fraction ``error_rate`` of the
+    outbound calls (everything except getUpdates) fails with 429 Too Many Requests.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = {}
+        self.throttled = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._updates = deque()
+        self.pushed_at = {}  # update_id -> time.perf_counter() when it was queued
+        self._update_id = 0
+        self._updates_ready = threading.Condition(self._lock)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='FakeBotAPI')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def total_calls(self, exclude=('getUpdates',)):
+        """Number of successful calls, by default only the bot's outbound ones"""
+        with self._lock:
+            return sum(count for method, count in self.calls.items() if method not in exclude)
+
+    def push_update(self, update):
+        """Queue an update (without update_id) for getUpdates; returns its update_id"""
+        with self._updates_ready:
+            self._update_id += 1
+            self.pushed_at[self._update_id] = time.perf_counter()
+            self._updates.append(dict(update, update_id=self._update_id))
+            self._updates_ready.notify_all()
+            return self._update_id
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._updates_ready:
+            # Updates below the offset have been confirmed by the client
+            while self._updates and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            return list(itertools.islice(self._updates, limit))
+
+    def _next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def handle(self, method, params):
+        """Return (http_status, payload) for one Bot API call"""
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'getUpdates':
+            self._count(method)
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.throttled += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }
+
+        self._count(method)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'
+            }}
+        if method.startswith('send') or method in ('forwardMessage', 'copyMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0) or 0)
+            return 200, {'ok': True, 'result': {
+                'message_id': self._next_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', '')
+            }}
+        return 200, {'ok': True, 'result': True}
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment; split writes stall on delayed ACKs
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                try:
+                    params = json.loads(body) if body else {}
+                except ValueError:
+                    params = {}
+                method = self.path.rsplit('/', 1)[-1]
+                status, payload = api.handle(method, params)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
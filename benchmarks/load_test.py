@@ -0,0 +1,244 @@
+"""End-to-end load test: main.py's full handler set against the fake Bot API.
+
+Synthetic users send a weighted mix of /start, /ask, /feedback, media with an
+/ask caption and plain text (auto-replies) at a fixed rate. Updates are
+delivered through getUpdates long polling, exactly as in production. Reports
+p50/p95/p99 handler latency and queue-to-handled latency per kind of update, plus
+updates/s and outbound Bot API calls/s.
+
+With --shards N the bot runs as a sharded deployment: this process is the
+coordinator and N worker processes share a temporary SQLite store. Handlers
+then run in the workers, so only throughput is reported.
+
+Usage: python benchmarks/load_test.py --updates 2000 --rate 200 --users 300 --latency 0.02 --mode concurrent
+       python benchmarks/load_test.py --updates 2000 --rate 0 --shards 4 --mode sequential
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import FakeBotAPI
+
+OWNER_ID = 1
+
+# Relative weight of each kind of synthetic update
+MIX = {
+    'start': 1,
+    'ask': 4,
+    'feedback': 1,
+    'media': 1,
+    'text': 3,
+}
+
+TEXTS = [
+    'hello there',
+    'thanks a lot!',
+    'what are your hours?',
+    'is anyone around',
+    'bye for now',
+]
+
+
+def command(text):
+    """Text message fields for a command, with the bot_command entity Telegram adds"""
+    length = len(text.split(' ', 1)[0])
+    return {'text': text, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': length}]}
+
+
+def make_update(kind, user_id, n):
+    message = {
+        'message_id': n,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'},
+    }
+    if kind == 'start':
+        message.update(command('/start'))
+    elif kind == 'ask':
+        message.update(command(f'/ask question number {n} about the service'))
+    elif kind == 'feedback':
+        message.update(command(f'/feedback {random.randint(1, 5)} load test feedback {n}'))
+    elif kind == 'media':
+        message['document'] = {
+            'file_id': f'doc{n}', 'file_unique_id': f'udoc{n}',
+            'file_name': f'report{n}.pdf', 'mime_type': 'application/pdf', 'file_size': 1024
+        }
+        message['caption'] = f'/ask please check file {n}'
+    else:
+        message['text'] = random.choice(TEXTS)
+    return {'message': message}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collects latencies per kind of update and signals when every update was handled"""
+
+    def __init__(self, expected, pushed_at):
+        self.expected = expected
+        self.handled = 0
+        self.pushed_at = pushed_at
+        self.kinds = {}  # message_id -> kind of synthetic update
+        self.handler_times = {}
+        self.end_to_end = {}
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def wrap(self, callback):
+        def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return callback(update, context)
+            finally:
+                finished = time.perf_counter()
+                message = update.effective_message if update is not None else None
+                name = self.kinds.get(message.message_id, 'other') if message else 'other'
+                with self._lock:
+                    self.handler_times.setdefault(name, []).append(finished - started)
+                    pushed = self.pushed_at.get(update.update_id) if update is not None else None
+                    if pushed is not None:
+                        self.end_to_end.setdefault(name, []).append(finished - pushed)
+                    self.handled += 1
+                    if self.handled >= self.expected:
+                        self.done.set()
+        return timed
+
+
+def report(title, samples):
+    print(f"\n{title}")
+    print(f"  {'update':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    everything = []
+    for name in sorted(samples):
+        values = sorted(samples[name])
+        everything.extend(values)
+        print(f"  {name:<18}{len(values):>8}"
+              f"{percentile(values, 0.50) * 1000:>10.1f}"
+              f"{percentile(values, 0.95) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}")
+    everything.sort()
+    print(f"  {'all':<18}{len(everything):>8}"
+          f"{percentile(everything, 0.50) * 1000:>10.1f}"
+          f"{percentile(everything, 0.95) * 1000:>10.1f}"
+          f"{percentile(everything, 0.99) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000, help='total updates to send')
+    parser.add_argument('--rate', type=float, default=200, help='updates per second offered (0 = as fast as possible)')
+    parser.add_argument('--users', type=int, default=300, help='distinct synthetic users')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake Bot API latency per call in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of outbound calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--mode', choices=('sequential', 'concurrent'), default='concurrent')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--shards', type=int, default=0, help='worker processes (sharded deployment)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Module-level configuration is read on import, by this process and by spawned workers
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    os.environ.update({
+        'OWNER_ID': str(OWNER_ID),
+        'BOT_TOKEN': '123:fake',
+        'DISPATCH_MODE': args.mode,
+        'DISPATCH_WORKERS': str(args.workers),
+        'STORAGE_BACKEND': 'sqlite' if args.shards > 1 else 'memory',
+        'STORAGE_PATH': os.path.join(workdir, 'bot_data.db'),
+        'MESSAGE_ARCHIVE_DIR': os.path.join(workdir, 'message_archive'),
+        # Synthetic users send far faster than real ones; the flood guard must not drop the load
+        'FLOOD_LIMITS': 'default=1000000/1',
+    })
+    import main as bot_main
+    from dispatch import create_updater
+    from sharding import ShardPool, create_sharded_updater
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server = FakeBotAPI(latency=args.latency, error_rate=args.error_rate, retry_after=args.retry_after).start()
+    recorder = Recorder(args.updates, server.pushed_at)
+    pool = None
+    if args.shards > 1:
+        bot_main.restore_state()
+        pool = ShardPool(args.shards, bot_main.run_shard_worker, args=(server.base_url,)).start()
+        bot_main.shard_pool = pool
+        pool.ready.wait(60)
+        updater = create_sharded_updater('123:fake', pool, bot_main.is_admin_update, base_url=server.base_url)
+        bot_main.register_handlers(updater.dispatcher)
+
+        def watch_workers():
+            while not recorder.done.wait(0.05):
+                recorder.handled = sum(pool.processed)
+                if recorder.handled >= args.updates:
+                    recorder.done.set()
+
+        threading.Thread(target=watch_workers, daemon=True).start()
+    else:
+        updater = create_updater('123:fake', mode=args.mode, workers=args.workers, base_url=server.base_url)
+        bot_main.register_handlers(updater.dispatcher)
+        for group, handlers in updater.dispatcher.handlers.items():
+            # Negative groups (the flood guard) run for every update ahead of the real handler
+            if group < 0:
+                continue
+            for handler in handlers:
+                handler.callback = recorder.wrap(handler.callback)
+
+    bot_main.admin_notifier.start(updater.bot)
+    updater.start_polling(poll_interval=0, timeout=1)
+
+    kinds = list(MIX)
+    weights = [MIX[kind] for kind in kinds]
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    started = time.perf_counter()
+    for n in range(1, args.updates + 1):
+        if interval:
+            delay = started + (n - 1) * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        kind = random.choices(kinds, weights)[0]
+        user_id = 1000 + random.randrange(args.users)
+        recorder.kinds[n] = kind
+        server.push_update(make_update(kind, user_id, n))
+    offered = time.perf_counter() - started
+
+    # Wait as long as updates keep getting handled
+    last_handled = -1
+    while not recorder.done.wait(10) and recorder.handled != last_handled:
+        last_handled = recorder.handled
+    finished = recorder.done.is_set()
+    elapsed = time.perf_counter() - started
+    outbound = server.total_calls()
+    updater.stop()
+    if pool is not None:
+        pool.stop()
+    bot_main.admin_notifier.stop(timeout=1)
+    server.stop()
+
+    if not finished:
+        print(f"⚠️ Timed out: only {recorder.handled}/{args.updates} updates were handled")
+    print(f"mode={args.mode} workers={args.workers} shards={args.shards} latency={args.latency * 1000:.0f}ms "
+          f"error_rate={args.error_rate} offered={args.updates / offered:.1f} updates/s")
+    print(f"handled {recorder.handled} updates in {elapsed:.2f}s: "
+          f"{recorder.handled / elapsed:.1f} updates/s, {outbound / elapsed:.1f} outbound calls/s "
+          f"({server.throttled} answered with 429)")
+    if pool is not None:
+        print(f"per shard: {pool.processed}")
+        return
+    report("Handler latency (time inside the callback)", recorder.handler_times)
+    report("End-to-end latency (queued on the fake API until handled)", recorder.end_to_end)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Per-call cost of a log line on the handler thread: direct StreamHandler vs the queued pipeline.
+
+The stream sleeps for --write-ms per write to stand in for a slow or
+back-pressured log sink (a full pipe, a remote collector).
+
+Usage: python benchmarks/logging_bench.py --write-ms 0 1 --calls 2000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_pipeline
+
+
+class SlowStream:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def per_call(logger, calls, lazy):
+    started = time.perf_counter()
+    for i in range(calls):
+        if lazy:
+            logger.info("Auto-reply sent for keyword '%s' to user %s", 'price', i)
+        else:
+            logger.info(f"Auto-reply sent for keyword '{'price'}' to user {i}")
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--write-ms', type=float, nargs='+', default=[0, 1])
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    logger = logging.getLogger('bench')
+    print(f"{'write ms':>9} {'direct (us)':>12} {'queued (us)':>12} {'sampled (us)':>13}")
+    for write_ms in args.write_ms:
+        stream = SlowStream(write_ms / 1000)
+        logging.basicConfig(stream=stream, format=log_pipeline.TEXT_FORMAT, level=logging.INFO, force=True)
+        direct = per_call(logger, args.calls, lazy=False)
+
+        # Unsampled: every record goes through the queue to the writer thread
+        pipeline = log_pipeline.LogPipeline(stream=stream, queue_size=args.calls * 2)
+        pipeline.handler.filters[0].rate = 0
+        pipeline.start()
+        queued = per_call(logger, args.calls, lazy=True)
+        pipeline.stop()
+
+        # Default sampling: past LOG_SAMPLE_RATE lines per second most records are dropped early
+        pipeline = log_pipeline.LogPipeline(stream=stream, queue_size=args.calls * 2).start()
+        sampled = per_call(logger, args.calls, lazy=True)
+        pipeline.stop()
+        root.handlers.clear()
+        print(f"{write_ms:>9} {direct * 1e6:>12.1f} {queued * 1e6:>12.1f} {sampled * 1e6:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Memory per message and feedback entry: the old dicts vs MessageRecord / FeedbackRecord.
+
+Entries mimic the handlers' output: a few hundred users with repeated names,
+ISO timestamps, one file message in ten.
+
+Usage: python benchmarks/record_memory_bench.py --records 200000
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import MessageRecord, FeedbackRecord
+
+START = 1767225600  # 2026-01-01T00:00:00Z
+
+
+def iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def message_dict(i, rng, users):
+    user_id = rng.randrange(users)
+    entry = {
+        # Built per update from Telegram's payload, so names are fresh strings every time
+        'user_id': user_id,
+        'user_name': ''.join(['User ', str(user_id)]),
+        'username': ''.join(['user_', str(user_id)]),
+        'message': f"message number {i}",
+        'message_type': 'file' if i % 10 == 0 else 'text',
+        'file_info': {'type': 'document', 'file_id': f"BQACAgI{i:012d}", 'file_name': f"report{i}.pdf",
+                      'file_size': 1024 + i, 'mime_type': 'application/pdf'} if i % 10 == 0 else None,
+        'timestamp': iso(START + i),
+    }
+    if i % 7 == 0:
+        entry['reply_to_bot'] = True
+    return entry
+
+
+def feedback_dict(i, rng, users):
+    user_id = rng.randrange(users)
+    return {
+        'user_id': user_id,
+        'user_name': ''.join(['User ', str(user_id)]),
+        'username': ''.join(['user_', str(user_id)]),
+        'rating': rng.randint(1, 5),
+        'comment': f"comment {i}",
+        'timestamp': iso(START + i),
+    }
+
+
+def measure(build, n, users):
+    rng = random.Random(1)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    entries = [build(i, rng, users) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return entries, (after - before) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=500)
+    args = parser.parse_args()
+
+    cases = (
+        ("messages", message_dict, lambda i, rng, users: MessageRecord.from_dict(message_dict(i, rng, users))),
+        ("feedback", feedback_dict, lambda i, rng, users: FeedbackRecord.from_dict(feedback_dict(i, rng, users))),
+    )
+    print(f"{args.records} records, {args.users} users")
+    print(f"{'':<10}{'dict (B)':>10}{'record (B)':>12}{'saved':>8}")
+    for label, as_dict, as_record in cases:
+        dicts, dict_bytes = measure(as_dict, args.records, args.users)
+        del dicts
+        records, record_bytes = measure(as_record, args.records, args.users)
+        del records
+        print(f"{label:<10}{dict_bytes:>10.0f}{record_bytes:>12.0f}{1 - record_bytes / dict_bytes:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
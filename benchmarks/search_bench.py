@@ -0,0 +1,90 @@
+"""Build, query, save and load times of SearchIndex, against a linear scan of the log.
+
+Messages are drawn from a Zipf-like vocabulary so there are both very common
+and rare terms, like real chat text.
+
+Usage: python benchmarks/search_bench.py --messages 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import MessageRecord
+from search_index import SearchIndex, tokenize, document_text
+
+START = 1767225600  # 2026-01-01T00:00:00Z
+
+
+def make_messages(count, vocabulary, users):
+    words = [f"w{i}" for i in range(vocabulary)]
+    # Cumulative weights once up front; plain weights are re-summed on every choices() call
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(vocabulary)))
+    messages = []
+    for i in range(count):
+        text = ' '.join(random.choices(words, cum_weights=cum_weights, k=random.randint(3, 20)))
+        messages.append(MessageRecord(
+            random.randrange(users), 'User', 'user', text, 'file' if i % 10 == 0 else 'text',
+            {'type': 'document', 'file_name': f"report{i}.pdf"} if i % 10 == 0 else None, START + i))
+    return messages
+
+
+def linear_scan(messages, query):
+    terms = set(tokenize(query))
+    return [i for i, entry in enumerate(messages) if terms <= set(tokenize(document_text(entry)))]
+
+
+def time_query(label, func, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = func()
+    elapsed = (time.perf_counter() - started) / repeat * 1000
+    print(f"  {label:<44}{elapsed:>9.2f} ms  ({len(results)} results)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+    random.seed(1)
+
+    messages = make_messages(args.messages, args.vocabulary, args.users)
+    index = SearchIndex()
+    started = time.perf_counter()
+    for position, entry in enumerate(messages):
+        index.add(position, entry)
+    print(f"Indexed {len(index)} messages in {time.perf_counter() - started:.1f}s")
+
+    print("Query latency (index):")
+    time_query("common term 'w0'", lambda: index.search('w0'))
+    time_query("mid term 'w500'", lambda: index.search('w500'))
+    time_query("rare term 'w40000'", lambda: index.search('w40000'))
+    time_query("two common terms 'w0 w1'", lambda: index.search('w0 w1'))
+    time_query("common + rare 'w0 w40000'", lambda: index.search('w0 w40000'))
+    time_query("file name 'report500'", lambda: index.search('report500'))
+    time_query("'w1' user filter", lambda: index.search('w1', user_id=42))
+    time_query("'w1' type:file since filter", lambda: index.search(
+        'w1', message_type='file', since=START + args.messages // 2))
+
+    print("Query latency (linear scan of the log):")
+    time_query("rare term 'w40000'", lambda: linear_scan(messages, 'w40000'), repeat=1)
+
+    path = os.path.join(tempfile.mkdtemp(), 'search_index.bin')
+    started = time.perf_counter()
+    index.save(path)
+    print(f"Saved in {time.perf_counter() - started:.2f}s ({os.path.getsize(path) / 1e6:.1f} MB)")
+    started = time.perf_counter()
+    loaded = SearchIndex.load(path)
+    print(f"Loaded in {time.perf_counter() - started:.2f}s, identical results: "
+          f"{loaded.search('w500 w3') == index.search('w500 w3')}")
+
+
+if __name__ == '__main__':
+    main()
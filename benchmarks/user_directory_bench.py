@@ -0,0 +1,128 @@
+"""Memory per user, @username lookup latency and broadcast segment resolution for UserDirectory.
+
+Usage: python benchmarks/user_directory_bench.py --users 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_directory import UserDirectory, RATING_OPS
+
+SEEN = 1767225600  # 2026-01-01T00:00:00Z
+
+
+def build_dict(n):
+    registry = {}
+    for user_id in range(n):
+        registry[user_id] = {
+            'user_name': f"User{user_id}",
+            'username': f"user_{user_id}",
+            'last_seen': '2026-01-01T00:00:00+00:00'
+        }
+    return registry
+
+
+def build_directory(n):
+    directory = UserDirectory()
+    for user_id in range(n):
+        directory.touch(user_id, f"User{user_id}", f"user_{user_id}", SEEN, count_message=True)
+    return directory
+
+
+def measure_memory(build, n):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    registry = build(n)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return registry, (after - before) / n
+
+
+def linear_lookup(registry, target):
+    username_to_find = target[1:].lower()
+    for user_id, user_info in registry.items():
+        if user_info.get('username') and user_info['username'].lower() == username_to_find:
+            return user_id
+    return None
+
+
+def segment_scan(directory, ratings, asked, since, op, value):
+    """The per-send filter the segment indexes replace: one pass over the whole registry"""
+    return {record.user_id for record in directory.values()
+            if record.last_seen >= since and record.user_id in asked
+            and record.user_id in ratings and RATING_OPS[op](ratings[record.user_id], value)}
+
+
+def bench_segments(directory, n, rng):
+    """Spread last_seen over 180 days, mark 20% as asked and rate 10%, then resolve segments"""
+    now = SEEN + 180 * 86400
+    ratings = {}
+    asked = set()
+    for user_id in range(n):
+        directory.touch(user_id, f"User{user_id}", f"user_{user_id}", SEEN + rng.randrange(180 * 86400))
+        if rng.random() < 0.2:
+            asked.add(user_id)
+            directory.mark_asked(user_id)
+        if rng.random() < 0.1:
+            ratings[user_id] = rng.randint(1, 5)
+            directory.rate(user_id, ratings[user_id])
+
+    for label, segment in (("--active 7d", {'active_within': 7 * 86400}),
+                           ("--active 30d", {'active_within': 30 * 86400}),
+                           ("--asked", {'asked': True}),
+                           ("--active 30d --asked --rated<=2",
+                            {'active_within': 30 * 86400, 'asked': True, 'rated': ('<=', 2)})):
+        started = time.perf_counter()
+        users = directory.segment(now=now, **segment)
+        elapsed = time.perf_counter() - started
+        print(f"segment {label:<32} {len(users):>8} users in {elapsed * 1e3:7.1f} ms")
+
+    started = time.perf_counter()
+    scanned = segment_scan(directory, ratings, asked, now - 30 * 86400, '<=', 2)
+    scan = time.perf_counter() - started
+    assert scanned == set(directory.segment(now=now, active_within=30 * 86400, asked=True, rated=('<=', 2)))
+    print(f"same last segment by scanning the registry: {scan * 1e3:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    parser.add_argument('--scan-lookups', type=int, default=20, help='lookups for the slow linear scan')
+    args = parser.parse_args()
+    n = args.users
+
+    registry, dict_bytes = measure_memory(build_dict, n)
+    directory, dir_bytes = measure_memory(build_directory, n)
+    print(f"memory per user: dict {dict_bytes:.0f} B, UserDirectory {dir_bytes:.0f} B (incl. username index)")
+
+    targets = [f"@USER_{random.randrange(n)}" for _ in range(args.lookups)]
+
+    started = time.perf_counter()
+    for target in targets[:args.scan_lookups]:
+        linear_lookup(registry, target)
+    scan = (time.perf_counter() - started) / args.scan_lookups
+
+    started = time.perf_counter()
+    for target in targets:
+        directory.find_by_username(target)
+    indexed = (time.perf_counter() - started) / len(targets)
+
+    print(f"@username lookup: linear scan {scan * 1e3:.2f} ms, indexed {indexed * 1e6:.2f} us")
+
+    # Username changes must keep the index consistent
+    directory.touch(0, "User0", "renamed_user", SEEN + 60)
+    assert directory.find_by_username("@user_0") is None
+    assert directory.find_by_username("@Renamed_User").user_id == 0
+    assert directory.get(0).first_seen == SEEN and directory.get(0).last_seen == SEEN + 60
+
+    bench_segments(directory, n, random.Random(7))
+
+
+if __name__ == '__main__':
+    main()
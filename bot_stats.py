@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+HOUR = 3600
+DAY = 86400
+# How many rollup buckets to keep
+HOURLY_BUCKETS = 7 * 24
+DAILY_BUCKETS = 90
+
+
+class StatsAggregator:
+    """Running message/feedback statistics updated on every write.
+
+    All reads are O(1) in the size of the history; the time-bucketed
+    rollups are bounded by HOURLY_BUCKETS and DAILY_BUCKETS.
+    """
+
+    def __init__(self):
+        self.total_messages = 0
+        self.total_feedback = 0
+        self.rating_sum = 0
+        self.rating_histogram = [0, 0, 0, 0, 0]  # counts for ratings 1..5
+        self._active_users = set()
+        self._hourly = OrderedDict()
+        self._daily = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def active_users(self):
+        """Number of distinct users who sent a message or feedback"""
+        return len(self._active_users)
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.total_feedback if self.total_feedback else None
+
+    def record_message(self, user_id, timestamp):
+        with self._lock:
+            self.total_messages += 1
+            self._active_users.add(user_id)
+            for bucket in self._buckets(timestamp):
+                bucket[0] += 1
+
+    def record_feedback(self, user_id, rating, timestamp):
+        with self._lock:
+            self.total_feedback += 1
+            self.rating_sum += rating
+            self.rating_histogram[rating - 1] += 1
+            self._active_users.add(user_id)
+            for bucket in self._buckets(timestamp):
+                bucket[1] += 1
+                bucket[2] += rating
+
+    def _buckets(self, timestamp):
+        """Return the hourly and daily [messages, feedback, rating_sum] rollups covering timestamp"""
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        return (
+            self._rollup(self._hourly, timestamp - timestamp % HOUR, HOURLY_BUCKETS),
+            self._rollup(self._daily, timestamp - timestamp % DAY, DAILY_BUCKETS)
+        )
+
+    @staticmethod
+    def _rollup(buckets, key, limit):
+        bucket = buckets.get(key)
+        if bucket is None:
+            late = bool(buckets) and key < next(reversed(buckets))
+            bucket = buckets[key] = [0, 0, 0]
+            if late:
+                # Late arrival: keep buckets ordered by time
+                for later in [k for k in buckets if k > key]:
+                    buckets.move_to_end(later)
+            while len(buckets) > limit:
+                buckets.popitem(last=False)
+        return bucket
+
+    def window(self, seconds, now=None):
+        """Totals over the last ``seconds`` (at hourly granularity)"""
+        now = int(now if now is not None else time.time())
+        cutoff = now - now % HOUR - (seconds // HOUR - 1) * HOUR
+        messages = feedback = rating_sum = 0
+        with self._lock:
+            for key in reversed(self._hourly):
+                if key < cutoff:
+                    break
+                bucket = self._hourly[key]
+                messages += bucket[0]
+                feedback += bucket[1]
+                rating_sum += bucket[2]
+        return messages, feedback, (rating_sum / feedback if feedback else None)
+
+    def snapshot(self, hours=24, days=7):
+        """JSON-friendly view of the aggregates, including recent rollups"""
+        with self._lock:
+            hourly = list(self._hourly.items())[-hours:]
+            daily = list(self._daily.items())[-days:]
+            return {
+                'total_messages': self.total_messages,
+                'total_feedback': self.total_feedback,
+                'active_users': len(self._active_users),
+                'average_rating': round(self.rating_sum / self.total_feedback, 2) if self.total_feedback else None,
+                'rating_histogram': {str(i + 1): count for i, count in enumerate(self.rating_histogram)},
+                'hourly': [self._format_bucket(key, bucket) for key, bucket in hourly],
+                'daily': [self._format_bucket(key, bucket) for key, bucket in daily]
+            }
+
+    @staticmethod
+    def _format_bucket(key, bucket):
+        messages, feedback, rating_sum = bucket
+        return {
+            'start': key,
+            'messages': messages,
+            'feedback': feedback,
+            'average_rating': round(rating_sum / feedback, 2) if feedback else None
+        }
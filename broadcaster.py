@@ -0,0 +1,307 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from telegram.error import RetryAfter, TimedOut, NetworkError, Unauthorized, BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second across all chats and
+# about one message per second to the same chat
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', '1.0'))
+PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '5'))
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by all sender threads"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given number of seconds (flood wait)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._last = self._paused_until
+
+
+class ChatLimiter:
+    """Enforces a minimum interval between two sends to the same chat"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def wait(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(chat_id, 0.0))
+            self._next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def release(self, chat_id):
+        """Forget a chat once all of its sends are done"""
+        with self._lock:
+            self._next_allowed.pop(chat_id, None)
+
+
+class BroadcastJob:
+    """Live progress of one broadcast"""
+
+    def __init__(self, title, total, job_id=None):
+        self.title = title
+        self.total = total
+        self.job_id = job_id
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.resumed = 0  # recipients already handled before this run
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def set_counts(self, sent, failed, retries):
+        """Overwrite the counters, for jobs whose sends are counted elsewhere"""
+        with self._lock:
+            self.sent, self.failed, self.retries = sent, failed, retries
+
+    def resume(self, sent, failed, retries):
+        """Carry over the counts of an earlier, interrupted run of this job"""
+        self.set_counts(sent, failed, retries)
+        self.resumed = sent + failed
+
+    def cancel(self):
+        """Stop sending; recipients not reached yet are skipped"""
+        self.cancelled.set()
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    @property
+    def status(self):
+        if self.cancelled.is_set():
+            return 'cancelled'
+        return 'done' if self.done.is_set() else 'running'
+
+    def progress_text(self):
+        """Human readable progress report for the admin"""
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        rate = (self.processed - self.resumed) / elapsed if elapsed > 0 else 0.0
+        percent = (self.processed * 100 // self.total) if self.total else 100
+        if self.cancelled.is_set():
+            status = "🛑 Cancelled" if self.done.is_set() else "🛑 Cancelling"
+        else:
+            status = "✅ Finished" if self.done.is_set() else "⏳ In progress"
+        title = f"{self.title} #{self.job_id}" if self.job_id is not None else self.title
+        text = (
+            f"📊 {title} Summary:\n\n"
+            f"{status} ({percent}%)\n"
+            f"✅ Successfully sent: {self.sent}\n"
+            f"❌ Failed: {self.failed}\n"
+            f"🔁 Retries: {self.retries}\n"
+            f"👥 Total users: {self.total}\n"
+            f"⚡ Rate: {rate:.1f} msg/s\n"
+            f"⏱ Elapsed: {int(elapsed)}s"
+        )
+        if self.cancelled.is_set():
+            text += f"\n⏸ Not sent: {self.total - self.processed}"
+        return text
+
+
+class BroadcastEngine:
+    """Sends broadcasts from a pool of sender threads under a global token bucket
+    plus per-chat limits, off the dispatcher thread."""
+
+    def __init__(self, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS,
+                 per_chat_interval=PER_CHAT_INTERVAL, progress_interval=PROGRESS_INTERVAL):
+        self.bucket = TokenBucket(rate)
+        self.chat_limiter = ChatLimiter(per_chat_interval)
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.active_jobs = []
+
+    def submit(self, title, recipients, steps, on_progress=None, on_done=None, job=None, on_delivered=None):
+        """Start a broadcast in the background and return its BroadcastJob.
+
+        Each recipient receives every callable in ``steps`` in order; a step is
+        called as ``step(chat_id)`` and performs exactly one Bot API call.
+        Pass ``job`` to run an existing (e.g. resumed) job; ``on_delivered(job,
+        chat_id, ok)`` is called once per recipient as soon as it is done.
+        """
+        recipients = list(recipients)
+        if job is None:
+            job = BroadcastJob(title, len(recipients))
+        self.active_jobs.append(job)
+        thread = threading.Thread(
+            target=self._run,
+            args=(job, recipients, steps, on_progress, on_done, on_delivered),
+            name='Broadcast'
+        )
+        thread.daemon = True
+        thread.start()
+        return job
+
+    def watch(self, job, on_progress=None, on_done=None):
+        """Report on a job whose recipients are delivered elsewhere (e.g. by shard
+        workers) exactly like submit() does, until job.done is set."""
+        self.active_jobs.append(job)
+        thread = threading.Thread(target=self._watch, args=(job, on_progress, on_done), name='BroadcastWatch')
+        thread.daemon = True
+        thread.start()
+        return job
+
+    def _watch(self, job, on_progress, on_done):
+        if on_progress is not None:
+            self._report(job, on_progress)
+        job.done.wait()
+        self._finish(job, None, on_done)
+
+    def _run(self, job, recipients, steps, on_progress, on_done, on_delivered):
+        reporter = None
+        if on_progress is not None:
+            reporter = threading.Thread(target=self._report, args=(job, on_progress), name='BroadcastProgress')
+            reporter.daemon = True
+            reporter.start()
+
+        try:
+            # Only a couple of recipients per sender are queued at a time, so a huge
+            # broadcast never holds a Future per recipient and cancelling stops it at once
+            slots = threading.BoundedSemaphore(self.workers * 2)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='BroadcastSender') as pool:
+                for chat_id in recipients:
+                    slots.acquire()
+                    if job.cancelled.is_set():
+                        slots.release()
+                        break
+                    future = pool.submit(self._deliver, job, chat_id, steps, on_delivered)
+                    future.add_done_callback(lambda _: slots.release())
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+            self._finish(job, reporter, on_done)
+
+    def _finish(self, job, reporter, on_done):
+        if job.finished_at is None:
+            job.finished_at = time.time()
+        self.active_jobs.remove(job)
+        if reporter is not None:
+            reporter.join()
+        logger.info("%s finished: %s/%s sent, %s failed", job.title, job.sent, job.total, job.failed)
+        if on_done is not None:
+            try:
+                on_done(job)
+            except Exception as e:
+                logger.error("Broadcast completion callback failed: %s", e)
+
+    def progress(self):
+        """Recipient counts across all running broadcasts"""
+        jobs = list(self.active_jobs)
+        sent = sum(job.sent for job in jobs)
+        failed = sum(job.failed for job in jobs)
+        return {
+            'sent': sent,
+            'failed': failed,
+            'pending': sum(job.total for job in jobs) - sent - failed
+        }
+
+    def _report(self, job, on_progress):
+        while not job.done.wait(self.progress_interval):
+            try:
+                on_progress(job)
+            except Exception as e:
+                logger.debug("Broadcast progress update failed: %s", e)
+
+    def _deliver(self, job, chat_id, steps, on_delivered=None):
+        if job.cancelled.is_set():
+            return
+        ok = False
+        try:
+            for step in steps:
+                self._send(job, chat_id, step)
+            ok = True
+        except Exception as e:
+            logger.warning("Failed to send broadcast to user %s: %s", chat_id, e)
+        finally:
+            self.chat_limiter.release(chat_id)
+        job.record(ok)
+        if on_delivered is not None:
+            try:
+                on_delivered(job, chat_id, ok)
+            except Exception as e:
+                logger.error("Failed to checkpoint broadcast delivery to %s: %s", chat_id, e)
+
+    def _send(self, job, chat_id, step):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.chat_limiter.wait(chat_id)
+            try:
+                return step(chat_id)
+            except RetryAfter as e:
+                # Flood wait applies to the whole bot, so every sender backs off
+                logger.warning("Flood limit hit, pausing broadcast for %ss", e.retry_after)
+                self.bucket.pause(float(e.retry_after))
+            except (Unauthorized, BadRequest):
+                # User blocked the bot or chat is gone; retrying will not help
+                raise
+            except (TimedOut, NetworkError):
+                if attempt >= MAX_RETRIES:
+                    raise
+                time.sleep(2 ** attempt)
+            attempt += 1
+            job.record_retry()
+            if attempt > MAX_RETRIES * 4:
+                raise RuntimeError(f"giving up after {attempt} attempts")
+
+
+def bot_steps(bot, specs):
+    """Turn (bot_method_name, kwargs) specs into broadcast steps for BroadcastEngine.
+
+    Specs are plain data, so a broadcast can be handed to another process.
+    """
+    return [
+        lambda chat_id, method=getattr(bot, name), kwargs=kwargs: method(chat_id=chat_id, **kwargs)
+        for name, kwargs in specs
+    ]
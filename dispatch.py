@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from queue import Queue
+from telegram import Update
+from telegram.ext import Dispatcher, JobQueue, Updater, ExtBot
+from metrics import InstrumentedRequest
+
+logger = logging.getLogger(__name__)
+
+# Dispatch configuration
+DISPATCH_MODE = os.getenv('DISPATCH_MODE', 'sequential')  # 'sequential' or 'concurrent'
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '8'))
+DISPATCH_QUEUE_DEPTH = int(os.getenv('DISPATCH_QUEUE_DEPTH', '256'))
+
+
+class ProgressQueue(Queue):
+    """Update queue that remembers when the dispatcher last finished with an update.
+
+    The dispatcher calls task_done() once per update it has processed (or
+    handed to its workers), so last_done only advances while it makes progress.
+    """
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.last_done = None
+        self.done = 0
+
+    def task_done(self):
+        super().task_done()
+        self.last_done = time.time()
+        self.done += 1
+
+
+class KeyedExecutor:
+    """Bounded worker pool that runs tasks sharing a key strictly one after another.
+
+    Tasks with different keys run in parallel; tasks with the same key run in
+    submission order and never overlap. submit() blocks once max_pending tasks
+    are waiting, which pushes back on the producer.
+    """
+
+    def __init__(self, workers=DISPATCH_WORKERS, max_pending=DISPATCH_QUEUE_DEPTH, name='DispatchWorker'):
+        self.workers = workers
+        self._pending = {}  # key -> deque of tasks; present while the key is queued or running
+        self._ready = Queue()
+        self._slots = threading.Semaphore(max_pending)
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f'{name}_{i}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def depth(self):
+        """Number of tasks submitted but not yet finished"""
+        return self._depth
+
+    def submit(self, key, fn, *args):
+        self._slots.acquire()
+        with self._lock:
+            self._depth += 1
+            tasks = self._pending.get(key)
+            if tasks is None:
+                self._pending[key] = deque([(fn, args)])
+                self._ready.put(key)
+            else:
+                tasks.append((fn, args))
+
+    def shutdown(self):
+        """Finish queued tasks and stop the worker threads"""
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                fn, args = self._pending[key].popleft()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Unhandled error while processing task for %s", key)
+            finally:
+                with self._lock:
+                    self._depth -= 1
+                    if self._pending[key]:
+                        # More work for this key: requeue it behind other keys
+                        self._ready.put(key)
+                    else:
+                        del self._pending[key]
+                self._slots.release()
+
+
+class OrderedDispatcher(Dispatcher):
+    """Dispatcher that processes updates from different chats in parallel while
+    keeping updates from the same chat in order."""
+
+    def __init__(self, *args, executor=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = executor or KeyedExecutor()
+
+    def process_update(self, update):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            # Polling errors and chat-less updates are handled inline
+            return super().process_update(update)
+        self.executor.submit(chat.id, super().process_update, update)
+
+    def stop(self):
+        super().stop()
+        self.executor.shutdown()
+
+
+def create_bot(token, workers=DISPATCH_WORKERS, base_url=None):
+    """Bot with a connection pool sized for the dispatch workers"""
+    # One connection per worker plus the usual spare ones for polling and jobs;
+    # InstrumentedRequest records every outbound Bot API call for /metrics
+    return ExtBot(token, request=InstrumentedRequest(con_pool_size=workers + 4),
+                  **({'base_url': base_url} if base_url else {}))
+
+
+def create_updater(token, mode=DISPATCH_MODE, workers=DISPATCH_WORKERS, queue_depth=DISPATCH_QUEUE_DEPTH,
+                   base_url=None):
+    """Build an Updater for the configured dispatch mode.
+
+    base_url points the bot at another Bot API endpoint, e.g. the local fake
+    server used by the benchmarks.
+    """
+    if mode not in ('sequential', 'concurrent'):
+        raise ValueError(f"Unknown dispatch mode: {mode}")
+
+    bot = create_bot(token, workers, base_url)
+    job_queue = JobQueue()
+    if mode == 'sequential':
+        # What Updater(bot=bot) would build, but with a ProgressQueue
+        dispatcher = Dispatcher(
+            bot,
+            ProgressQueue(),
+            job_queue=job_queue,
+            exception_event=threading.Event(),
+            use_context=True
+        )
+    else:
+        dispatcher = OrderedDispatcher(
+            bot,
+            ProgressQueue(),
+            job_queue=job_queue,
+            exception_event=threading.Event(),
+            use_context=True,
+            executor=KeyedExecutor(workers, queue_depth)
+        )
+        logger.info("Concurrent dispatch enabled: %s workers, queue depth %s", workers, queue_depth)
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)
@@ -0,0 +1,120 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Exports up to this size stay in memory; larger ones roll over to a temporary file
+EXPORT_SPOOL_BYTES = int(os.getenv('EXPORT_SPOOL_BYTES', str(8 * 1024 * 1024)))
+# Bots may upload documents of at most 50 MB
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+MESSAGE_FIELDS = ('number', 'timestamp', 'user_id', 'username', 'user_name', 'message_type', 'message',
+                  'file_type', 'file_name', 'file_size', 'mime_type', 'file_id', 'reply_to_bot')
+FEEDBACK_FIELDS = ('number', 'timestamp', 'user_id', 'username', 'user_name', 'rating', 'comment')
+
+
+def message_rows(message_log, positions):
+    """Yield flat export rows for the given message_log positions, one at a time"""
+    for position in positions:
+        entry = message_log[position]
+        file_info = entry.get('file_info') or {}
+        yield {
+            'number': position + 1,
+            'timestamp': entry.get('timestamp'),
+            'user_id': entry['user_id'],
+            'username': entry.get('username'),
+            'user_name': entry.get('user_name'),
+            'message_type': entry.get('message_type', 'text'),
+            'message': entry.get('message'),
+            'file_type': file_info.get('type'),
+            'file_name': file_info.get('file_name'),
+            'file_size': file_info.get('file_size'),
+            'mime_type': file_info.get('mime_type'),
+            'file_id': file_info.get('file_id'),
+            'reply_to_bot': bool(entry.get('reply_to_bot')),
+        }
+
+
+def feedback_rows(feedback_log, user_id=None, since=None, until=None):
+    """Yield flat export rows for feedback entries matching the filters"""
+    # Iterate a snapshot of the length so feedback arriving mid-export is left out
+    for index in range(len(feedback_log)):
+        entry = feedback_log[index]
+        if user_id is not None and entry['user_id'] != user_id:
+            continue
+        if since is not None or until is not None:
+            timestamp = entry.time or 0
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp >= until:
+                continue
+        yield {
+            'number': index + 1,
+            'timestamp': entry.get('timestamp'),
+            'user_id': entry['user_id'],
+            'username': entry.get('username'),
+            'user_name': entry.get('user_name'),
+            'rating': entry.get('rating'),
+            'comment': entry.get('comment'),
+        }
+
+
+class ExportResult:
+    """A finished export: the compressed file rewound to its start, plus its stats"""
+
+    def __init__(self, file, rows, size, elapsed):
+        self.file = file
+        self.rows = rows
+        self.size = size
+        self.elapsed = elapsed
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def close(self):
+        self.file.close()
+
+
+def export_rows(rows, fields, fmt, spool_bytes=EXPORT_SPOOL_BYTES):
+    """Stream rows into a gzip-compressed CSV or JSONL file and return an ExportResult.
+
+    Rows are consumed one at a time and written straight through the
+    compressor, so memory use does not grow with the number of rows.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    started = time.perf_counter()
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+    count = 0
+    try:
+        with gzip.GzipFile(fileobj=spool, mode='wb') as compressed:
+            text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+            if fmt == 'csv':
+                writer = csv.DictWriter(text, fieldnames=fields)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    text.write(json.dumps(row, ensure_ascii=False))
+                    text.write('\n')
+                    count += 1
+            text.flush()
+            # Leave the spool open for the caller; closing the wrapper would close it too
+            text.detach()
+    except Exception:
+        spool.close()
+        raise
+    size = spool.tell()
+    spool.seek(0)
+    return ExportResult(spool, count, size, time.perf_counter() - started)
@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Allowed updates per user as <kind>=<count>/<seconds>: up to count at once,
+# refilling at count per seconds. Kinds are command names, 'text', 'file',
+# 'callback' and 'default' for anything else.
+DEFAULT_LIMITS = 'start=3/60,help=3/60,ask=5/60,feedback=3/300,file=5/60,text=10/60,callback=30/60,default=20/60'
+FLOOD_LIMITS = os.getenv('FLOOD_LIMITS', DEFAULT_LIMITS)
+# Users whose buckets are kept; the least recently seen are forgotten first
+FLOOD_TRACKED_USERS = int(os.getenv('FLOOD_TRACKED_USERS', '10000'))
+
+flood_dropped = metrics.registry.family(
+    'bot_flood_dropped_total', 'Updates dropped by the per-user flood limit', 'counter', ('kind',))
+
+
+def parse_limits(spec):
+    """Parse 'kind=count/seconds,...' into {kind: (rate per second, burst)}"""
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        kind, _, limit = item.partition('=')
+        count, _, seconds = limit.partition('/')
+        count, seconds = float(count), float(seconds or 1)
+        if count <= 0 or seconds <= 0:
+            raise ValueError(f"Invalid flood limit '{item}'")
+        limits[kind.strip().lower()] = (count / seconds, count)
+    limits.setdefault('default', (20 / 60, 20))
+    return limits
+
+
+class FloodGuard:
+    """Per-user token buckets, one per kind of update, in a bounded LRU.
+
+    Each tracked user costs one small dict of [tokens, last_refill, warned]
+    lists, and at most max_users users are tracked, so memory stays flat no
+    matter how many distinct senders show up.
+    """
+
+    def __init__(self, limits=FLOOD_LIMITS, max_users=FLOOD_TRACKED_USERS):
+        self.limits = parse_limits(limits) if isinstance(limits, str) else dict(limits)
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> {kind: [tokens, last_refill, warned]}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def allow(self, user_id, kind):
+        """Take a token for this user and kind.
+
+        Returns (allowed, warn): warn is True for the first dropped update of
+        a flood, so the user is told once instead of on every message. Kinds
+        without a limit of their own share the 'default' bucket, so arbitrary
+        /commands cannot add buckets or metric labels.
+        """
+        kind = kind if kind in self.limits else 'default'
+        rate, burst = self.limits[kind]
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._users.get(user_id)
+            if buckets is None:
+                buckets = self._users[user_id] = {}
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            bucket = buckets.get(kind)
+            if bucket is None:
+                bucket = buckets[kind] = [burst, now, False]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                return True, False
+            warn = not bucket[2]
+            bucket[2] = True
+        flood_dropped.inc(kind)
+        return False, warn
+
+    def dropped(self):
+        """Dropped update counts by kind"""
+        return dict((labels[0], count) for labels, count in flood_dropped.children.items())
+
+
+def update_kind(update):
+    """Classify an update for flood limits: command name, 'text', 'file' or 'callback'"""
+    if update.callback_query is not None:
+        return 'callback'
+    message = update.effective_message
+    if message is None:
+        return 'default'
+    text = message.text or message.caption or ''
+    if text.startswith('/'):
+        # '/ask@my_bot hello' -> 'ask'
+        command = text[1:].split(maxsplit=1)
+        return command[0].split('@', 1)[0].lower() if command else 'default'
+    if message.effective_attachment is not None:
+        return 'file'
+    return 'text' if message.text else 'default'
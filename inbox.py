@@ -0,0 +1,145 @@
+import bisect
+import threading
+
+# Status codes, as stored in the messages table; 0 marks a position not logged yet
+STATUS_OPEN = 1
+STATUS_ANSWERED = 2
+STATUS_DISMISSED = 3
+STATUS_NAMES = {STATUS_OPEN: 'open', STATUS_ANSWERED: 'answered', STATUS_DISMISSED: 'dismissed'}
+
+
+def _remove(positions, position):
+    index = bisect.bisect_left(positions, position)
+    if index < len(positions) and positions[index] == position:
+        del positions[index]
+
+
+class Inbox:
+    """Status of every logged message by message_log position, with indexes of the open ones.
+
+    Statuses are one byte per position, so looking one up or changing it is
+    O(1). Open messages are also kept in a sorted list and in sorted lists
+    per user, so counts are O(1) and listing the open ones never touches
+    answered or dismissed history.
+    """
+
+    def __init__(self):
+        self._status = bytearray()
+        self._open = []  # sorted positions of open messages
+        self._open_users = {}  # position -> user_id, for open messages
+        self._by_user = {}  # user_id -> sorted positions of that user's open messages
+        self._counts = dict.fromkeys(STATUS_NAMES, 0)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of open messages"""
+        return len(self._open)
+
+    def _grow(self, position):
+        if position >= len(self._status):
+            self._status.extend(bytes(position + 1 - len(self._status)))
+
+    def load(self, rows):
+        """Apply persisted (position, status) pairs of messages that are no longer open.
+
+        Call before the messages themselves are added, so they never enter the
+        open indexes.
+        """
+        with self._lock:
+            for position, status in rows:
+                if status in STATUS_NAMES:
+                    self._grow(position)
+                    self._status[position] = status
+
+    def add(self, position, user_id):
+        """Track a logged message; it is open unless load() gave it another status"""
+        with self._lock:
+            self._grow(position)
+            status = self._status[position] or STATUS_OPEN
+            self._status[position] = status
+            self._counts[status] += 1
+            if status == STATUS_OPEN:
+                self._open_users[position] = user_id
+                if not self._open or position > self._open[-1]:
+                    self._open.append(position)
+                else:
+                    # Restored history arrives after newer messages
+                    bisect.insort(self._open, position)
+                positions = self._by_user.setdefault(user_id, [])
+                if not positions or position > positions[-1]:
+                    positions.append(position)
+                else:
+                    bisect.insort(positions, position)
+
+    def status(self, position):
+        """'open', 'answered' or 'dismissed', or None for a position not logged yet"""
+        if 0 <= position < len(self._status):
+            return STATUS_NAMES.get(self._status[position])
+        return None
+
+    def counts(self):
+        """Number of messages by status name"""
+        with self._lock:
+            return {STATUS_NAMES[status]: count for status, count in self._counts.items()}
+
+    def _set(self, position, status):
+        previous = self._status[position]
+        if previous == status:
+            return False
+        self._status[position] = status
+        self._counts[previous] -= 1
+        self._counts[status] += 1
+        if previous == STATUS_OPEN:
+            user_id = self._open_users.pop(position)
+            _remove(self._open, position)
+            positions = self._by_user[user_id]
+            _remove(positions, position)
+            if not positions:
+                del self._by_user[user_id]
+        return True
+
+    def set_status(self, positions, status):
+        """Move logged messages to status; returns the positions that changed.
+
+        Reopening is not supported: only open messages can be closed, and
+        closed ones can switch between answered and dismissed.
+        """
+        if status not in (STATUS_ANSWERED, STATUS_DISMISSED):
+            raise ValueError(f"Cannot move messages to status {status}")
+        changed = []
+        with self._lock:
+            for position in positions:
+                if not 0 <= position < len(self._status) or not self._status[position]:
+                    continue
+                if self._set(position, status):
+                    changed.append(position)
+        return changed
+
+    def close_user(self, user_id, status, upto=None):
+        """Close a user's open messages before position upto (all if None); returns the positions"""
+        with self._lock:
+            positions = self._by_user.get(user_id, [])
+            end = bisect.bisect_left(positions, upto) if upto is not None else len(positions)
+            closing = positions[:end]
+            for position in closing:
+                self._set(position, status)
+        return closing
+
+    def open_positions(self, user_id=None):
+        """Positions of open messages, oldest first, optionally of one user only"""
+        with self._lock:
+            if user_id is not None:
+                return list(self._by_user.get(user_id, ()))
+            return list(self._open)
+
+    def open_users(self, upto=None):
+        """{user_id: number of open messages} for users with open messages before upto"""
+        with self._lock:
+            if upto is None:
+                return {user_id: len(positions) for user_id, positions in self._by_user.items()}
+            users = {}
+            for user_id, positions in self._by_user.items():
+                count = bisect.bisect_left(positions, upto)
+                if count:
+                    users[user_id] = count
+            return users
@@ -1,4 +1,9 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
+from telegram import Update
+from werkzeug.serving import make_server
+from startup_profile import profile as startup_profile
+import metrics
+import hmac
 import threading
 import time
 import os
@@ -11,71 +16,205 @@ app = Flask(__name__)
 # Configure Flask logging to match bot logging
 app.logger.setLevel(logging.INFO)
 
-# Global variables to track bot status
-bot_status = {
-    'started_at': None,
-    'last_update': None,
-    'total_users': 0,
-    'total_messages': 0,
-    'status': 'starting'
+class BotStatus:
+    """Bot status shared by handler threads, the watchdog and Flask request threads.
+
+    Writers update fields under a lock and readers take a consistent snapshot.
+    Liveness comes from real progress: last_poll is the last successful
+    getUpdates and last_processed the last update the dispatcher finished.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {
+            'started_at': None,
+            'last_update': None,  # last change to any of these fields
+            'last_poll': None,
+            'last_processed': None,
+            'total_users': 0,
+            'total_messages': 0,
+            'status': 'starting',
+            'ready': False,  # set once the bot has started receiving updates
+            'stalled': None,  # why the watchdog considers the bot stalled, if it does
+            'restarts': 0,
+            'last_error': None
+        }
+
+    def update(self, **fields):
+        with self._lock:
+            self._values.update(fields)
+            self._values['last_update'] = time.time()
+
+    def increment(self, field, amount=1):
+        with self._lock:
+            self._values[field] += amount
+            self._values['last_update'] = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def __getitem__(self, field):
+        with self._lock:
+            return self._values[field]
+
+
+bot_status = BotStatus()
+
+# Keep-alive server state; started is set once binding succeeded or every port failed
+server = {'thread': None, 'port': None}
+server_started = threading.Event()
+
+# Callable returning aggregated bot statistics for /health
+stats_provider = None
+
+# Webhook ingestion target, set by enable_webhook()
+webhook = {
+    'bot': None,
+    'update_queue': None,
+    'secret_token': None,
+    'received': 0,
+    'rejected': 0
 }
+WEBHOOK_PATH = '/telegram'
+
+def _age(timestamp, now):
+    return round(now - timestamp, 1) if timestamp else None
 
 @app.route('/')
 def home():
     """Health check endpoint with detailed status"""
+    current = bot_status.snapshot()
     return jsonify({
         'status': 'alive',
         'message': 'Telegram Bot Keep-Alive Server',
         'timestamp': datetime.now().isoformat(),
-        'uptime_seconds': int(time.time() - bot_status['started_at']) if bot_status['started_at'] else 0,
-        'bot_status': bot_status['status']
+        'uptime_seconds': int(time.time() - current['started_at']) if current['started_at'] else 0,
+        'bot_status': current['status']
     })
 
+def _health_state(current):
+    """'stalled' while the watchdog sees a stall, 'ready' once serving, else 'starting'"""
+    if current['stalled']:
+        return 'stalled'
+    if current['ready'] and server['port'] is not None:
+        return 'ready'
+    return 'starting'
+
 @app.route('/health')
 def health():
-    """Detailed health check endpoint"""
-    uptime = int(time.time() - bot_status['started_at']) if bot_status['started_at'] else 0
+    """Detailed health check endpoint; always 200, the state is in the body (see /ready)"""
+    current = bot_status.snapshot()
+    now = time.time()
+    uptime = int(now - current['started_at']) if current['started_at'] else 0
+    state = _health_state(current)
     return jsonify({
-        'status': 'healthy',
-        'bot_status': bot_status['status'],
+        'status': state,
+        'stalled_reason': current['stalled'],
+        'bot_status': current['status'],
         'uptime_seconds': uptime,
         'uptime_human': f"{uptime // 3600}h {(uptime % 3600) // 60}m {uptime % 60}s",
-        'started_at': bot_status['started_at'],
-        'last_update': bot_status['last_update'],
-        'total_users': bot_status['total_users'],
-        'total_messages': bot_status['total_messages'],
-        'environment': 'production' if os.getenv('REPL_ID') else 'development'
+        'started_at': current['started_at'],
+        'last_update': current['last_update'],
+        'last_poll': current['last_poll'],
+        'last_poll_age_seconds': _age(current['last_poll'], now),
+        'last_processed': current['last_processed'],
+        'last_processed_age_seconds': _age(current['last_processed'], now),
+        'updater_restarts': current['restarts'],
+        'last_error': current['last_error'],
+        'total_users': current['total_users'],
+        'total_messages': current['total_messages'],
+        'stats': stats_provider() if stats_provider else None,
+        'update_mode': 'webhook' if webhook['update_queue'] is not None else 'polling',
+        'webhook_received': webhook['received'],
+        'webhook_rejected': webhook['rejected'],
+        'environment': 'production' if os.getenv('REPL_ID') else 'development',
+        'startup': startup_profile.snapshot()
     })
 
+@app.route('/ready')
+def ready():
+    """Readiness endpoint: 200 when ready, 503 while starting or stalled"""
+    current = bot_status.snapshot()
+    state = _health_state(current)
+    return jsonify({
+        'status': state,
+        'stalled_reason': current['stalled'],
+        'bot_status': current['status']
+    }), 200 if state == 'ready' else 503
+
 @app.route('/status')
 def status():
     """Simple status endpoint for monitoring"""
+    current = bot_status.snapshot()
     return {
-        'alive': True,
-        'status': bot_status['status'],
-        'uptime': int(time.time() - bot_status['started_at']) if bot_status['started_at'] else 0
+        'alive': current['stalled'] is None,
+        'status': current['status'],
+        'uptime': int(time.time() - current['started_at']) if current['started_at'] else 0
     }
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/ping')
 def ping():
     """Simple ping endpoint"""
     return 'pong'
 
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Receive a Telegram update, validate it and hand it to the dispatcher"""
+    if webhook['update_queue'] is None:
+        return 'Webhook mode is not enabled', 404
+
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token, webhook['secret_token']):
+        webhook['rejected'] += 1
+        return 'Forbidden', 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('update_id'), int):
+        webhook['rejected'] += 1
+        return 'Invalid update', 400
+
+    try:
+        update = Update.de_json(data, webhook['bot'])
+    except Exception as e:
+        webhook['rejected'] += 1
+        app.logger.warning("Rejected malformed update: %s", e)
+        return 'Invalid update', 400
+
+    # Enqueue and return immediately; the dispatcher does the actual work
+    webhook['update_queue'].put(update)
+    webhook['received'] += 1
+    return '', 200
+
 def update_bot_status(status=None, users=None, messages=None):
     """Update bot status information"""
-    global bot_status
-    
+    fields = {}
     if status:
-        bot_status['status'] = status
+        fields['status'] = status
     if users is not None:
-        bot_status['total_users'] = users
+        fields['total_users'] = users
     if messages is not None:
-        bot_status['total_messages'] = messages
-    
-    bot_status['last_update'] = time.time()
+        fields['total_messages'] = messages
+    bot_status.update(**fields)
+
+def enable_webhook(bot, update_queue, secret_token):
+    """Start accepting updates on WEBHOOK_PATH for the given dispatcher queue"""
+    webhook['bot'] = bot
+    webhook['secret_token'] = secret_token
+    webhook['update_queue'] = update_queue
 
-def run():
-    """Run the Flask server with enhanced configuration"""
+def set_stats_provider(provider):
+    """Register a callable whose result is included in /health"""
+    global stats_provider
+    stats_provider = provider
+
+def run(started_at):
+    """Bind the Flask server to the first free port and serve until the process exits"""
     try:
         # Disable Flask request logging in production to reduce noise
         if os.getenv('REPL_ID'):
@@ -83,18 +222,12 @@ def run():
         
         # Try different ports if 8080 is occupied
         ports_to_try = [8080, 8081, 8082, 8083, 8084]
-        server_started = False
+        http_server = None
         
         for port in ports_to_try:
             try:
-                app.run(
-                    host='0.0.0.0', 
-                    port=port, 
-                    debug=False,
-                    threaded=True,  # Enable threading for better performance
-                    use_reloader=False  # Disable reloader to prevent conflicts
-                )
-                server_started = True
+                # Binding happens here, so once this returns the server is reachable
+                http_server = make_server('0.0.0.0', port, app, threaded=True)
                 break
             except OSError as port_error:
                 if "Address already in use" in str(port_error):
@@ -103,52 +236,50 @@ def run():
                 else:
                     raise port_error
         
-        if not server_started:
+        if http_server is None:
             print("Could not start keep-alive server on any available port")
+            return
+        
+        server['port'] = port
+        startup_profile.record('keep_alive_server', time.perf_counter() - started_at)
+        server_started.set()
+        print(f"🚀 Keep-alive server started on port {port}")
+        print(f"📊 Health check available at: http://localhost:{port}/health")
+        print(f"🚦 Readiness endpoint: http://localhost:{port}/ready")
+        print(f"🔍 Status endpoint: http://localhost:{port}/status")
+        http_server.serve_forever()
             
     except Exception as e:
         print(f"Keep-alive server error: {e}")
+    finally:
+        # Never leave wait_until_serving() hanging when the server could not start
+        server_started.set()
 
 def keep_alive():
-    """Start the Flask server in a separate daemon thread for 24/7 operation"""
-    global bot_status
-    
+    """Start the Flask server in a separate daemon thread for 24/7 operation.
+
+    Returns immediately; wait_until_serving() tells when the server is reachable.
+    """
     # Initialize bot status
-    bot_status['started_at'] = time.time()
-    bot_status['status'] = 'initializing'
+    bot_status.update(started_at=time.time(), status='initializing')
     
     # Create and start the keep-alive thread
-    server_thread = threading.Thread(target=run, name='KeepAliveServer')
+    server_thread = threading.Thread(target=run, args=(time.perf_counter(),), name='KeepAliveServer')
     server_thread.daemon = True  # Daemon thread dies when main thread dies
+    server['thread'] = server_thread
     server_thread.start()
-    
-    print("🚀 Keep-alive server started on port 8080")
-    print("📊 Health check available at: http://localhost:8080/health")
-    print("🔍 Status endpoint: http://localhost:8080/status")
-    
-    # Small delay to ensure server starts
-    time.sleep(0.5)
-    
     return server_thread
 
-def heartbeat():
-    """Send periodic heartbeat to update last_update timestamp"""
-    def _heartbeat():
-        while True:
-            try:
-                bot_status['last_update'] = time.time()
-                # Send heartbeat every 30 seconds
-                time.sleep(30)
-            except Exception as e:
-                print(f"Heartbeat error: {e}")
-                time.sleep(30)
-    
-    heartbeat_thread = threading.Thread(target=_heartbeat, name='Heartbeat')
-    heartbeat_thread.daemon = True
-    heartbeat_thread.start()
-    
-    return heartbeat_thread
+def wait_until_serving(timeout=None):
+    """Block until the keep-alive server accepts connections.
+
+    Returns False if it was never started or could not bind any port.
+    """
+    if server['thread'] is None:
+        return False
+    server_started.wait(timeout)
+    return server['port'] is not None
 
 def set_bot_ready():
     """Mark bot as ready and running"""
-    update_bot_status('running')
+    bot_status.update(status='running', ready=True)
@@ -0,0 +1,187 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# 'json' writes one JSON object per line; 'text' keeps the classic single-line format
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Records waiting for the writer thread; beyond this new records are dropped, never waited on
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Info and debug lines per second each call site may emit before it is sampled
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '20'))
+# Once over its rate, a call site keeps one line in this many
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '100'))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Attributes every LogRecord has; anything else on a record came from extra= or the context
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Records dropped before reaching the writer, by reason ('sampled' or 'queue_full')
+dropped = {'sampled': 0, 'queue_full': 0}
+
+# Handler currently running on this thread, set by metrics.instrument
+_context = threading.local()
+
+
+def count_dropped(reason):
+    # A plain increment; an occasional lost count under contention is acceptable here
+    dropped[reason] += 1
+
+
+def enter_handler(name, update):
+    """Tag log records from this thread with the handler, its update and start time"""
+    _context.handler = name
+    _context.update = update
+    _context.started = time.perf_counter()
+
+
+def exit_handler():
+    _context.handler = None
+    _context.update = None
+
+
+class SamplingFilter(logging.Filter):
+    """Rate-limits info and debug records per call site; warnings and errors always pass.
+
+    Each call site (file and line) may emit LOG_SAMPLE_RATE records per second
+    in bursts of up to that many; past that only every sample_every-th record
+    is kept, carrying a 'sampled' count of the records it stands for.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE, sample_every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.rate = rate
+        self.sample_every = max(1, sample_every)
+        self._sites = {}  # (pathname, lineno) -> [tokens, last_refill, skipped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [self.rate, now, 0]
+            site[0] = min(self.rate, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] >= 1:
+                site[0] -= 1
+                return True
+            site[2] += 1
+            if site[2] < self.sample_every:
+                skipped = None
+            else:
+                skipped, site[2] = site[2], 0
+        if skipped is None:
+            count_dropped('sampled')
+            return False
+        record.sampled = skipped
+        return True
+
+
+class ContextFilter(logging.Filter):
+    """Adds handler, update_id, user_id and latency_ms of the running handler to records.
+
+    Runs on the logging thread before the record is queued, since the context
+    is thread-local; user ids are only looked up for records that are kept.
+    """
+
+    def filter(self, record):
+        handler = getattr(_context, 'handler', None)
+        if handler is None:
+            return True
+        record.handler = handler
+        record.latency_ms = round((time.perf_counter() - _context.started) * 1000, 2)
+        update = _context.update
+        if update is not None:
+            record.update_id = getattr(update, 'update_id', None)
+            user = getattr(update, 'effective_user', None)
+            if user is not None:
+                record.user_id = user.id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message plus any extra fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, without formatting, and drops them when the queue is full.
+
+    The stdlib QueueHandler merges msg and args on the calling thread; here
+    that is left to the writer thread, so a %-style logger call on a handler
+    costs little more than creating the record. Arguments must therefore not
+    be mutated after logging them.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            count_dropped('queue_full')
+
+
+class BlockingSentinelListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue instead of failing"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Root logging through a bounded queue drained by a single background writer thread"""
+
+    def __init__(self, stream=None, fmt=LOG_FORMAT, level=LOG_LEVEL, queue_size=LOG_QUEUE_SIZE):
+        self.queue = queue.Queue(queue_size)
+        writer = logging.StreamHandler(stream or sys.stderr)
+        writer.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+        self.handler = LazyQueueHandler(self.queue)
+        self.handler.addFilter(SamplingFilter())
+        self.handler.addFilter(ContextFilter())
+        self.listener = BlockingSentinelListener(self.queue, writer, respect_handler_level=True)
+        self.level = level
+
+    def start(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+
+def setup_logging(**kwargs):
+    """Route all logging through a LogPipeline; returns the started pipeline"""
+    return LogPipeline(**kwargs).start()
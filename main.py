@@ -1,27 +1,217 @@
+# Imported first so the startup profile can time every import below
+from startup_profile import profile as startup_profile
+startup_profile.start_import_timing()
+
 import logging
 import os
+import sys
+import itertools
+import threading
 import time
-from telegram import Update
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
+from collections import OrderedDict
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, Filters, CallbackContext, DispatcherHandlerStop
+import io
 import json
-from keep_alive import keep_alive, heartbeat, set_bot_ready, update_bot_status  # Import keep_alive functions
+import secrets
+from keep_alive import keep_alive, wait_until_serving, bot_status, set_bot_ready, update_bot_status, set_stats_provider, enable_webhook, WEBHOOK_PATH  # Import keep_alive functions
+from broadcaster import BroadcastEngine, BroadcastJob, bot_steps, BROADCAST_RATE
+from notifier import AdminNotifier, ADMIN_CHAT_RATE
+from flood_control import FloodGuard, update_kind
+from storage import MemoryStorage, create_storage, STORAGE_BACKEND
+from message_archive import MessageArchive
+from user_directory import UserDirectory, parse_segment, describe_segment
+from bot_stats import StatsAggregator
+from reply_matcher import ReplyMatcher
+from dispatch import create_updater
+from updater_watchdog import UpdaterWatchdog
+from sharding import SHARD_WORKERS, SHARD_FOLLOW_INTERVAL, ShardPool, create_sharded_updater, serve_shard, shard_of
+import metrics
+import log_pipeline
+from profiler import handler_profiler, MAX_PROFILE_SECONDS
+from search_index import SearchIndex, SAVE_INTERVAL as SEARCH_INDEX_SAVE_INTERVAL
+from exporter import export_rows, message_rows, feedback_rows, MESSAGE_FIELDS, FEEDBACK_FIELDS, EXPORT_FORMATS, MAX_DOCUMENT_BYTES
+from inbox import Inbox, STATUS_ANSWERED, STATUS_DISMISSED
+from records import MessageRecord, FeedbackRecord
+from message_store import MessageLog, HistoryNotRestored, RETENTION_COUNT, RETENTION_AGE, MAX_CAPTION_LENGTH, PAGE_LIMIT, FILTER_KEYS, text_length, parse_filters, encode_cursor, decode_cursor, pack_page, previous_page_start
+
+startup_profile.stop_import_timing()
+startup_profile.record('imports', time.perf_counter() - startup_profile.started)
 
 # Configuration - Get bot token from environment variables with fallback
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'your_bot_token_here')
 OWNER_ID = int(os.getenv('OWNER_ID', '0'))  # Replace with your Telegram user ID
 
+# Webhook mode: public base URL of the keep-alive server (leave unset to use polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
 # Data storage for messages and feedback
-message_log = []
+message_log = MessageLog()
 feedback_log = []
-user_registry = {}  # Store user info for username-based replies
+user_registry = UserDirectory()  # Indexed user info for username-based replies
+search_index = SearchIndex()  # Full-text index over message_log positions for /search
+search_sessions = OrderedDict()  # Recent /search results by session id, for paging
+MAX_SEARCH_SESSIONS = 32
+inbox = Inbox()  # Open/answered/dismissed status of every message_log position
+# Cleared while message history is restored in the background
+history_restored = threading.Event()
+history_restored.set()
 
-# Logging setup
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+record_lock = threading.Lock()
+
+# Running aggregates for /stats, /view_feedback and /health
+bot_stats = StatsAggregator()
+set_stats_provider(bot_stats.snapshot)
+
+# Rate-limited background sender used by /broadcast
+broadcast_engine = BroadcastEngine()
+# Recent broadcast jobs by id, for /broadcast_status and /broadcast_cancel
+recent_broadcasts = OrderedDict()
+MAX_RECENT_BROADCASTS = 20
+# Running /reply_all_open jobs: job id -> log position before which delivered users' messages are answered
+open_replies = {}
+REPLY_ALL_TITLE = "Reply to open messages"
+
+# Digest-coalescing, rate-limited queue for alerts to the bot owner; started in main()
+admin_notifier = AdminNotifier(OWNER_ID)
+
+# Per-user token buckets checked before any handler runs
+flood_guard = FloodGuard()
+
+# Durable backend for the logs above; replaced by the configured backend in main()
+storage = MemoryStorage()
+
+# Sharded deployment (SHARD_WORKERS > 1): the coordinator routes user updates to
+# worker processes through shard_pool; workers set shard_worker and only write
+# through to the shared store, which the coordinator follows for its global view
+shard_pool = None
+shard_worker = False
+
+# Admin commands the coordinator handles itself; everything else goes to a worker
+ADMIN_COMMANDS = ('view_messages', 'search', 'inbox', 'dismiss', 'reply', 'reply_all_open', 'broadcast',
+                  'broadcast_status', 'broadcast_cancel', 'view_feedback', 'export', 'stats', 'profile')
+
+# Logging setup: records are queued and written as JSON lines by a background thread
+logging_pipeline = log_pipeline.setup_logging()
 logger = logging.getLogger(__name__)
 
+def register_user(message, count_message=False):
+    """Merge the sender of a message into user_registry and persist the record"""
+    user = message.from_user
+    record = user_registry.touch(user.id, user.first_name, user.username, message.date, count_message)
+    storage.upsert_user(record)
+    return record
+
+def record_message(entry):
+    """Append a message to message_log, persist it and update statistics"""
+    if shard_worker:
+        storage.append_message(entry)
+        return
+    # Log positions and storage ids must follow the same order for restores to line up
+    with record_lock:
+        position = message_log.append(entry)
+        storage.append_message(entry)
+    inbox.add(position, entry['user_id'])
+    user_registry.mark_asked(entry['user_id'])
+    search_index.add(position, entry)
+    bot_stats.record_message(entry.user_id, entry.time)
+
+def close_messages(positions, status):
+    """Mark messages answered or dismissed and persist the change; returns the positions changed"""
+    changed = inbox.set_status(positions, status)
+    for position in changed:
+        storage.update_message_status(position + 1, status)
+    return changed
+
+def close_user_messages(user_id, status, upto=None):
+    """Mark a user's open messages (before position upto) answered or dismissed"""
+    closed = inbox.close_user(user_id, status, upto)
+    for position in closed:
+        storage.update_message_status(position + 1, status)
+    return closed
+
+def record_feedback(entry):
+    """Append a feedback entry to feedback_log, persist it and update statistics"""
+    if shard_worker:
+        storage.append_feedback(entry)
+        return
+    feedback_log.append(entry)
+    storage.append_feedback(entry)
+    user_registry.rate(entry['user_id'], entry['rating'])
+    bot_stats.record_feedback(entry.user_id, entry.rating, entry.time)
+
+def report_storage_failure(reason):
+    """Tell the admin that messages are no longer persisted"""
+    bot_status.update(last_error=f"Storage: {reason}")
+    admin_notifier.notify(f"🚨 Storage {reason}.\nNew messages are no longer saved; restart the bot once storage is healthy.")
+
+def restore_state():
+    """Reload persisted state; message history streams back in on a background thread"""
+    global storage, search_index
+    storage = create_storage()
+    storage.on_failure = report_storage_failure
+    user_registry.restore(storage.load_users())
+    restored_feedback = storage.load_feedback()
+    feedback_log[:0] = restored_feedback
+    for fb in restored_feedback:
+        bot_stats.record_feedback(fb.user_id, fb.rating, fb.time)
+        user_registry.rate(fb.user_id, fb.rating)
+    logger.info("Restored %s users and %s feedback entries", len(user_registry), len(feedback_log))
+
+    # With retention enabled, older messages live in the on-disk archive and
+    # only messages stored after the archived ones need replaying from storage
+    if RETENTION_COUNT or RETENTION_AGE:
+        message_log.attach_archive(MessageArchive())
+    archived = len(message_log)
+    last_id = storage.last_message_id()
+    message_log.begin_restore(max(0, last_id - archived))
+    history_restored.clear()
+
+    # A saved search index only needs the messages logged after it was written
+    loaded_index = SearchIndex.load()
+    if len(loaded_index) > last_id:
+        logger.warning("Saved search index is ahead of storage; rebuilding it")
+    elif len(loaded_index):
+        search_index = loaded_index
+
+    def _restore_messages():
+        restored = 0
+        started = time.perf_counter()
+        try:
+            # Closed statuses first, so answered history never enters the open indexes
+            inbox.load((message_id - 1, status) for message_id, status in storage.load_message_statuses())
+            # Archived history is not reloaded into memory, it only feeds the statistics
+            if message_log.archive is not None:
+                for position, msg in enumerate(itertools.islice(message_log.archive, archived)):
+                    bot_stats.record_message(msg.user_id, msg.time)
+                    search_index.add(position, msg)
+                    inbox.add(position, msg['user_id'])
+                    user_registry.mark_asked(msg['user_id'])
+            for chunk in storage.iter_messages(after=archived, upto=last_id):
+                # Older history goes in front of anything logged while restoring
+                message_log.restore_chunk(chunk)
+                search_index.catch_up(chunk, archived + restored)
+                for offset, msg in enumerate(chunk):
+                    bot_stats.record_message(msg.user_id, msg.time)
+                    inbox.add(archived + restored + offset, msg['user_id'])
+                    user_registry.mark_asked(msg['user_id'])
+                restored += len(chunk)
+            logger.info("Restored %s messages from storage (%s already archived)", restored, archived)
+        except Exception as e:
+            logger.error("Failed to restore message history: %s", e)
+        finally:
+            message_log.end_restore()
+            history_restored.set()
+            update_bot_status(users=len(user_registry), messages=len(message_log))
+            # Runs in the background; the bot is ready long before this finishes
+            startup_profile.record('restore_history_background', time.perf_counter() - started)
+
+    restore_thread = threading.Thread(target=_restore_messages, name='StorageRestore')
+    restore_thread.daemon = True
+    restore_thread.start()
+    return restore_thread
+
 def start(update: Update, context: CallbackContext):
     """Handle /start command"""
     try:
@@ -30,11 +220,7 @@ def start(update: Update, context: CallbackContext):
         username = update.message.from_user.username
         
         # Register user in user_registry for future reference
-        user_registry[user_id] = {
-            'user_name': user_name,
-            'username': username,
-            'first_seen': update.message.date.isoformat()
-        }
+        register_user(update.message)
         
         # Update keep-alive status with current user count
         update_bot_status(users=len(user_registry))
@@ -45,9 +231,9 @@ def start(update: Update, context: CallbackContext):
             "Use /help to see all available commands."
         )
         update.message.reply_text(welcome_message)
-        logger.info(f"User {user_name} started the bot")
+        logger.info("User %s started the bot", user_name)
     except Exception as e:
-        logger.error(f"Error in start command: {str(e)}")
+        logger.error("Error in start command: %s", e)
         update.message.reply_text("Sorry, something went wrong. Please try again.")
 
 def help_command(update: Update, context: CallbackContext):
@@ -60,17 +246,26 @@ def help_command(update: Update, context: CallbackContext):
             "🔹 /ask <your question> - Ask me anything or send files\n"
             "🔹 /feedback <1-5> <comment> - Leave feedback\n\n"
             "👨‍💼 Admin Only Commands:\n"
-            "🔹 /view_messages - View all user messages\n"
+            "🔹 /view_messages [user:<id>] [type:text|file] [since:YYYY-MM-DD] [until:YYYY-MM-DD] - View user messages\n"
+            "🔹 /search <terms> [filters] - Search user messages\n"
+            "🔹 /inbox [user:<id>] - List messages still waiting for an answer\n"
+            "🔹 /dismiss <number>|user:<id> - Close messages that need no answer\n"
             "🔹 /reply <user_id> <message> - Reply to user by ID\n"
             "🔹 /reply @<username> <message> - Reply to user by username\n"
-            "🔹 /broadcast <message> - Send message to all users\n"
+            "🔹 /reply #<number> <message> - Reply to one logged message\n"
+            "🔹 /reply_all_open <message> - Reply to every user with open messages\n"
+            "🔹 /broadcast [--active 7d] [--asked] [--rated<=2] [--no-username] <message> - Send message to all users or a segment\n"
+            "🔹 /broadcast_status [job_id] - Show broadcast progress\n"
+            "🔹 /broadcast_cancel <job_id> - Stop a running broadcast\n"
             "🔹 /view_feedback - View all feedback\n"
-            "🔹 /stats - View bot statistics"
+            "🔹 /export messages|feedback [csv|jsonl] [filters] - Download as a compressed file\n"
+            "🔹 /stats - View bot statistics\n"
+            "🔹 /profile <seconds> - Profile live handlers and get the report"
         )
         update.message.reply_text(help_text)
-        logger.info(f"Help requested by user {update.message.from_user.id}")
+        logger.info("Help requested by user %s", update.message.from_user.id)
     except Exception as e:
-        logger.error(f"Error in help command: {str(e)}")
+        logger.error("Error in help command: %s", e)
         update.message.reply_text("Sorry, something went wrong. Please try again.")
 
 def ask(update: Update, context: CallbackContext):
@@ -81,11 +276,7 @@ def ask(update: Update, context: CallbackContext):
         username = update.message.from_user.username if update.message.from_user.username else "No Username"
 
         # Register/update user in user_registry
-        user_registry[user_id] = {
-            'user_name': user_name,
-            'username': username,
-            'last_seen': update.message.date.isoformat()
-        }
+        register_user(update.message, count_message=True)
 
         # Handle text message with /ask command
         if update.message.text:
@@ -149,16 +340,9 @@ def ask(update: Update, context: CallbackContext):
                 }
 
         # Store the message in the log for admin review
-        message_entry = {
-            'user_id': user_id,
-            'user_name': user_name,
-            'username': username,
-            'message': user_message,
-            'message_type': message_type,
-            'file_info': file_info,
-            'timestamp': update.message.date.isoformat()
-        }
-        message_log.append(message_entry)
+        message_entry = MessageRecord(user_id, user_name, username, user_message, message_type, file_info,
+                                      update.message.date)
+        record_message(message_entry)
         
         # Update keep-alive status with message count
         update_bot_status(messages=len(message_log))
@@ -195,23 +379,14 @@ def ask(update: Update, context: CallbackContext):
                     f"🆔 User ID: {user_id}"
                 )
             
-            try:
-                context.bot.send_message(chat_id=OWNER_ID, text=admin_notification)
-                
-                # Forward the file to admin if it's a file message
-                if message_type == "file":
-                    context.bot.forward_message(
-                        chat_id=OWNER_ID,
-                        from_chat_id=user_id,
-                        message_id=update.message.message_id
-                    )
-            except Exception as e:
-                logger.error(f"Failed to notify admin: {str(e)}")
-
-        logger.info(f"{'File' if message_type == 'file' else 'Question'} logged from user {user_name} ({user_id})")
+            # Forward the file to admin after the alert if it's a file message
+            forward = (user_id, update.message.message_id) if message_type == "file" else None
+            admin_notifier.notify(admin_notification, forward=forward)
+
+        logger.info("%s logged from user %s (%s)", 'File' if message_type == 'file' else 'Question', user_name, user_id)
         
     except Exception as e:
-        logger.error(f"Error in ask command: {str(e)}")
+        logger.error("Error in ask command: %s", e)
         update.message.reply_text("Sorry, something went wrong while processing your message. Please try again.")
 
 def feedback(update: Update, context: CallbackContext):
@@ -234,15 +409,9 @@ def feedback(update: Update, context: CallbackContext):
             return
         
         # Store feedback
-        feedback_entry = {
-            'user_id': update.message.from_user.id,
-            'user_name': update.message.from_user.first_name,
-            'username': update.message.from_user.username,
-            'rating': int(rating),
-            'comment': comment,
-            'timestamp': update.message.date.isoformat()
-        }
-        feedback_log.append(feedback_entry)
+        feedback_entry = FeedbackRecord(update.message.from_user.id, update.message.from_user.first_name,
+                                        update.message.from_user.username, int(rating), comment, update.message.date)
+        record_feedback(feedback_entry)
         
         # Create rating stars
         stars = "⭐" * int(rating)
@@ -261,19 +430,63 @@ def feedback(update: Update, context: CallbackContext):
                 f"⭐ Rating: {rating}/5\n"
                 f"💬 Comment: {comment}"
             )
-            try:
-                context.bot.send_message(chat_id=OWNER_ID, text=admin_feedback)
-            except Exception as e:
-                logger.error(f"Failed to notify admin of feedback: {str(e)}")
+            admin_notifier.notify(admin_feedback)
         
-        logger.info(f"Feedback received: {rating}/5 from user {update.message.from_user.id}")
+        logger.info("Feedback received: %s/5 from user %s", rating, update.message.from_user.id)
         
     except Exception as e:
-        logger.error(f"Error in feedback command: {str(e)}")
+        logger.error("Error in feedback command: %s", e)
         update.message.reply_text("Sorry, something went wrong while processing your feedback. Please try again.")
 
+def format_message_entry(position):
+    """Render one message_log entry for the admin"""
+    msg = message_log[position]
+    message_type = msg.get('message_type', 'text')
+    file_info = msg.get('file_info')
+    
+    message_text = (
+        f"📨 Message #{position + 1}\n"
+        f"👤 From: @{msg['username']} ({msg['user_name']})\n"
+        f"🆔 User ID: {msg['user_id']}\n"
+        f"💬 Message: {msg['message']}\n"
+        f"📌 Status: {inbox.status(position) or 'open'}\n"
+    )
+    
+    if message_type == 'file' and file_info:
+        file_details = f"📎 File Type: {file_info.get('type', 'unknown').title()}\n"
+        if file_info.get('file_name'):
+            file_details += f"📄 File Name: {file_info['file_name']}\n"
+        if file_info.get('file_size'):
+            file_details += f"📏 File Size: {file_info['file_size']} bytes\n"
+        message_text += file_details
+    
+    message_text += (
+        f"⏰ Time: {msg.get('timestamp', 'N/A')}\n"
+        f"{'='*30}"
+    )
+    return message_text
+
+def render_messages_page(start, filters):
+    """Build the text and navigation keyboard for one packed page of messages"""
+    positions = message_log.select(**filters)
+    if not positions:
+        return "📭 No messages match these filters.", None
+    
+    start = min(max(start, 0), len(positions) - 1)
+    page_text, end = pack_page(positions, start, format_message_entry)
+    
+    buttons = []
+    if start > 0:
+        prev_start = previous_page_start(positions, start, format_message_entry)
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=encode_cursor('vm', prev_start, filters)))
+    if end < len(positions):
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=encode_cursor('vm', end, filters)))
+    
+    header = f"📨 Messages {start + 1}-{end} of {len(positions)}\n\n"
+    return header + page_text, InlineKeyboardMarkup([buttons]) if buttons else None
+
 def view_messages(update: Update, context: CallbackContext):
-    """Admin command to view all logged messages"""
+    """Admin command to view logged messages, one packed page at a time"""
     try:
         if update.message.from_user.id != OWNER_ID:
             update.message.reply_text("❌ You are not authorized to view messages.")
@@ -283,38 +496,279 @@ def view_messages(update: Update, context: CallbackContext):
             update.message.reply_text("📭 No messages logged yet.")
             return
         
-        # Send messages in chunks to avoid hitting Telegram's message length limit
-        for i, msg in enumerate(message_log, 1):
-            message_type = msg.get('message_type', 'text')
-            file_info = msg.get('file_info')
-            
-            message_text = (
-                f"📨 Message #{i}\n"
-                f"👤 From: @{msg['username']} ({msg['user_name']})\n"
-                f"🆔 User ID: {msg['user_id']}\n"
-                f"💬 Message: {msg['message']}\n"
-            )
-            
-            if message_type == 'file' and file_info:
-                file_details = f"📎 File Type: {file_info.get('type', 'unknown').title()}\n"
-                if file_info.get('file_name'):
-                    file_details += f"📄 File Name: {file_info['file_name']}\n"
-                if file_info.get('file_size'):
-                    file_details += f"📏 File Size: {file_info['file_size']} bytes\n"
-                message_text += file_details
-            
-            message_text += (
-                f"⏰ Time: {msg.get('timestamp', 'N/A')}\n"
-                f"{'='*30}"
+        try:
+            filters = parse_filters(context.args)
+        except ValueError as e:
+            update.message.reply_text(
+                f"❌ {str(e)}\n\n"
+                "Usage: /view_messages [user:<id>] [type:text|file] [since:YYYY-MM-DD] [until:YYYY-MM-DD]"
             )
-            update.message.reply_text(message_text)
-            
-        logger.info(f"Admin viewed {len(message_log)} messages")
+            return
+        
+        page_text, keyboard = render_messages_page(0, filters)
+        update.message.reply_text(page_text, reply_markup=keyboard)
+        logger.info("Admin viewed messages with filters %s", filters)
         
     except Exception as e:
-        logger.error(f"Error in view_messages command: {str(e)}")
+        logger.error("Error in view_messages command: %s", e)
         update.message.reply_text("Sorry, something went wrong while retrieving messages.")
 
+def view_messages_page(update: Update, context: CallbackContext):
+    """Handle Prev/Next buttons under a /view_messages page"""
+    query = update.callback_query
+    try:
+        if query.from_user.id != OWNER_ID:
+            query.answer("❌ You are not authorized to view messages.")
+            return
+        
+        start, filters = decode_cursor(query.data)
+        page_text, keyboard = render_messages_page(start, filters)
+        query.edit_message_text(page_text, reply_markup=keyboard)
+        query.answer()
+        
+    except Exception as e:
+        logger.error("Error in view_messages navigation: %s", e)
+        query.answer("Sorry, something went wrong while retrieving messages.")
+
+def render_inbox_page(start, filters):
+    """Build the text and navigation keyboard for one packed page of open messages"""
+    counts = inbox.counts()
+    summary = (f"📥 Inbox: {counts['open']} open · ✅ {counts['answered']} answered · "
+               f"🗑 {counts['dismissed']} dismissed")
+    # Only the open index is read, never the whole history
+    positions = inbox.open_positions(filters.get('user_id'))
+    if not positions:
+        return summary + "\n\n🎉 No open messages" + (" from this user." if filters else "."), None
+
+    start = min(max(start, 0), len(positions) - 1)
+    limit = PAGE_LIMIT - text_length(summary)
+    page_text, end = pack_page(positions, start, format_message_entry, limit=limit)
+
+    buttons = []
+    if start > 0:
+        prev_start = previous_page_start(positions, start, format_message_entry, limit=limit)
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=encode_cursor('ib', prev_start, filters)))
+    if end < len(positions):
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=encode_cursor('ib', end, filters)))
+
+    header = f"{summary}\n📨 Open {start + 1}-{end} of {len(positions)}\n\n"
+    return header + page_text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+def show_inbox(update: Update, context: CallbackContext):
+    """Admin command to list messages that are still waiting for an answer, oldest first"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to view the inbox.")
+            return
+
+        try:
+            filters = parse_filters(context.args)
+            if set(filters) - {'user_id'}:
+                raise ValueError("Only user:<id> can filter the inbox")
+        except ValueError as e:
+            update.message.reply_text(
+                f"❌ {str(e)}\n\n"
+                "Usage: /inbox [user:<id>]\n"
+                "Answer with /reply #<number> <text> or /reply_all_open <text>, skip with /dismiss <number>"
+            )
+            return
+
+        page_text, keyboard = render_inbox_page(0, filters)
+        update.message.reply_text(page_text, reply_markup=keyboard)
+        logger.info("Admin viewed the inbox with filters %s: %s open", filters, len(inbox))
+
+    except Exception as e:
+        logger.error("Error in inbox command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while retrieving the inbox.")
+
+def inbox_page(update: Update, context: CallbackContext):
+    """Handle Prev/Next buttons under an /inbox page"""
+    query = update.callback_query
+    try:
+        if query.from_user.id != OWNER_ID:
+            query.answer("❌ You are not authorized to view the inbox.")
+            return
+
+        start, filters = decode_cursor(query.data)
+        page_text, keyboard = render_inbox_page(start, filters)
+        query.edit_message_text(page_text, reply_markup=keyboard)
+        query.answer()
+
+    except Exception as e:
+        logger.error("Error in inbox navigation: %s", e)
+        query.answer("Sorry, something went wrong while retrieving the inbox.")
+
+def dismiss(update: Update, context: CallbackContext):
+    """Admin command to close messages that need no answer"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to dismiss messages.")
+            return
+
+        usage = "Usage: /dismiss <number> [<number> ...] or /dismiss user:<id>"
+        if not context.args:
+            update.message.reply_text(usage)
+            return
+
+        try:
+            if context.args[0].lower().startswith('user:'):
+                dismissed = close_user_messages(int(context.args[0][5:]), STATUS_DISMISSED)
+            else:
+                positions = [int(arg.lstrip('#')) - 1 for arg in context.args]
+                dismissed = close_messages(positions, STATUS_DISMISSED)
+        except ValueError:
+            update.message.reply_text(usage)
+            return
+
+        update.message.reply_text(f"🗑 Dismissed {len(dismissed)} message(s). {len(inbox)} still open.")
+        logger.info("Admin dismissed %s messages", len(dismissed))
+
+    except Exception as e:
+        logger.error("Error in dismiss command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while dismissing messages.")
+
+def render_search_page(session_id, start):
+    """Build the text and navigation keyboard for one packed page of search results"""
+    session = search_sessions.get(session_id)
+    if session is None:
+        return "⌛ These search results have expired. Please run /search again.", None
+    query, positions = session
+    if not positions:
+        return f"🔎 No messages match \"{query}\".", None
+
+    start = min(max(start, 0), len(positions) - 1)
+    page_text, end = pack_page(positions, start, format_message_entry)
+
+    buttons = []
+    if start > 0:
+        prev_start = previous_page_start(positions, start, format_message_entry)
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"sr|{session_id}|{prev_start}"))
+    if end < len(positions):
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"sr|{session_id}|{end}"))
+
+    header = f"🔎 Results {start + 1}-{end} of {len(positions)} for \"{query}\"\n\n"
+    return header + page_text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+def search(update: Update, context: CallbackContext):
+    """Admin command to full-text search logged messages, best matches first"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to search messages.")
+            return
+
+        filter_args = [arg for arg in context.args if arg.partition(':')[0].lower() in FILTER_KEYS]
+        terms = [arg for arg in context.args if arg not in filter_args]
+        usage = (
+            "Usage: /search <terms> [user:<id>] [type:text|file] [since:YYYY-MM-DD] [until:YYYY-MM-DD]\n\n"
+            "Example: /search refund invoice since:2024-01-01"
+        )
+        if not terms:
+            update.message.reply_text(usage)
+            return
+        try:
+            filters = parse_filters(filter_args)
+        except ValueError as e:
+            update.message.reply_text(f"❌ {str(e)}\n\n{usage}")
+            return
+
+        query = ' '.join(terms)
+        started = time.perf_counter()
+        positions = search_index.search(query, **filters)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        session_id = secrets.token_hex(4)
+        search_sessions[session_id] = (query, positions)
+        while len(search_sessions) > MAX_SEARCH_SESSIONS:
+            search_sessions.popitem(last=False)
+
+        page_text, keyboard = render_search_page(session_id, 0)
+        update.message.reply_text(page_text, reply_markup=keyboard)
+        logger.info("Admin searched for '%s' with filters %s: %s results in %.1fms",
+                    query, filters, len(positions), elapsed_ms)
+
+    except Exception as e:
+        logger.error("Error in search command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while searching messages.")
+
+def search_page(update: Update, context: CallbackContext):
+    """Handle Prev/Next buttons under a /search results page"""
+    query = update.callback_query
+    try:
+        if query.from_user.id != OWNER_ID:
+            query.answer("❌ You are not authorized to search messages.")
+            return
+
+        _, session_id, start = query.data.split('|')
+        page_text, keyboard = render_search_page(session_id, int(start))
+        query.edit_message_text(page_text, reply_markup=keyboard)
+        query.answer()
+
+    except Exception as e:
+        logger.error("Error in search navigation: %s", e)
+        query.answer("Sorry, something went wrong while retrieving search results.")
+
+def save_search_index_periodically(interval=SEARCH_INDEX_SAVE_INTERVAL):
+    """Persist the search index in the background whenever it has grown"""
+    def _save_loop():
+        saved = len(search_index)
+        while True:
+            time.sleep(interval)
+            if len(search_index) != saved:
+                try:
+                    search_index.save()
+                    saved = len(search_index)
+                except Exception as e:
+                    logger.error("Failed to save search index: %s", e)
+
+    saver = threading.Thread(target=_save_loop, name='SearchIndexSaver')
+    saver.daemon = True
+    saver.start()
+    return saver
+
+def resolve_reply_target(update, target):
+    """Resolve a /reply target: #<message number>, @username or a numeric user ID.
+
+    Returns (user_id, display name, answered message position or None), or
+    None after telling the admin why the target is not usable.
+    """
+    if target.startswith('#'):
+        # Target is one logged message; the reply goes to its sender
+        try:
+            position = int(target[1:]) - 1
+            if not 0 <= position < len(message_log):
+                raise IndexError(position)
+            msg = message_log[position]
+        except HistoryNotRestored:
+            update.message.reply_text(f"⏳ Message {target} is still loading from history. Try again shortly.")
+            return None
+        except (ValueError, IndexError):
+            update.message.reply_text(f"❌ Message {target} not found.")
+            return None
+        return msg['user_id'], f"{msg['user_name']} (ID: {msg['user_id']}) about message {target}", position
+    if target.startswith('@'):
+        # Look up user by username (case-insensitive index)
+        user_info = user_registry.find_by_username(target)
+        if user_info is None:
+            update.message.reply_text(f"❌ Username {target} not found in user registry.")
+            return None
+        return user_info.user_id, f"@{user_info.username} ({user_info.user_name})", None
+    # Target is user ID
+    try:
+        target_user_id = int(target)
+    except ValueError:
+        update.message.reply_text("❌ Invalid format. Use #message number, numeric user ID or @username.")
+        return None
+    user_info = user_registry.get(target_user_id)
+    if user_info is not None:
+        return target_user_id, f"{user_info.user_name} (ID: {target_user_id})", None
+    return target_user_id, f"User ID: {target_user_id}", None
+
+def mark_reply_answered(user_id, position=None):
+    """A reply to one message answers just that one; a reply to a user answers all their open ones"""
+    if position is not None:
+        return close_messages([position], STATUS_ANSWERED)
+    return close_user_messages(user_id, STATUS_ANSWERED)
+
 def reply_to_user(update: Update, context: CallbackContext):
     """Admin command to reply to specific users by ID or username"""
     try:
@@ -326,44 +780,21 @@ def reply_to_user(update: Update, context: CallbackContext):
             update.message.reply_text(
                 "Usage:\n"
                 "/reply <user_id> <your reply>\n"
-                "/reply @<username> <your reply>\n\n"
+                "/reply @<username> <your reply>\n"
+                "/reply #<message number> <your reply>\n\n"
                 "Examples:\n"
                 "/reply 123456789 Thank you for your question!\n"
-                "/reply @john Hello John!\n\n"
+                "/reply @john Hello John!\n"
+                "/reply #42 Fixed in the latest version.\n\n"
                 "💡 Tip: You can also reply with a file by using /reply command as caption!"
             )
             return
 
-        target = context.args[0]
         reply_message = ' '.join(context.args[1:])
-        target_user_id = None
-        target_display_name = ""
-
-        # Check if target is a username (starts with @)
-        if target.startswith('@'):
-            username_to_find = target[1:].lower()  # Remove @ and make lowercase
-            # Search for user by username
-            for user_id, user_info in user_registry.items():
-                if user_info.get('username') and user_info['username'].lower() == username_to_find:
-                    target_user_id = user_id
-                    target_display_name = f"@{user_info['username']} ({user_info['user_name']})"
-                    break
-            
-            if target_user_id is None:
-                update.message.reply_text(f"❌ Username {target} not found in user registry.")
-                return
-        else:
-            # Target is user ID
-            try:
-                target_user_id = int(target)
-                if target_user_id in user_registry:
-                    user_info = user_registry[target_user_id]
-                    target_display_name = f"{user_info['user_name']} (ID: {target_user_id})"
-                else:
-                    target_display_name = f"User ID: {target_user_id}"
-            except ValueError:
-                update.message.reply_text("❌ Invalid format. Use numeric user ID or @username.")
-                return
+        resolved = resolve_reply_target(update, context.args[0])
+        if resolved is None:
+            return
+        target_user_id, target_display_name, answered_position = resolved
 
         # Send the reply to the user
         try:
@@ -371,15 +802,18 @@ def reply_to_user(update: Update, context: CallbackContext):
                 chat_id=target_user_id, 
                 text=f"📧 Reply from Admin:\n\n{reply_message}"
             )
-            update.message.reply_text(f"✅ Reply sent successfully to {target_display_name}")
-            logger.info(f"Admin replied to user {target_user_id}")
+            answered = mark_reply_answered(target_user_id, answered_position)
+            update.message.reply_text(
+                f"✅ Reply sent successfully to {target_display_name}" +
+                (f"\n📥 {len(answered)} open message(s) marked answered" if answered else ""))
+            logger.info("Admin replied to user %s, answering %s messages", target_user_id, len(answered))
         except Exception as e:
             error_message = f"❌ Failed to send reply to {target_display_name}: {str(e)}"
             update.message.reply_text(error_message)
             logger.error(error_message)
             
     except Exception as e:
-        logger.error(f"Error in reply command: {str(e)}")
+        logger.error("Error in reply command: %s", e)
         update.message.reply_text("Sorry, something went wrong while sending the reply.")
 
 def reply_with_file(update: Update, context: CallbackContext):
@@ -398,54 +832,26 @@ def reply_with_file(update: Update, context: CallbackContext):
         # Parse the caption like a normal reply command
         caption_parts = caption.strip().split()
         if len(caption_parts) < 3:
-            update.message.reply_text("❌ Usage: Send file with caption '/reply <user_id> <message>'\n\nExample: '/reply 123456789 Here's the document you requested!'")
+            update.message.reply_text("❌ Usage: Send file with caption '/reply <user_id|@username|#message> <message>'\n\nExample: '/reply 123456789 Here's the document you requested!'")
             return
 
         # Get target and message
-        target = caption_parts[1]
         reply_message = ' '.join(caption_parts[2:])
-        target_user_id = None
-        target_display_name = ""
-
-        # Check if target is a username (starts with @)
-        if target.startswith('@'):
-            username_to_find = target[1:].lower()
-            for user_id, user_info in user_registry.items():
-                if user_info.get('username') and user_info['username'].lower() == username_to_find:
-                    target_user_id = user_id
-                    target_display_name = f"@{user_info['username']} ({user_info['user_name']})"
-                    break
-            
-            if target_user_id is None:
-                update.message.reply_text(f"❌ Username {target} not found in user registry.")
-                return
-        else:
-            try:
-                target_user_id = int(target)
-                if target_user_id in user_registry:
-                    user_info = user_registry[target_user_id]
-                    target_display_name = f"{user_info['user_name']} (ID: {target_user_id})"
-                else:
-                    target_display_name = f"User ID: {target_user_id}"
-            except ValueError:
-                update.message.reply_text("❌ Invalid format. Use numeric user ID or @username.")
-                return
-
-        # Send text message first
-        context.bot.send_message(
-            chat_id=target_user_id,
-            text=f"📧 Reply from Admin:\n\n{reply_message}"
-        )
+        resolved = resolve_reply_target(update, caption_parts[1])
+        if resolved is None:
+            return
+        target_user_id, target_display_name, answered_position = resolved
 
-        # Forward the file to the user
-        context.bot.forward_message(
-            chat_id=target_user_id,
-            from_chat_id=update.message.chat_id,
-            message_id=update.message.message_id
-        )
+        # Resend the file by file_id with the reply as its caption
+        specs = media_specs(update.message, f"📧 Reply from Admin:\n\n{reply_message}")
+        for method, kwargs in specs:
+            getattr(context.bot, method)(chat_id=target_user_id, **kwargs)
 
-        update.message.reply_text(f"✅ Reply with file sent successfully to {target_display_name}")
-        logger.info(f"Admin replied with file to user {target_user_id}")
+        answered = mark_reply_answered(target_user_id, answered_position)
+        update.message.reply_text(
+            f"✅ Reply with file sent successfully to {target_display_name}" +
+            (f"\n📥 {len(answered)} open message(s) marked answered" if answered else ""))
+        logger.info("Admin replied with file to user %s, answering %s messages", target_user_id, len(answered))
 
     except Exception as e:
         error_message = f"❌ Failed to send reply with file: {str(e)}"
@@ -463,14 +869,12 @@ def view_feedback(update: Update, context: CallbackContext):
             update.message.reply_text("📭 No feedback received yet.")
             return
         
-        # Calculate average rating
-        total_rating = sum(fb['rating'] for fb in feedback_log)
-        avg_rating = total_rating / len(feedback_log)
-        
+        histogram = ' '.join(f"{rating}⭐:{count}" for rating, count in enumerate(bot_stats.rating_histogram, 1))
         summary = (
             f"📊 Feedback Summary\n"
-            f"Total feedback: {len(feedback_log)}\n"
-            f"Average rating: {avg_rating:.1f}/5\n"
+            f"Total feedback: {bot_stats.total_feedback}\n"
+            f"Average rating: {bot_stats.average_rating:.1f}/5\n"
+            f"Ratings: {histogram}\n"
             f"{'='*30}\n\n"
         )
         update.message.reply_text(summary)
@@ -488,63 +892,389 @@ def view_feedback(update: Update, context: CallbackContext):
             )
             update.message.reply_text(feedback_text)
             
-        logger.info(f"Admin viewed {len(feedback_log)} feedback entries")
+        logger.info("Admin viewed %s feedback entries", len(feedback_log))
         
     except Exception as e:
-        logger.error(f"Error in view_feedback command: {str(e)}")
+        logger.error("Error in view_feedback command: %s", e)
         update.message.reply_text("Sorry, something went wrong while retrieving feedback.")
 
+def run_export(bot, chat_id, kind, fmt, filters):
+    """Stream one export into a compressed document and send it to the admin"""
+    try:
+        if kind == 'messages':
+            rows, fields = message_rows(message_log, message_log.select(**filters)), MESSAGE_FIELDS
+        else:
+            rows, fields = feedback_rows(feedback_log, **filters), FEEDBACK_FIELDS
+        result = export_rows(rows, fields, fmt)
+    except Exception as e:
+        logger.error("Export of %s failed: %s", kind, e)
+        bot.send_message(chat_id, f"❌ Export failed: {str(e)}")
+        return
+
+    try:
+        summary = (
+            f"📦 Exported {result.rows} {kind} in {result.elapsed:.1f}s "
+            f"({result.rate:.0f} rows/s, {result.size / 1024:.0f} KB compressed)"
+        )
+        logger.info(summary)
+        if not result.rows:
+            bot.send_message(chat_id, f"📭 No {kind} match these filters.")
+        elif result.size > MAX_DOCUMENT_BYTES:
+            bot.send_message(chat_id, f"{summary}\n\n❌ The file is too large to send. Narrow it down with since:/until: filters.")
+        else:
+            filename = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}.gz"
+            bot.send_document(chat_id, document=result.file, filename=filename, caption=summary)
+    except Exception as e:
+        logger.error("Failed to send %s export: %s", kind, e)
+    finally:
+        result.close()
+
+def export(update: Update, context: CallbackContext):
+    """Admin command to download messages or feedback as a compressed CSV/JSONL document"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to export data.")
+            return
+
+        usage = (
+            "Usage: /export messages|feedback [csv|jsonl] [user:<id>] [type:text|file] "
+            "[since:YYYY-MM-DD] [until:YYYY-MM-DD]\n\n"
+            "Example: /export messages jsonl since:2024-01-01 type:file"
+        )
+        args = list(context.args)
+        if not args or args[0].lower() not in ('messages', 'feedback'):
+            update.message.reply_text(usage)
+            return
+        kind = args.pop(0).lower()
+        fmt = args.pop(0).lower() if args and args[0].lower() in EXPORT_FORMATS else 'csv'
+        try:
+            filters = parse_filters(args)
+            if kind == 'feedback' and 'message_type' in filters:
+                raise ValueError("type: only applies to messages")
+        except ValueError as e:
+            update.message.reply_text(f"❌ {str(e)}\n\n{usage}")
+            return
+
+        update.message.reply_text(f"⏳ Exporting {kind} as {fmt}.gz...")
+        # Large exports take a while; keep the dispatcher free meanwhile
+        exporter = threading.Thread(
+            target=run_export,
+            args=(context.bot, update.effective_chat.id, kind, fmt, filters),
+            name='Export'
+        )
+        exporter.daemon = True
+        exporter.start()
+        logger.info("Admin started a %s export of %s with filters %s", fmt, kind, filters)
+
+    except Exception as e:
+        logger.error("Error in export command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while starting the export.")
+
+# Bot API method that sends each kind of media by file_id
+MEDIA_METHODS = {
+    'document': 'send_document',
+    'photo': 'send_photo',
+    'video': 'send_video',
+    'audio': 'send_audio',
+    'voice': 'send_voice'
+}
+
+def media_specs(message, caption):
+    """(bot_method_name, kwargs) specs that resend the message's media by file_id with caption.
+
+    The file_id is extracted once, so every recipient costs a single call; a
+    caption over Telegram's limit goes in a separate text message first.
+    """
+    for kind in MEDIA_METHODS:
+        media = getattr(message, kind)
+        if media:
+            # Photos come in several sizes; send the largest
+            file_id = media[-1].file_id if kind == 'photo' else media.file_id
+            break
+    else:
+        return None
+
+    method = MEDIA_METHODS[kind]
+    if text_length(caption) <= MAX_CAPTION_LENGTH:
+        return [(method, {kind: file_id, 'caption': caption})]
+    return [('send_message', {'text': caption}), (method, {kind: file_id})]
+
+def checkpoint_broadcast(job):
+    """Persist a broadcast job's counters and status"""
+    storage.update_broadcast(job.job_id, job.status, job.sent, job.failed, job.retries,
+                             int(job.finished_at) if job.done.is_set() and job.finished_at else None)
+
+def record_delivery(job, chat_id, ok):
+    """Checkpoint one recipient of a broadcast so a restart never sends to it twice"""
+    storage.record_delivery(job.job_id, chat_id, ok)
+    upto = open_replies.get(job.job_id)
+    if ok and upto is not None:
+        # A resumed reply can start before the history it answers is back in the inbox
+        history_restored.wait()
+        close_user_messages(chat_id, STATUS_ANSWERED, upto)
+
+def answer_delivered(job_id):
+    """Sharded mode: answer the open messages of every user a reply job reached"""
+    upto = open_replies.get(job_id)
+    if upto is None:
+        return
+    history_restored.wait()
+    for chat_id in storage.delivered_recipients(job_id):
+        close_user_messages(chat_id, STATUS_ANSWERED, upto)
+
+def launch_broadcast(bot, job, recipients, specs, status_message):
+    """Deliver a persistent broadcast job to recipients, keeping status_message up to date"""
+    def on_progress(job):
+        checkpoint_broadcast(job)
+        status_message.edit_text(job.progress_text())
+
+    def on_done(job):
+        checkpoint_broadcast(job)
+        if shard_pool is not None:
+            # Deliveries were recorded by the workers, not through record_delivery here
+            answer_delivered(job.job_id)
+        open_replies.pop(job.job_id, None)
+        try:
+            status_message.edit_text(job.progress_text())
+        except Exception:
+            # Fall back to a fresh message if the status message can't be edited
+            bot.send_message(status_message.chat_id, job.progress_text())
+
+    recent_broadcasts[job.job_id] = job
+    while len(recent_broadcasts) > MAX_RECENT_BROADCASTS:
+        recent_broadcasts.popitem(last=False)
+
+    if shard_pool is not None:
+        # Each worker sends to the users it owns at its share of the global rate
+        # and checkpoints its deliveries in the shared store
+        broadcast_engine.watch(job, on_progress=on_progress, on_done=on_done)
+        shard_pool.broadcast(job, recipients, specs)
+    else:
+        broadcast_engine.submit(job.title, recipients, bot_steps(bot, specs), on_progress=on_progress,
+                                on_done=on_done, job=job, on_delivered=record_delivery)
+
+def start_broadcast(update: Update, context: CallbackContext, title, specs, recipients=None, answers_upto=None):
+    """Persist a new broadcast job, then hand it to the background engine.
+
+    specs are (bot_method_name, kwargs) pairs sent to every recipient in order;
+    recipients default to every registered user. With answers_upto, each
+    recipient's open messages before that position are answered on delivery.
+    """
+    if recipients is None:
+        recipients = list(user_registry.keys())
+    job_id = storage.create_broadcast(title, specs, update.effective_chat.id, recipients, answers_upto)
+    job = BroadcastJob(title, len(recipients), job_id=job_id)
+    if answers_upto is not None:
+        open_replies[job_id] = answers_upto
+    status_message = update.message.reply_text(
+        f"📢 Broadcast #{job_id} started for {len(recipients)} users...\n"
+        "Progress will be updated here.\n"
+        f"Cancel it with /broadcast_cancel {job_id}"
+    )
+    launch_broadcast(context.bot, job, recipients, specs, status_message)
+    logger.info("%s #%s queued for %s users", title, job_id, len(recipients))
+
+def resume_broadcasts(bot):
+    """Pick up broadcasts that were still running when the bot last stopped"""
+    for stored in storage.load_broadcasts(status='running'):
+        try:
+            pending = storage.pending_recipients(stored['id'])
+            sent, failed = storage.delivery_counts(stored['id'])
+            job = BroadcastJob(stored['title'], stored['total'], job_id=stored['id'])
+            job.resume(sent, failed, stored['retries'])
+            if stored['answers_upto'] is not None:
+                open_replies[stored['id']] = stored['answers_upto']
+            status_message = bot.send_message(
+                stored['chat_id'],
+                f"🔄 Resuming broadcast #{stored['id']}: {len(pending)} of {stored['total']} users left..."
+            )
+            launch_broadcast(bot, job, pending, stored['specs'], status_message)
+            logger.info("Resumed %s #%s with %s pending recipients", stored['title'], stored['id'], len(pending))
+        except Exception as e:
+            logger.error("Failed to resume broadcast #%s: %s", stored['id'], e)
+
+def broadcast_status_line(job_id, title, status, processed, total):
+    icons = {'running': '⏳', 'done': '✅', 'cancelled': '🛑'}
+    percent = (processed * 100 // total) if total else 100
+    return f"{icons.get(status, '❔')} #{job_id} {title}: {processed}/{total} ({percent}%) {status}"
+
+def broadcast_status(update: Update, context: CallbackContext):
+    """Admin command to show the progress of one broadcast, or list recent ones"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to view broadcasts.")
+            return
+
+        if context.args:
+            try:
+                job_id = int(context.args[0].lstrip('#'))
+            except ValueError:
+                update.message.reply_text("Usage: /broadcast_status [job_id]")
+                return
+            job = recent_broadcasts.get(job_id)
+            if job is not None:
+                update.message.reply_text(job.progress_text())
+                return
+            # Counters are checkpointed on the job row, so no recipient list is scanned
+            stored = storage.load_broadcast(job_id)
+            if stored is None:
+                update.message.reply_text(f"❌ No broadcast #{job_id} found.")
+                return
+            update.message.reply_text(broadcast_status_line(
+                job_id, stored['title'], stored['status'], stored['sent'] + stored['failed'], stored['total']) +
+                f"\n✅ Sent: {stored['sent']}\n❌ Failed: {stored['failed']}\n🔁 Retries: {stored['retries']}")
+            return
+
+        lines = {}
+        for stored in storage.load_broadcasts(limit=MAX_RECENT_BROADCASTS):
+            lines[stored['id']] = broadcast_status_line(
+                stored['id'], stored['title'], stored['status'], stored['sent'] + stored['failed'], stored['total'])
+        # Jobs known to this process have fresher counts than their last checkpoint
+        for job_id, job in recent_broadcasts.items():
+            lines[job_id] = broadcast_status_line(job_id, job.title, job.status, job.processed, job.total)
+        if not lines:
+            update.message.reply_text("📭 No broadcasts yet.")
+            return
+        recent = [lines[job_id] for job_id in sorted(lines, reverse=True)[:MAX_RECENT_BROADCASTS]]
+        update.message.reply_text("📢 Recent broadcasts:\n\n" + '\n'.join(recent))
+
+    except Exception as e:
+        logger.error("Error in broadcast_status command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while retrieving broadcasts.")
+
+def broadcast_cancel(update: Update, context: CallbackContext):
+    """Admin command to stop a running broadcast; recipients not reached yet are skipped"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to cancel broadcasts.")
+            return
+
+        try:
+            job_id = int(context.args[0].lstrip('#'))
+        except (IndexError, ValueError):
+            update.message.reply_text("Usage: /broadcast_cancel <job_id>")
+            return
+
+        job = recent_broadcasts.get(job_id)
+        if job is not None and not job.done.is_set():
+            job.cancel()
+            if shard_pool is not None:
+                shard_pool.cancel(job_id)
+            checkpoint_broadcast(job)
+            update.message.reply_text(
+                f"🛑 Broadcast #{job_id} cancelled after {job.processed} of {job.total} users.")
+            logger.info("Admin cancelled broadcast #%s", job_id)
+            return
+
+        stored = storage.load_broadcast(job_id)
+        if stored is not None and stored['status'] == 'running':
+            # Interrupted and not resumed in this process; just stop it from resuming
+            storage.update_broadcast(job_id, 'cancelled', stored['sent'], stored['failed'], stored['retries'],
+                                     int(time.time()))
+            update.message.reply_text(f"🛑 Broadcast #{job_id} cancelled.")
+            logger.info("Admin cancelled interrupted broadcast #%s", job_id)
+            return
+        update.message.reply_text(f"❌ Broadcast #{job_id} is not running.")
+
+    except Exception as e:
+        logger.error("Error in broadcast_cancel command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while cancelling the broadcast.")
+
+BROADCAST_USAGE = (
+    "Usage: /broadcast [segment] <your message>\n\n"
+    "Segments (combine to narrow down):\n"
+    "--active 7d - seen in the last 7 days (also m, h, w)\n"
+    "--asked - sent at least one question or file\n"
+    "--rated<=2 - latest feedback rating (also >=, <, >, =)\n"
+    "--no-username - users without a @username\n\n"
+    "Examples:\n"
+    "/broadcast Hello everyone! This is an important update.\n"
+    "/broadcast --active 7d --rated<=2 We fixed the issues you reported.\n\n"
+    "💡 Tip: You can also broadcast a file by using /broadcast as caption!"
+)
+
+def segment_recipients(segment, title):
+    """Resolve a broadcast segment to (recipients, title); recipients is None for everyone"""
+    if not segment:
+        return None, title
+    started = time.perf_counter()
+    recipients = list(user_registry.segment(**segment))
+    logger.info("Resolved segment '%s' to %s users in %.1fms",
+                describe_segment(segment), len(recipients), (time.perf_counter() - started) * 1000)
+    return recipients, f"{title} ({describe_segment(segment)})"
+
 def broadcast(update: Update, context: CallbackContext):
-    """Admin command to broadcast message to all users"""
+    """Admin command to broadcast a message to all users or a segment of them"""
     try:
         if update.message.from_user.id != OWNER_ID:
             update.message.reply_text("❌ You are not authorized to send broadcasts.")
             return
 
-        if len(context.args) < 1:
-            update.message.reply_text(
-                "Usage: /broadcast <your message>\n\n"
-                "Examples:\n"
-                "/broadcast Hello everyone! This is an important update.\n\n"
-                "💡 Tip: You can also broadcast a file by using /broadcast as caption!"
-            )
+        try:
+            segment, message_args = parse_segment(context.args)
+        except ValueError as e:
+            update.message.reply_text(f"❌ {str(e)}\n\n{BROADCAST_USAGE}")
             return
 
-        broadcast_message = ' '.join(context.args)
+        if not message_args:
+            update.message.reply_text(BROADCAST_USAGE)
+            return
+
+        broadcast_message = ' '.join(message_args)
         
         if not user_registry:
             update.message.reply_text("❌ No users found to broadcast to.")
             return
 
-        success_count = 0
-        failed_count = 0
-        
-        # Send message to all registered users
-        for user_id in user_registry.keys():
-            try:
-                context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📢 Broadcast Message:\n\n{broadcast_message}"
-                )
-                success_count += 1
-            except Exception as e:
-                failed_count += 1
-                logger.warning(f"Failed to send broadcast to user {user_id}: {str(e)}")
+        recipients, title = segment_recipients(segment, "Broadcast")
+        if recipients is not None and not recipients:
+            update.message.reply_text(f"❌ No users match this segment ({describe_segment(segment)}).")
+            return
 
-        # Send summary to admin
-        summary = (
-            f"📊 Broadcast Summary:\n\n"
-            f"✅ Successfully sent: {success_count}\n"
-            f"❌ Failed: {failed_count}\n"
-            f"👥 Total users: {len(user_registry)}"
-        )
-        update.message.reply_text(summary)
-        logger.info(f"Broadcast sent to {success_count}/{len(user_registry)} users")
+        text = f"📢 Broadcast Message:\n\n{broadcast_message}"
+        specs = [('send_message', {'text': text})]
+        start_broadcast(update, context, title, specs, recipients=recipients)
         
     except Exception as e:
-        logger.error(f"Error in broadcast command: {str(e)}")
+        logger.error("Error in broadcast command: %s", e)
         update.message.reply_text("Sorry, something went wrong while sending the broadcast.")
 
+def reply_all_open(update: Update, context: CallbackContext):
+    """Admin command to answer every user with open messages at once, through the broadcast engine"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to send replies.")
+            return
+
+        if not context.args:
+            update.message.reply_text(
+                "Usage: /reply_all_open <your reply>\n\n"
+                "Sends one reply to every user with open messages and marks those messages answered "
+                "as each reply is delivered. Messages arriving meanwhile stay open."
+            )
+            return
+
+        # Open messages not restored yet would be missed
+        if not history_restored.is_set():
+            update.message.reply_text("⏳ Message history is still loading. Try again shortly.")
+            return
+
+        # Messages logged from here on are not covered by this reply
+        upto = len(message_log)
+        users = inbox.open_users(upto)
+        if not users:
+            update.message.reply_text("🎉 No open messages to reply to.")
+            return
+
+        text = f"📧 Reply from Admin:\n\n{' '.join(context.args)}"
+        update.message.reply_text(f"📧 Replying to {sum(users.values())} open messages from {len(users)} users.")
+        start_broadcast(update, context, REPLY_ALL_TITLE, [('send_message', {'text': text})],
+                        recipients=list(users), answers_upto=upto)
+
+    except Exception as e:
+        logger.error("Error in reply_all_open command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while sending the replies.")
+
 def broadcast_with_file(update: Update, context: CallbackContext):
     """Admin command to broadcast files to all users"""
     try:
@@ -558,54 +1288,34 @@ def broadcast_with_file(update: Update, context: CallbackContext):
             update.message.reply_text("❌ Please use /broadcast command as caption when sending files.\n\nExample: Send a photo with caption '/broadcast Check out this image!'")
             return
 
-        # Parse the caption like a normal broadcast command
-        caption_parts = caption.strip().split()
-        if len(caption_parts) < 2:
-            update.message.reply_text("❌ Usage: Send file with caption '/broadcast <message>'\n\nExample: '/broadcast Here's an important document for everyone!'")
+        # Parse the caption like a normal broadcast command, segment flags included
+        try:
+            segment, message_args = parse_segment(caption.strip().split()[1:])
+        except ValueError as e:
+            update.message.reply_text(f"❌ {str(e)}\n\n{BROADCAST_USAGE}")
+            return
+        if not message_args:
+            update.message.reply_text("❌ Usage: Send file with caption '/broadcast [segment] <message>'\n\nExample: '/broadcast --active 30d Here's an important document for everyone!'")
             return
 
-        # Remove '/broadcast' and get the message
-        broadcast_message = ' '.join(caption_parts[1:])
+        broadcast_message = ' '.join(message_args)
         
         if not user_registry:
             update.message.reply_text("❌ No users found to broadcast to.")
             return
 
-        success_count = 0
-        failed_count = 0
-        
-        # Send message and file to all registered users
-        for user_id in user_registry.keys():
-            try:
-                # Send text message first
-                context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📢 Broadcast Message:\n\n{broadcast_message}"
-                )
-                
-                # Forward the file
-                context.bot.forward_message(
-                    chat_id=user_id,
-                    from_chat_id=update.message.chat_id,
-                    message_id=update.message.message_id
-                )
-                success_count += 1
-            except Exception as e:
-                failed_count += 1
-                logger.warning(f"Failed to send broadcast with file to user {user_id}: {str(e)}")
+        recipients, title = segment_recipients(segment, "Broadcast with File")
+        if recipients is not None and not recipients:
+            update.message.reply_text(f"❌ No users match this segment ({describe_segment(segment)}).")
+            return
 
-        # Send summary to admin
-        summary = (
-            f"📊 Broadcast with File Summary:\n\n"
-            f"✅ Successfully sent: {success_count}\n"
-            f"❌ Failed: {failed_count}\n"
-            f"👥 Total users: {len(user_registry)}"
-        )
-        update.message.reply_text(summary)
-        logger.info(f"Broadcast with file sent to {success_count}/{len(user_registry)} users")
+        text = f"📢 Broadcast Message:\n\n{broadcast_message}"
+        # One send per recipient: the file by its file_id with the message as caption
+        specs = media_specs(update.message, text)
+        start_broadcast(update, context, title, specs, recipients=recipients)
         
     except Exception as e:
-        logger.error(f"Error in broadcast with file command: {str(e)}")
+        logger.error("Error in broadcast with file command: %s", e)
         update.message.reply_text("Sorry, something went wrong while sending the broadcast with file.")
 
 def handle_file_reply(update: Update, context: CallbackContext):
@@ -620,11 +1330,7 @@ def handle_file_reply(update: Update, context: CallbackContext):
             return
             
         # Register/update user in user_registry
-        user_registry[user_id] = {
-            'user_name': user_name,
-            'username': username,
-            'last_seen': update.message.date.isoformat()
-        }
+        register_user(update.message, count_message=True)
         
         # Update keep-alive status with current user count
         update_bot_status(users=len(user_registry))
@@ -666,51 +1372,37 @@ def handle_file_reply(update: Update, context: CallbackContext):
             }
         
         # Log the message with file info
-        message_entry = {
-            'user_id': user_id,
-            'user_name': user_name,
-            'username': username,
-            'message': update.message.caption or f"[{file_info.get('type', 'file').upper()} FILE REPLY]",
-            'message_type': message_type,
-            'file_info': file_info,
-            'timestamp': update.message.date.isoformat(),
-            'reply_to_bot': True
-        }
-        message_log.append(message_entry)
+        message_entry = MessageRecord(
+            user_id, user_name, username,
+            update.message.caption or f"[{file_info.get('type', 'file').upper()} FILE REPLY]",
+            message_type, file_info, update.message.date, reply_to_bot=True)
+        record_message(message_entry)
         
         # Update keep-alive status with message count
         update_bot_status(messages=len(message_log))
         
         # Forward the file to admin for review
-        if update.message.from_user.id != OWNER_ID:
-            try:
-                context.bot.forward_message(
-                    chat_id=OWNER_ID,
-                    from_chat_id=update.message.chat_id,
-                    message_id=update.message.message_id
-                )
-                
-                # Send notification to admin
-                file_type = file_info.get('type', 'file')
-                notification = (
-                    f"📎 New {file_type} reply from {user_name} (@{username or 'no_username'}):\n"
-                    f"👤 User ID: {user_id}\n"
-                    f"📝 Caption: {update.message.caption or 'No caption'}\n"
-                    f"📅 Time: {update.message.date.strftime('%Y-%m-%d %H:%M:%S')}"
-                )
-                context.bot.send_message(chat_id=OWNER_ID, text=notification)
-                
-            except Exception as forward_error:
-                logger.error(f"Failed to forward file to admin: {forward_error}")
+        if update.message.from_user.id != OWNER_ID and OWNER_ID != 0:
+            file_type = file_info.get('type', 'file')
+            notification = (
+                f"📎 New {file_type} reply from {user_name} (@{username or 'no_username'}):\n"
+                f"👤 User ID: {user_id}\n"
+                f"📝 Caption: {update.message.caption or 'No caption'}\n"
+                f"📅 Time: {update.message.date.strftime('%Y-%m-%d %H:%M:%S')}"
+            )
+            admin_notifier.notify(
+                notification,
+                forward=(update.message.chat_id, update.message.message_id)
+            )
         
         # Respond to user
         response = f"Thank you for sharing the {file_info.get('type', 'file')}! I've received it and will review it shortly."
         update.message.reply_text(response)
         
-        logger.info(f"File reply logged from user {user_name} ({user_id})")
+        logger.info("File reply logged from user %s (%s)", user_name, user_id)
         
     except Exception as e:
-        logger.error(f"Error in handle_file_reply: {str(e)}")
+        logger.error("Error in handle_file_reply: %s", e)
         update.message.reply_text("Thank you for sharing the file!")
 
 def stats(update: Update, context: CallbackContext):
@@ -722,32 +1414,80 @@ def stats(update: Update, context: CallbackContext):
 
         stats_text = (
             f"📊 Bot Statistics\n\n"
-            f"📨 Total Messages: {len(message_log)}\n"
-            f"📝 Total Feedback: {len(feedback_log)}\n"
+            f"📨 Total Messages: {bot_stats.total_messages}\n"
+            f"📝 Total Feedback: {bot_stats.total_feedback}\n"
             f"👥 Registered Users: {len(user_registry)}\n"
         )
         
-        if feedback_log:
-            avg_rating = sum(fb['rating'] for fb in feedback_log) / len(feedback_log)
-            stats_text += f"⭐ Average Rating: {avg_rating:.1f}/5\n"
+        if bot_stats.total_feedback:
+            stats_text += f"⭐ Average Rating: {bot_stats.average_rating:.1f}/5\n"
         
-        # Count unique users from messages and feedback
-        unique_users = set()
-        for msg in message_log:
-            unique_users.add(msg['user_id'])
-        for fb in feedback_log:
-            unique_users.add(fb['user_id'])
+        stats_text += f"💬 Active Users: {bot_stats.active_users}\n"
         
-        stats_text += f"💬 Active Users: {len(unique_users)}"
+        # Recent activity from the hourly rollups
+        day_messages, day_feedback, day_rating = bot_stats.window(24 * 3600)
+        stats_text += f"🕐 Last 24h: {day_messages} messages, {day_feedback} feedback"
+        if day_rating is not None:
+            stats_text += f" (avg {day_rating:.1f}/5)"
         
         update.message.reply_text(stats_text)
         logger.info("Admin viewed bot statistics")
         
     except Exception as e:
-        logger.error(f"Error in stats command: {str(e)}")
+        logger.error("Error in stats command: %s", e)
         update.message.reply_text("Sorry, something went wrong while retrieving statistics.")
 
-# Auto-reply system with predefined responses
+def send_profile_report(bot, chat_id, capture):
+    """Send a finished profile capture to the admin as a text document"""
+    try:
+        if not capture.handlers:
+            bot.send_message(chat_id, f"🔬 No handlers ran during the {capture.seconds}s profile window.")
+            return
+        calls = sum(count for count, _ in capture.handlers.values())
+        busiest = max(capture.handlers.items(), key=lambda item: item[1][1])[0]
+        report = io.BytesIO(capture.report().encode('utf-8'))
+        bot.send_document(
+            chat_id,
+            document=report,
+            filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+            caption=f"🔬 {calls} handler calls profiled over {capture.seconds}s; most time in {busiest}"
+        )
+        logger.info("Sent profile of %s handler calls", calls)
+    except Exception as e:
+        logger.error("Failed to send profile report: %s", e)
+
+def profile(update: Update, context: CallbackContext):
+    """Admin command to cProfile live handler traffic for a few seconds"""
+    try:
+        if update.message.from_user.id != OWNER_ID:
+            update.message.reply_text("❌ You are not authorized to profile the bot.")
+            return
+
+        try:
+            seconds = int(context.args[0]) if context.args else 30
+            if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+                raise ValueError
+        except ValueError:
+            update.message.reply_text(f"Usage: /profile <seconds> (1-{MAX_PROFILE_SECONDS}, default 30)")
+            return
+
+        try:
+            capture = handler_profiler.start(seconds)
+        except RuntimeError:
+            update.message.reply_text("⏳ A profile is already being captured. Please wait for it to finish.")
+            return
+
+        update.message.reply_text(f"🔬 Profiling all handlers for {seconds}s. The report will follow as a document.")
+        timer = threading.Timer(seconds, send_profile_report, args=(context.bot, update.effective_chat.id, capture))
+        timer.daemon = True
+        timer.start()
+        logger.info("Admin started a %ss handler profile", seconds)
+
+    except Exception as e:
+        logger.error("Error in profile command: %s", e)
+        update.message.reply_text("Sorry, something went wrong while starting the profiler.")
+
+# Built-in auto-reply rules, used until AUTO_REPLIES_FILE is present
 auto_replies = {
     "hello": "Hi there! 👋 How can I assist you today? Use /help to see available commands.",
     "hi": "Hello! 😊 How can I help you?",
@@ -758,6 +1498,9 @@ auto_replies = {
     "help": "I'm here to help! Use /help to see all available commands. 📋"
 }
 
+# Compiled auto-reply matcher; edits to the rules file are picked up without a restart
+reply_matcher = ReplyMatcher(os.getenv('AUTO_REPLIES_FILE', 'auto_replies.json'), auto_replies)
+
 def auto_reply(update: Update, context: CallbackContext):
     """Handle automatic replies for common messages"""
     try:
@@ -766,23 +1509,18 @@ def auto_reply(update: Update, context: CallbackContext):
         username = update.message.from_user.username
         
         # Register/update user in user_registry
-        user_registry[user_id] = {
-            'user_name': user_name,
-            'username': username,
-            'last_seen': update.message.date.isoformat()
-        }
+        register_user(update.message, count_message=True)
         
         # Update keep-alive status
         update_bot_status(users=len(user_registry))
         
-        user_message = update.message.text.lower().strip()
-        
-        # Check if message matches any auto-reply keywords
-        for keyword, response in auto_replies.items():
-            if keyword in user_message:
-                update.message.reply_text(response)
-                logger.info(f"Auto-reply sent for keyword '{keyword}' to user {update.message.from_user.id}")
-                return
+        # Find the best whole-word keyword match in a single pass over the message
+        match = reply_matcher.match(update.message.text)
+        if match:
+            keyword, response = match
+            update.message.reply_text(response)
+            logger.info("Auto-reply sent for keyword '%s' to user %s", keyword, update.message.from_user.id)
+            return
 
         # Default response for unmatched messages
         default_response = (
@@ -791,22 +1529,266 @@ def auto_reply(update: Update, context: CallbackContext):
             "For help with commands, use: /help"
         )
         update.message.reply_text(default_response)
-        logger.info(f"Default auto-reply sent to user {update.message.from_user.id}")
+        logger.info("Default auto-reply sent to user %s", update.message.from_user.id)
         
     except Exception as e:
-        logger.error(f"Error in auto_reply: {str(e)}")
+        logger.error("Error in auto_reply: %s", e)
         # Don't send error message for auto-replies to avoid spam
 
+def flood_control(update: Update, context: CallbackContext):
+    """Drop updates from users over their flood limit before any handler sees them"""
+    user = update.effective_user
+    if user is None or user.id == OWNER_ID:
+        return
+
+    kind = update_kind(update)
+    allowed, warn = flood_guard.allow(user.id, kind)
+    if allowed:
+        return
+
+    # Only the first dropped update of a flood gets an answer; the rest cost nothing
+    if warn:
+        logger.info("User %s hit the flood limit for %s", user.id, kind)
+        try:
+            if update.callback_query is not None:
+                update.callback_query.answer("⏳ Too many requests. Please slow down.")
+            elif update.effective_message is not None:
+                update.effective_message.reply_text(
+                    "⏳ You're sending messages too quickly. Please wait a moment and try again.")
+        except Exception as e:
+            logger.warning("Failed to warn user %s about flooding: %s", user.id, e)
+    raise DispatcherHandlerStop
+
 def error_handler(update: Update, context: CallbackContext):
     """Handle errors caused by Updates"""
-    logger.warning(f'Update {update} caused error {context.error}')
+    # The update id and sender are added to the record by the log context; the full
+    # Update repr is only worth rendering when debugging
+    logger.warning("Update %s caused error %s", getattr(update, 'update_id', None), context.error)
+    logger.debug("Update that caused the error: %s", update)
     
-    # Update status to indicate error handling
+    # Record the error for /health; whether the bot is alive is up to the watchdog
     if "Conflict" in str(context.error):
-        # Don't change status for conflict errors as they're common during restarts
+        # Don't record conflict errors as they're common during restarts
         pass
     else:
-        update_bot_status('error_handled')
+        bot_status.update(last_error=f"{type(context.error).__name__}: {context.error}")
+
+def register_handlers(dispatcher):
+    """Register every command, message and error handler on the dispatcher"""
+    # Flood limits run in group -1, before every handler below, and can stop an update there
+    dispatcher.add_handler(TypeHandler(Update, flood_control), group=-1)
+
+    # Register command handlers
+    dispatcher.add_handler(CommandHandler("start", start))
+    dispatcher.add_handler(CommandHandler("help", help_command))
+    dispatcher.add_handler(CommandHandler("ask", ask))
+    dispatcher.add_handler(CommandHandler("feedback", feedback))
+    dispatcher.add_handler(CommandHandler("view_messages", view_messages))
+    dispatcher.add_handler(CommandHandler("inbox", show_inbox))
+    dispatcher.add_handler(CommandHandler("dismiss", dismiss))
+    dispatcher.add_handler(CommandHandler("reply", reply_to_user))
+    dispatcher.add_handler(CommandHandler("reply_all_open", reply_all_open))
+    dispatcher.add_handler(CommandHandler("broadcast", broadcast))
+    dispatcher.add_handler(CommandHandler("broadcast_status", broadcast_status))
+    dispatcher.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel))
+    dispatcher.add_handler(CommandHandler("view_feedback", view_feedback))
+    dispatcher.add_handler(CommandHandler("stats", stats))
+    dispatcher.add_handler(CommandHandler("profile", profile))
+    dispatcher.add_handler(CommandHandler("search", search))
+    dispatcher.add_handler(CommandHandler("export", export))
+    dispatcher.add_handler(CallbackQueryHandler(view_messages_page, pattern=r'^vm\|'))
+    dispatcher.add_handler(CallbackQueryHandler(inbox_page, pattern=r'^ib\|'))
+    dispatcher.add_handler(CallbackQueryHandler(search_page, pattern=r'^sr\|'))
+
+    # Register message handlers for files with commands (caption-based)
+    dispatcher.add_handler(MessageHandler(
+        (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
+        Filters.caption_regex(r'^/ask'), ask))
+
+    dispatcher.add_handler(MessageHandler(
+        (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
+        Filters.caption_regex(r'^/reply'), reply_with_file))
+
+    dispatcher.add_handler(MessageHandler(
+        (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
+        Filters.caption_regex(r'^/broadcast'), broadcast_with_file))
+
+    # Register message handlers for files without commands (reply-to-message based)
+    dispatcher.add_handler(MessageHandler(
+        (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
+        Filters.reply, handle_file_reply))
+
+    # Register message handler for automatic replies (non-command messages)
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, auto_reply))
+
+    # Register error handler
+    dispatcher.add_error_handler(error_handler)
+
+    # Time every registered handler for /metrics
+    metrics.instrument_dispatcher(dispatcher)
+
+def is_admin_update(update):
+    """True for the owner's admin commands, which need the global view"""
+    user = update.effective_user
+    if user is None or user.id != OWNER_ID:
+        return False
+    if update.callback_query is not None:
+        return True
+    message = update.effective_message
+    text = (message.text or message.caption or '') if message else ''
+    if not text.startswith('/'):
+        return False
+    command = text[1:].split(maxsplit=1)[0].split('@')[0] if len(text) > 1 else ''
+    return command in ADMIN_COMMANDS
+
+def follow_shared_store(restore_thread, interval=SHARD_FOLLOW_INTERVAL):
+    """Coordinator: fold messages, feedback and users written by the shard workers into the global view"""
+    restore_thread.join()
+    # Workers stamp users with the message date, which can trail the commit a little
+    slack = 300
+    watermark = max((record.last_seen or 0 for record in user_registry.values()), default=0)
+    while True:
+        time.sleep(interval)
+        try:
+            # Message ids are contiguous, so the log length is the last id already folded in
+            for chunk in storage.iter_messages(after=len(message_log)):
+                for msg in chunk:
+                    position = message_log.append(msg)
+                    search_index.add(position, msg)
+                    inbox.add(position, msg['user_id'])
+                    user_registry.mark_asked(msg['user_id'])
+                    bot_stats.record_message(msg.user_id, msg.time)
+            for fb in storage.load_feedback(after=len(feedback_log)):
+                feedback_log.append(fb)
+                bot_stats.record_feedback(fb.user_id, fb.rating, fb.time)
+                user_registry.rate(fb.user_id, fb.rating)
+            rows = storage.load_users(seen_since=watermark - slack)
+            if rows:
+                user_registry.restore(rows)
+                watermark = max(watermark, max(row[4] or 0 for row in rows))
+            update_bot_status(users=len(user_registry), messages=len(message_log))
+        except Exception as e:
+            logger.error("Failed to follow the shared store: %s", e)
+
+def run_shard_worker(index, count, updates, results, base_url=None):
+    """Entry point of a shard worker process: handles the users hashed to this shard"""
+    global storage, broadcast_engine, admin_notifier, shard_worker
+    shard_worker = True
+    storage = create_storage()
+    storage.on_failure = report_storage_failure
+    # Only this shard's users are ever touched here
+    user_registry.restore(row for row in storage.load_users() if shard_of(row[0], count) == index)
+    # Telegram's limits are per bot, so each worker gets its share of them
+    broadcast_engine = BroadcastEngine(rate=BROADCAST_RATE / count)
+    admin_notifier = AdminNotifier(OWNER_ID, rate=ADMIN_CHAT_RATE / count)
+
+    updater = create_updater(BOT_TOKEN, base_url=base_url)
+    register_handlers(updater.dispatcher)
+    admin_notifier.start(updater.bot)
+    logger.info("Shard worker %s/%s ready with %s users", index, count, len(user_registry))
+
+    # This shard's part of each broadcast, by job id
+    broadcast_parts = {}
+
+    def run_broadcast(job_id, title, chat_ids, specs, report):
+        part = BroadcastJob(title, len(chat_ids), job_id=job_id)
+        broadcast_parts[job_id] = part
+        # Local jobs (no persistent id) have nothing to checkpoint against
+        on_delivered = record_delivery if isinstance(job_id, int) else None
+
+        def on_done(part):
+            broadcast_parts.pop(job_id, None)
+            if on_delivered is not None:
+                # The coordinator reads the delivery states once every part is done
+                storage.flush()
+            report(part)
+
+        broadcast_engine.submit(title, chat_ids, bot_steps(updater.bot, specs), on_progress=report, on_done=on_done,
+                                job=part, on_delivered=on_delivered)
+
+    def cancel_broadcast(job_id):
+        part = broadcast_parts.get(job_id)
+        if part is not None:
+            part.cancel()
+
+    try:
+        serve_shard(index, updates, results, updater.dispatcher, run_broadcast, cancel_broadcast)
+        for job in list(broadcast_engine.active_jobs):
+            job.done.wait()
+    finally:
+        admin_notifier.stop()
+        storage.close()
+
+def register_gauges(updater):
+    """Expose update queue depth and broadcast progress on /metrics"""
+    executor = getattr(updater.dispatcher, 'executor', None)
+    metrics.registry.gauge('bot_update_queue_depth', 'Updates waiting for the dispatcher',
+                           updater.update_queue.qsize)
+    if executor is not None:
+        metrics.registry.gauge('bot_dispatch_pending', 'Updates queued or running on dispatch workers',
+                               lambda: executor.depth)
+    metrics.registry.gauge('bot_broadcasts_active', 'Broadcasts currently running',
+                           lambda: len(broadcast_engine.active_jobs))
+    metrics.registry.gauge('bot_broadcast_recipients', 'Recipients of running broadcasts by state',
+                           broadcast_engine.progress, label_name='state')
+    metrics.registry.gauge('bot_admin_notifications_pending', 'Admin alerts and forwards waiting to be sent',
+                           lambda: admin_notifier.pending)
+    if shard_pool is not None:
+        metrics.registry.gauge('bot_shard_processed_updates', 'Updates handled by each shard worker',
+                               lambda: dict(enumerate(shard_pool.processed)), label_name='shard')
+    metrics.registry.gauge('bot_flood_tracked_users', 'Users with flood-limit buckets in memory',
+                           lambda: len(flood_guard))
+    metrics.registry.gauge('bot_log_queue_depth', 'Log records waiting for the writer thread',
+                           logging_pipeline.queue.qsize)
+    metrics.registry.gauge('bot_log_records_dropped', 'Log records sampled out or dropped on a full queue',
+                           lambda: dict(log_pipeline.dropped), label_name='reason')
+    metrics.registry.gauge('bot_storage_failed', 'Whether message writes stopped after a lost storage batch',
+                           lambda: 1 if storage.failed else 0)
+    metrics.registry.gauge('bot_registered_users', 'Users in the registry', lambda: len(user_registry))
+    metrics.registry.gauge('bot_logged_messages', 'Messages in the message log', lambda: len(message_log))
+
+def start_receiving_updates(updater):
+    """Receive updates through the keep-alive webhook if configured, falling back to polling"""
+    if WEBHOOK_URL:
+        try:
+            updater.bot.set_webhook(
+                url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET
+            )
+            enable_webhook(updater.bot, updater.update_queue, WEBHOOK_SECRET)
+            
+            # No polling thread: run the dispatcher and job queue ourselves
+            dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher')
+            dispatcher_thread.daemon = True
+            dispatcher_thread.start()
+            updater.job_queue.start()
+            updater.running = True
+            logger.info("Bot started successfully! Receiving updates via webhook at %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+            return 'webhook'
+        except Exception as e:
+            logger.error("Failed to set up webhook, falling back to polling: %s", e)
+    
+    # start_polling() also removes any webhook left over from a previous run
+    updater.start_polling()
+    logger.info("Bot started successfully! Polling for updates...")
+    return 'polling'
+
+def build_updater():
+    """Create an Updater with every handler and gauge registered.
+
+    Called once at startup and again by the watchdog whenever it replaces a
+    stalled Updater.
+    """
+    if shard_pool is not None:
+        updater = create_sharded_updater(BOT_TOKEN, shard_pool, is_admin_update)
+    else:
+        # DISPATCH_MODE picks sequential or concurrent dispatch
+        updater = create_updater(BOT_TOKEN)
+
+    # Register all handlers and expose queue/broadcast gauges on /metrics
+    register_handlers(updater.dispatcher)
+    register_gauges(updater)
+    return updater
 
 def main():
     """Main function to set up and run the Telegram bot"""
@@ -821,80 +1803,71 @@ def main():
         print("Warning: OWNER_ID not configured. Admin commands will not work.")
     
     try:
-        # Create the Updater and pass it the bot's token
-        updater = Updater(BOT_TOKEN, use_context=True)
-
-        # Get the dispatcher to register handlers
-        dispatcher = updater.dispatcher
-
-        # Register command handlers
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("ask", ask))
-        dispatcher.add_handler(CommandHandler("feedback", feedback))
-        dispatcher.add_handler(CommandHandler("view_messages", view_messages))
-        dispatcher.add_handler(CommandHandler("reply", reply_to_user))
-        dispatcher.add_handler(CommandHandler("broadcast", broadcast))
-        dispatcher.add_handler(CommandHandler("view_feedback", view_feedback))
-        dispatcher.add_handler(CommandHandler("stats", stats))
-
-        # Register message handlers for files with commands (caption-based)
-        dispatcher.add_handler(MessageHandler(
-            (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
-            Filters.caption_regex(r'^/ask'), ask))
-        
-        dispatcher.add_handler(MessageHandler(
-            (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
-            Filters.caption_regex(r'^/reply'), reply_with_file))
-        
-        dispatcher.add_handler(MessageHandler(
-            (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
-            Filters.caption_regex(r'^/broadcast'), broadcast_with_file))
-        
-        # Register message handlers for files without commands (reply-to-message based)
-        dispatcher.add_handler(MessageHandler(
-            (Filters.document | Filters.photo | Filters.video | Filters.audio | Filters.voice) & 
-            Filters.reply, handle_file_reply))
-        
-        # Register message handler for automatic replies (non-command messages)
-        dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, auto_reply))
-        
-        # Register error handler
-        dispatcher.add_error_handler(error_handler)
+        # Restore persisted users, feedback and message history
+        with startup_profile.phase('restore_state'):
+            restore_thread = restore_state()
+        save_search_index_periodically()
+
+        global shard_pool
+        if SHARD_WORKERS > 1 and STORAGE_BACKEND != 'sqlite':
+            logger.warning("SHARD_WORKERS needs STORAGE_BACKEND=sqlite for shared state; running a single process")
+        elif SHARD_WORKERS > 1:
+            # This process becomes the coordinator: it receives updates, routes them
+            # to the workers by user and keeps a global view for admin commands
+            with startup_profile.phase('start_shard_workers'):
+                shard_pool = ShardPool(SHARD_WORKERS, run_shard_worker).start()
+            follower = threading.Thread(target=follow_shared_store, args=(restore_thread,), name='StoreFollower')
+            follower.daemon = True
+            follower.start()
+
+        with startup_profile.phase('build_updater'):
+            updater = build_updater()
 
         logger.info("Bot handlers registered successfully")
         print("🤖 Telegram bot is starting...")
         print(f"🔑 Bot token configured: {'✅' if BOT_TOKEN != 'your_bot_token_here' else '❌'}")
         print(f"👨‍💼 Admin configured: {'✅' if OWNER_ID != 0 else '❌'}")
         
-        # Start the bot
-        updater.start_polling()
-        logger.info("Bot started successfully! Polling for updates...")
+        # Start delivering admin alerts, then the bot under the stall watchdog
+        admin_notifier.start(updater.bot)
+        watchdog = UpdaterWatchdog(build_updater, start_receiving_updates, bot_status)
+        with startup_profile.phase('start_receiving_updates'):
+            watchdog.start(updater)
         print("✅ Bot is now running! Press Ctrl+C to stop.")
         
-        # Mark bot as ready in keep-alive system
+        # Mark bot as ready in keep-alive system; /ready reports ready once
+        # the keep-alive server (started concurrently) is serving too
         set_bot_ready()
+        wait_until_serving()
+        startup_profile.mark_ready()
+        if '--profile-startup' in sys.argv:
+            print(startup_profile.report())
+
+        # Finish broadcasts a previous run was interrupted in
+        with startup_profile.phase('resume_broadcasts'):
+            resume_broadcasts(updater.bot)
+        
+        # Run the bot until you press Ctrl-C, restarting the Updater if it stalls
+        watchdog.idle()
         
-        # Run the bot until you press Ctrl-C
-        updater.idle()
+        # Let shard workers drain, deliver queued admin alerts, commit queued writes and save the search index
+        if shard_pool is not None:
+            shard_pool.stop()
+        admin_notifier.stop()
+        storage.close()
+        search_index.save()
         
     except Exception as e:
-        logger.error(f"Failed to start bot: {str(e)}")
+        logger.error("Failed to start bot: %s", e)
         print(f"❌ Failed to start bot: {str(e)}")
         update_bot_status('error')
 
 if __name__ == '__main__':
-    # Start keep-alive server first
+    # The keep-alive server binds on its own thread while the bot starts up;
+    # readiness is tracked with events, so nothing here waits on a fixed sleep
     print("🔄 Initializing keep-alive system...")
     keep_alive_thread = keep_alive()
     
-    # Start heartbeat system
-    print("💓 Starting heartbeat system...")
-    heartbeat_thread = heartbeat()
-    
-    # Give servers a moment to initialize
-    time.sleep(1)
-    
-    # Start the main bot
+    # Start the main bot (pass --profile-startup to print where startup time went)
     print("🤖 Starting Telegram bot...")
     main()
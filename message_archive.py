@@ -0,0 +1,168 @@
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from records import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv('MESSAGE_ARCHIVE_DIR', 'message_archive')
+SEGMENT_BYTES = int(os.getenv('MESSAGE_ARCHIVE_SEGMENT_BYTES', str(32 * 1024 * 1024)))
+CACHED_MEMBERS = 4
+
+
+class ArchiveMember:
+    """Location and summary of one compressed batch of archived messages"""
+
+    __slots__ = ('seq', 'count', 'segment', 'offset', 'length', 'min_ts', 'max_ts', 'users', 'types')
+
+    def __init__(self, seq, count, segment, offset, length, min_ts, max_ts, users, types):
+        self.seq = seq
+        self.count = count
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.users = users
+        self.types = types
+
+    def to_json(self):
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+
+class MessageArchive:
+    """Append-only, gzip-compressed on-disk archive of messages evicted from memory.
+
+    Messages are written in batches; each batch is one gzip member appended to
+    the current segment file, so any batch can be read back with a single seek.
+    A small JSON-lines index records where every batch lives, its sequence
+    range, time range, user ids and message types.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.members = []
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.jsonl')
+        self._load_index()
+
+    def __len__(self):
+        """Number of archived messages; they occupy sequence numbers 0..len-1"""
+        if not self.members:
+            return 0
+        last = self.members[-1]
+        return last.seq + last.count
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash; the batch it described is ignored
+                    break
+                self.members.append(ArchiveMember(**data))
+        logger.info("Message archive holds %s messages in %s batches", len(self), len(self.members))
+
+    def append(self, entries, times):
+        """Archive a batch of entries that directly follow the already archived ones"""
+        if not entries:
+            return
+        payload = gzip.compress(
+            '\n'.join(json.dumps(entry.to_dict(), ensure_ascii=False) for entry in entries).encode('utf-8'))
+        with self._lock:
+            segment = self._current_segment(len(payload))
+            path = os.path.join(self.directory, segment)
+            with open(path, 'ab') as segment_file:
+                offset = segment_file.tell()
+                segment_file.write(payload)
+            member = ArchiveMember(
+                len(self), len(entries), segment, offset, len(payload), min(times), max(times),
+                sorted({entry['user_id'] for entry in entries}),
+                sorted({entry.get('message_type', 'text') for entry in entries})
+            )
+            with open(self._index_path, 'a', encoding='utf-8') as index_file:
+                index_file.write(member.to_json() + '\n')
+            self.members.append(member)
+
+    def _current_segment(self, incoming):
+        if self.members:
+            last = self.members[-1]
+            if last.offset + last.length + incoming <= self.segment_bytes:
+                return last.segment
+        return f"segment-{len(self):012d}.jsonl.gz"
+
+    def _member_for(self, seq):
+        lo, hi = 0, len(self.members)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.members[mid].seq + self.members[mid].count <= seq:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self.members):
+            raise IndexError(seq)
+        return self.members[lo]
+
+    def read_member(self, member):
+        """Decompress one batch, keeping the most recently used batches cached"""
+        with self._lock:
+            entries = self._cache.get(member.seq)
+            if entries is not None:
+                self._cache.move_to_end(member.seq)
+                return entries
+        with open(os.path.join(self.directory, member.segment), 'rb') as segment_file:
+            segment_file.seek(member.offset)
+            payload = segment_file.read(member.length)
+        entries = [MessageRecord.from_dict(json.loads(line))
+                   for line in gzip.decompress(payload).decode('utf-8').split('\n')]
+        with self._lock:
+            self._cache[member.seq] = entries
+            while len(self._cache) > CACHED_MEMBERS:
+                self._cache.popitem(last=False)
+        return entries
+
+    def get(self, seq):
+        member = self._member_for(seq)
+        return self.read_member(member)[seq - member.seq]
+
+    def __iter__(self):
+        for member in list(self.members):
+            yield from self.read_member(member)
+
+    def select(self, user_id=None, message_type=None, since=None, until=None, timestamp=None):
+        """Sequence numbers of archived messages matching the filters.
+
+        Batches are skipped using their summaries; only batches that may
+        contain matches are decompressed. ``timestamp`` maps an entry to epoch seconds.
+        """
+        positions = []
+        for member in list(self.members):
+            if user_id is not None and user_id not in member.users:
+                continue
+            if message_type is not None and message_type not in member.types:
+                continue
+            if since is not None and member.max_ts < since:
+                continue
+            if until is not None and member.min_ts >= until:
+                continue
+            for offset, entry in enumerate(self.read_member(member)):
+                if user_id is not None and entry['user_id'] != user_id:
+                    continue
+                if message_type is not None and entry.get('message_type', 'text') != message_type:
+                    continue
+                if since is not None or until is not None:
+                    ts = timestamp(entry)
+                    if (since is not None and ts < since) or (until is not None and ts >= until):
+                        continue
+                positions.append(member.seq + offset)
+        return positions
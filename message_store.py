@@ -0,0 +1,374 @@
+import bisect
+import os
+import threading
+import time
+from datetime import datetime
+
+
+# Telegram rejects messages and media captions longer than these
+MAX_MESSAGE_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+# Leave room for a short page header above the packed entries
+PAGE_LIMIT = MAX_MESSAGE_LENGTH - 64
+
+# Retention of the in-memory hot window; older messages spill to the archive
+RETENTION_COUNT = int(os.getenv('MESSAGE_RETENTION_COUNT', '50000'))  # 0 = no count limit
+RETENTION_AGE = int(os.getenv('MESSAGE_RETENTION_AGE', '0'))  # seconds, 0 = no age limit
+SPILL_BATCH = int(os.getenv('MESSAGE_SPILL_BATCH', '1000'))
+AGE_CHECK_INTERVAL = 60
+
+
+class HistoryNotRestored(LookupError):
+    """A position reserved for history that the background restore has not reached yet"""
+
+
+class Spans:
+    """Read-only sequence over a few ascending, disjoint ranges of positions"""
+
+    def __init__(self, ranges):
+        self.ranges = [r for r in ranges if len(r)]
+
+    def __len__(self):
+        return sum(len(r) for r in self.ranges)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        for r in self.ranges:
+            if index < len(r):
+                return r[index]
+            index -= len(r)
+        raise IndexError(index)
+
+
+class MessageLog:
+    """Message log with indexes by user_id, message_type and time.
+
+    Only a hot window of recent messages (bounded by count and/or age) is
+    kept in memory; older ones spill in batches to a MessageArchive on disk.
+    Positions are global sequence numbers, so archived messages can still be
+    read, filtered and paged through.
+    """
+
+    def __init__(self, archive=None, max_count=RETENTION_COUNT, max_age=RETENTION_AGE, spill_batch=SPILL_BATCH):
+        self.archive = archive
+        self.max_count = max_count
+        self.max_age = max_age
+        self.spill_batch = spill_batch
+        self._base = len(archive) if archive is not None else 0  # position of the first hot entry
+        self._entries = []
+        self._times = []
+        self._by_user = {}
+        self._by_type = {}
+        self._next_age_check = 0.0
+        self._restore = None
+        self._lock = threading.Lock()
+
+    def attach_archive(self, archive):
+        """Enable spilling to archive; must be called before any message is logged"""
+        with self._lock:
+            if self._entries:
+                raise RuntimeError("attach_archive() called on a non-empty MessageLog")
+            self.archive = archive
+            self._base = len(archive)
+
+    @property
+    def hot_count(self):
+        """Number of messages currently held in memory"""
+        return len(self._entries)
+
+    def __len__(self):
+        # Includes positions reserved by begin_restore() that are not restored yet
+        return self._base + len(self._entries)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        """Iterate the whole history, archived messages first"""
+        if self.archive is not None:
+            yield from self.archive
+        yield from list(self._entries)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._base + len(self._entries)
+        if position >= self._base:
+            return self._entries[position - self._base]
+        if self._restore is not None:
+            with self._lock:
+                if self._restore is not None:
+                    return self._restored_entry(position)
+        if self.archive is None:
+            raise IndexError(position)
+        return self.archive.get(position)
+
+    def _restored_entry(self, position):
+        """Entry at a position below the hot window while a restore is running"""
+        state = self._restore
+        start = self._base - state['total']
+        if position < start:
+            if self.archive is None:
+                raise IndexError(position)
+            return self.archive.get(position)
+        offset = position - start
+        if offset >= state['restored']:
+            raise HistoryNotRestored(position)
+        archived = len(self.archive) if self.archive is not None else 0
+        if position < archived:
+            return self.archive.get(position)
+        buffer = state['archive_buffer']
+        if position - archived < len(buffer):
+            return buffer[position - archived]
+        return state['tail'][position - archived - len(buffer)]
+
+    def append(self, entry):
+        """Add an entry and return its position"""
+        with self._lock:
+            position = self._base + len(self._entries)
+            self._index(position, entry)
+            self._entries.append(entry)
+            if self.archive is not None and self._restore is None:
+                self._enforce_retention()
+            return position
+
+    def _index(self, position, entry):
+        self._times.append(entry.time or 0)
+        self._by_user.setdefault(entry['user_id'], []).append(position)
+        self._by_type.setdefault(entry.get('message_type', 'text'), []).append(position)
+
+    def _enforce_retention(self):
+        count = 0
+        # Spill in whole batches so archive members stay a useful size
+        if self.max_count and len(self._entries) >= self.max_count + self.spill_batch:
+            count = len(self._entries) - self.max_count
+        if self.max_age:
+            now = time.time()
+            if now >= self._next_age_check:
+                self._next_age_check = now + AGE_CHECK_INTERVAL
+                count = max(count, bisect.bisect_left(self._times, now - self.max_age))
+        if count:
+            self._spill(count)
+
+    def _spill(self, count):
+        evicted = self._entries[:count]
+        self.archive.append(evicted, self._times[:count])
+        del self._entries[:count]
+        del self._times[:count]
+        self._base += count
+        for index, keys in ((self._by_user, {e['user_id'] for e in evicted}),
+                            (self._by_type, {e.get('message_type', 'text') for e in evicted})):
+            for key in keys:
+                positions = index[key]
+                del positions[:bisect.bisect_left(positions, self._base)]
+                if not positions:
+                    del index[key]
+
+    def begin_restore(self, count):
+        """Reserve positions for ``count`` older messages about to be restored.
+
+        Messages appended meanwhile are numbered after the reserved range and
+        are not spilled until end_restore().
+        """
+        with self._lock:
+            self._restore = {'restored': 0, 'total': count, 'archive_buffer': [], 'tail': []}
+            entries = self._entries
+            self._entries, self._times, self._by_user, self._by_type = [], [], {}, {}
+            self._base += count
+            for entry in entries:
+                self._index(self._base + len(self._entries), entry)
+                self._entries.append(entry)
+
+    def restore_chunk(self, entries):
+        """Feed the next chunk of restored history, oldest first"""
+        state = self._restore
+        # Everything older than the final hot window goes straight to the archive
+        if self.archive is not None and self.max_count:
+            archive_until = state['total'] - self.max_count
+        else:
+            archive_until = 0
+        # Under the lock so readers of restored positions see the buffers and archive agree
+        with self._lock:
+            for entry in entries:
+                if state['restored'] < archive_until:
+                    state['archive_buffer'].append(entry)
+                    if len(state['archive_buffer']) >= self.spill_batch:
+                        self._flush_restore_buffer()
+                else:
+                    state['tail'].append(entry)
+                state['restored'] += 1
+
+    def _flush_restore_buffer(self):
+        buffer = self._restore['archive_buffer']
+        if buffer:
+            self.archive.append(buffer, [e.time or 0 for e in buffer])
+            self._restore['archive_buffer'] = []
+
+    def end_restore(self):
+        """Place the restored tail in front of the hot window and resume retention"""
+        with self._lock:
+            self._flush_restore_buffer()
+            tail = self._restore['tail']
+            entries = tail + self._entries
+            self._base -= len(tail)
+            self._entries, self._times, self._by_user, self._by_type = [], [], {}, {}
+            for entry in entries:
+                self._index(self._base + len(self._entries), entry)
+                self._entries.append(entry)
+            self._restore = None
+            if self.archive is not None:
+                self._enforce_retention()
+
+    def _archived_range(self):
+        return range(0, len(self.archive)) if self.archive is not None else range(0)
+
+    def select(self, user_id=None, message_type=None, since=None, until=None):
+        """Return a sequence of log positions matching all given filters.
+
+        Hot messages are served from the in-memory indexes: unfiltered and
+        time-only selections are ranges, user/type selections are slices of
+        the posting lists. Archived messages are found through the archive's
+        per-batch summaries.
+        """
+        filtered = user_id is not None or message_type is not None or since is not None or until is not None
+        archived = []
+        if self.archive is not None and len(self.archive):
+            if filtered:
+                archived = self.archive.select(user_id, message_type, since, until,
+                                               timestamp=lambda e: e.time or 0)
+            else:
+                archived = self._archived_range()
+
+        with self._lock:
+            base = self._base
+            if user_id is not None and message_type is not None:
+                by_user = self._by_user.get(user_id, [])
+                by_type = self._by_type.get(message_type, [])
+                # Walk the shorter posting list and probe the other one
+                if len(by_user) <= len(by_type):
+                    positions = [p for p in by_user if self._entries[p - base].get('message_type', 'text') == message_type]
+                else:
+                    positions = [p for p in by_type if self._entries[p - base]['user_id'] == user_id]
+            elif user_id is not None:
+                positions = list(self._by_user.get(user_id, []))
+            elif message_type is not None:
+                positions = list(self._by_type.get(message_type, []))
+            else:
+                lo = bisect.bisect_left(self._times, since) if since is not None else 0
+                hi = bisect.bisect_left(self._times, until) if until is not None else len(self._times)
+                hot = range(base + lo, base + max(lo, hi))
+                if isinstance(archived, range):
+                    return Spans([archived, hot])
+                return archived + list(hot)
+
+            if since is not None or until is not None:
+                times = self._times
+                lo = bisect.bisect_left(positions, since, key=lambda p: times[p - base]) if since is not None else 0
+                hi = bisect.bisect_left(positions, until, key=lambda p: times[p - base]) if until is not None else len(positions)
+                positions = positions[lo:max(lo, hi)]
+            return archived + positions if archived else positions
+
+
+def text_length(text):
+    """Length of text as Telegram counts it (UTF-16 code units)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def truncate_text(text, limit):
+    """Cut text down to at most limit UTF-16 code units, marking the cut"""
+    if text_length(text) <= limit:
+        return text
+    text = text[:limit - 1]
+    while text_length(text) > limit - 1:
+        text = text[:-1]
+    return text + '…'
+
+
+# Keys understood by parse_filters
+FILTER_KEYS = ('user', 'type', 'since', 'until')
+# Values understood by the type: filter; also keeps page cursors within Telegram's 64-byte callback data
+FILTER_TYPES = ('text', 'file')
+
+
+def parse_filters(args):
+    """Parse 'user:<id> type:<text|file> since:<YYYY-MM-DD> until:<YYYY-MM-DD>' arguments"""
+    filters = {}
+    for arg in args:
+        key, sep, value = arg.partition(':')
+        if not sep or not value:
+            raise ValueError(f"Unrecognized filter '{arg}'")
+        key = key.lower()
+        if key == 'user':
+            filters['user_id'] = int(value)
+        elif key == 'type':
+            if value.lower() not in FILTER_TYPES:
+                raise ValueError(f"Unknown message type '{value}', expected {' or '.join(FILTER_TYPES)}")
+            filters['message_type'] = value.lower()
+        elif key in ('since', 'until'):
+            filters[key] = int(datetime.fromisoformat(value).timestamp())
+        else:
+            raise ValueError(f"Unknown filter '{key}'")
+    return filters
+
+
+def encode_cursor(prefix, start, filters):
+    """Pack a page cursor and its filters into inline-keyboard callback data (max 64 bytes)"""
+    return '|'.join([
+        prefix,
+        str(start),
+        str(filters.get('user_id', '')),
+        filters.get('message_type', '') or '',
+        str(filters.get('since', '')),
+        str(filters.get('until', ''))
+    ])
+
+
+def decode_cursor(data):
+    """Inverse of encode_cursor; returns (start, filters)"""
+    _, start, user_id, message_type, since, until = data.split('|')
+    filters = {}
+    if user_id:
+        filters['user_id'] = int(user_id)
+    if message_type:
+        filters['message_type'] = message_type
+    if since:
+        filters['since'] = int(since)
+    if until:
+        filters['until'] = int(until)
+    return int(start), filters
+
+
+def pack_page(positions, start, render, limit=PAGE_LIMIT, separator='\n\n'):
+    """Pack rendered entries from positions[start:] into one message of at most limit chars.
+
+    Returns (text, end) where end is the cursor of the next page. Only the
+    entries that end up on the page are rendered.
+    """
+    parts = []
+    length = 0
+    end = start
+    while end < len(positions):
+        part = render(positions[end])
+        extra = text_length(part) + (len(separator) if parts else 0)
+        if parts and length + extra > limit:
+            break
+        if not parts and extra > limit:
+            part = truncate_text(part, limit)
+            extra = text_length(part)
+        parts.append(part)
+        length += extra
+        end += 1
+    return separator.join(parts), end
+
+
+def previous_page_start(positions, start, render, limit=PAGE_LIMIT, separator='\n\n'):
+    """Find where the page ending just before ``start`` begins, packing backwards"""
+    length = 0
+    begin = start
+    while begin > 0:
+        extra = min(text_length(render(positions[begin - 1])), limit) + (len(separator) if begin < start else 0)
+        if begin < start and length + extra > limit:
+            break
+        length += extra
+        begin -= 1
+    return begin
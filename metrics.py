@@ -0,0 +1,191 @@
+import bisect
+import functools
+import threading
+import time
+from telegram.error import RetryAfter, TimedOut, TelegramError
+from telegram.ext import DispatcherHandlerStop
+from telegram.utils.request import Request
+from profiler import handler_profiler
+from log_pipeline import enter_handler, exit_handler
+
+# Latency buckets in seconds, shared by all histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect plus three increments"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricFamily:
+    """A named metric with one child (Histogram or counter) per label set"""
+
+    def __init__(self, name, help_text, kind, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, *labels):
+        child = self.children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(labels, Histogram())
+        return child
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.children[labels] = self.children.get(labels, 0) + amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for labels, child in list(self.children.items()):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            if self.kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(child.buckets, child.counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {child.count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {child.sum}')
+                lines.append(f'{self.name}_count{{{label_text}}} {child.count}')
+            else:
+                lines.append(f'{self.name}{{{label_text}}} {child}')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = []
+        self.gauges = []  # (name, help_text, callable returning a number or {label_value: number})
+
+    def family(self, name, help_text, kind, label_names=()):
+        family = MetricFamily(name, help_text, kind, tuple(label_names))
+        self.families.append(family)
+        return family
+
+    def gauge(self, name, help_text, func, label_name=None):
+        """Register a gauge whose value is read from func() at scrape time;
+        registering a name again replaces the earlier gauge"""
+        self.gauges = [gauge for gauge in self.gauges if gauge[0] != name]
+        self.gauges.append((name, help_text, func, label_name))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for family in self.families:
+            family.render(lines)
+        for name, help_text, func, label_name in self.gauges:
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for label_value, number in value.items():
+                    lines.append(f'{name}{{{label_name}="{label_value}"}} {number}')
+            else:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+handler_latency = registry.family(
+    'bot_handler_latency_seconds', 'Time spent in each update handler', 'histogram', ('handler',))
+handler_errors = registry.family(
+    'bot_handler_errors_total', 'Exceptions escaping update handlers', 'counter', ('handler',))
+api_latency = registry.family(
+    'bot_api_request_latency_seconds', 'Outbound Bot API call latency', 'histogram', ('method', 'outcome'))
+api_calls = registry.family(
+    'bot_api_requests_total', 'Outbound Bot API calls', 'counter', ('method', 'outcome'))
+# Wall-clock time of the last successful call per Bot API method (e.g. getUpdates)
+api_last_success = {}
+
+
+def instrument(name, callback):
+    """Wrap a handler callback so every call is timed under the given handler name,
+    its log records are tagged with the handler and update, and it is profiled
+    while a /profile capture is running"""
+    histogram = handler_latency.histogram(name)
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        enter_handler(name, args[0] if args else None)
+        try:
+            return handler_profiler.call(name, callback, args, kwargs)
+        except DispatcherHandlerStop:
+            # Flow control, e.g. the flood guard ending an update early
+            raise
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            exit_handler()
+            histogram.observe(time.perf_counter() - started)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_dispatcher(dispatcher):
+    """Instrument every handler and error handler registered on the dispatcher"""
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, 'instrumented', False):
+                handler.callback = instrument(handler.callback.__name__, handler.callback)
+    for callback, run_async in list(dispatcher.error_handlers.items()):
+        if not getattr(callback, 'instrumented', False):
+            del dispatcher.error_handlers[callback]
+            dispatcher.error_handlers[instrument(callback.__name__, callback)] = run_async
+
+
+def api_outcome(error):
+    if error is None:
+        return 'ok'
+    if isinstance(error, RetryAfter):
+        return 'retry_after'
+    if isinstance(error, TimedOut):
+        return 'timeout'
+    if isinstance(error, TelegramError):
+        return type(error).__name__.lower()
+    return 'error'
+
+
+class InstrumentedRequest(Request):
+    """Request that records count and latency of every Bot API call by method and outcome"""
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        error = None
+        try:
+            return super().post(url, data, timeout)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            outcome = api_outcome(error)
+            if error is None:
+                api_last_success[method] = time.time()
+            api_latency.histogram(method, outcome).observe(time.perf_counter() - started)
+            api_calls.inc(method, outcome)
@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from telegram.error import TelegramError, RetryAfter, TimedOut, NetworkError, Unauthorized, BadRequest
+from broadcaster import TokenBucket
+from message_store import MAX_MESSAGE_LENGTH, text_length, truncate_text
+
+logger = logging.getLogger(__name__)
+
+# Alerts arriving within this many seconds of the first one are sent as one digest
+DIGEST_WINDOW = float(os.getenv('ADMIN_DIGEST_WINDOW', '3'))
+# Sustained send rate into the admin chat; Telegram allows about one message per second per chat
+ADMIN_CHAT_RATE = float(os.getenv('ADMIN_CHAT_RATE', '1'))
+ADMIN_CHAT_BURST = 3
+MAX_BACKOFF = 30
+DIGEST_SEPARATOR = '\n\n➖➖➖\n\n'
+
+
+class AdminNotifier:
+    """Queues admin alerts and forwards and delivers them from one background thread.
+
+    Alerts that arrive within the digest window are coalesced into a single
+    digest message. Every call into the admin chat goes through a token bucket,
+    flood waits and network errors are retried rather than dropped, and
+    forwards are delivered after the digest that announced them.
+    """
+
+    def __init__(self, chat_id, window=DIGEST_WINDOW, rate=ADMIN_CHAT_RATE, burst=ADMIN_CHAT_BURST):
+        self.chat_id = chat_id
+        self.window = window
+        self.bucket = TokenBucket(rate, burst)
+        self.bot = None
+        self.digests_sent = 0
+        self.alerts_sent = 0
+        self.forwards_sent = 0
+        self.dropped = 0
+        self._pending = deque()  # ('alert', text) or ('forward', from_chat_id, message_id)
+        self._first_at = None
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Alerts and forwards waiting to be delivered"""
+        return len(self._pending)
+
+    def start(self, bot):
+        """Begin delivering queued notifications with the given bot"""
+        self.bot = bot
+        self._thread = threading.Thread(target=self._run, name='AdminNotifier')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Deliver what is queued without waiting for the digest window, then stop"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self, text, forward=None):
+        """Queue an alert, optionally followed by forwarding (from_chat_id, message_id)"""
+        with self._cond:
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            self._pending.append(('alert', text))
+            if forward is not None:
+                self._pending.append(('forward',) + tuple(forward))
+            self._cond.notify()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._stopping:
+                    return None
+                self._cond.wait()
+            # Leave the window open so alerts from the same burst land in one digest
+            while not self._stopping:
+                remaining = self._first_at + self.window - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = list(self._pending)
+            self._pending.clear()
+            self._first_at = None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # An unexpected error must not kill the thread, or later alerts would only pile up
+            try:
+                self._deliver(batch)
+            except Exception:
+                logger.exception("Failed to deliver a batch of %s admin notifications", len(batch))
+
+    def _deliver(self, batch):
+        alerts = [item[1] for item in batch if item[0] == 'alert']
+        for text in build_digests(alerts):
+            if self._call(self.bot.send_message, chat_id=self.chat_id, text=text):
+                self.digests_sent += 1
+        self.alerts_sent += len(alerts)
+        for item in batch:
+            if item[0] == 'forward' and self._call(
+                    self.bot.forward_message, chat_id=self.chat_id,
+                    from_chat_id=item[1], message_id=item[2]):
+                self.forwards_sent += 1
+
+    def _call(self, method, **kwargs):
+        """Make one Bot API call, retrying until it succeeds or cannot succeed"""
+        backoff = 1
+        while True:
+            self.bucket.acquire()
+            try:
+                method(**kwargs)
+                return True
+            except RetryAfter as e:
+                logger.warning("Admin chat flood limit hit, pausing notifications for %ss", e.retry_after)
+                self.bucket.pause(float(e.retry_after))
+            except (Unauthorized, BadRequest) as e:
+                # Admin blocked the bot or the forwarded message is gone
+                self.dropped += 1
+                logger.error("Failed to notify admin: %s", e)
+                return False
+            except (TimedOut, NetworkError) as e:
+                if self._stopping and backoff > MAX_BACKOFF:
+                    self.dropped += 1
+                    logger.error("Giving up on admin notification during shutdown: %s", e)
+                    return False
+                logger.warning("Admin notification failed, retrying in %ss: %s", backoff, e)
+                time.sleep(min(backoff, MAX_BACKOFF))
+                backoff *= 2
+            except TelegramError as e:
+                # ChatMigrated, Conflict, InvalidToken and the like will not succeed on retry
+                self.dropped += 1
+                logger.error("Failed to notify admin: %s", e)
+                return False
+
+
+def build_digests(alerts, limit=MAX_MESSAGE_LENGTH):
+    """Pack alerts into as few messages as fit Telegram's length limit"""
+    if len(alerts) == 1:
+        return [truncate_text(alerts[0], limit)]
+    messages = []
+    current = []
+    size = 0
+    separator_length = text_length(DIGEST_SEPARATOR)
+    # Reserve room for the header, whose count is only known once the message is full
+    body_limit = limit - 64
+    for alert in alerts:
+        alert = truncate_text(alert, body_limit)
+        length = text_length(alert)
+        if current and size + separator_length + length > body_limit:
+            messages.append(current)
+            current, size = [], 0
+        size += (separator_length if current else 0) + length
+        current.append(alert)
+    if current:
+        messages.append(current)
+    return [
+        f"📬 Digest: {len(chunk)} new alerts\n\n" + DIGEST_SEPARATOR.join(chunk)
+        for chunk in messages
+    ]
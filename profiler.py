@@ -0,0 +1,93 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILE_SECONDS = int(os.getenv('MAX_PROFILE_SECONDS', '300'))
+# Functions listed in a profile report, by cumulative time
+REPORT_FUNCTIONS = 60
+
+
+class ProfileCapture:
+    """cProfile data of every handler call made during one capture window, merged across threads"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.handlers = {}  # handler name -> [calls, seconds]
+        self._stats = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return time.monotonic() < self.deadline
+
+    def add(self, name, profile, elapsed):
+        with self._lock:
+            calls = self.handlers.setdefault(name, [0, 0.0])
+            calls[0] += 1
+            calls[1] += elapsed
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def report(self, limit=REPORT_FUNCTIONS):
+        """Per-handler call counts and the top functions by cumulative time, as text"""
+        with self._lock:
+            out = io.StringIO()
+            out.write(f"Handler profile: {self.seconds}s window from "
+                      f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))}\n\n")
+            out.write(f"{'handler':<28}{'calls':>8}{'total s':>10}{'mean ms':>10}\n")
+            for name, (calls, seconds) in sorted(self.handlers.items(), key=lambda item: item[1][1], reverse=True):
+                out.write(f"{name:<28}{calls:>8}{seconds:>10.3f}{seconds / calls * 1000:>10.2f}\n")
+            out.write("\n")
+            if self._stats is not None:
+                self._stats.stream = out
+                self._stats.sort_stats('cumulative').print_stats(limit)
+            return out.getvalue()
+
+
+class HandlerProfiler:
+    """Runs handler calls under cProfile while a capture is active; otherwise a plain call.
+
+    Outside a capture the only cost is one attribute check per handler call.
+    """
+
+    def __init__(self):
+        self.capture = None
+        self._lock = threading.Lock()
+
+    def start(self, seconds):
+        """Begin a capture; raises RuntimeError if one is already running"""
+        with self._lock:
+            if self.capture is not None and self.capture.active:
+                raise RuntimeError("a profile capture is already running")
+            self.capture = ProfileCapture(seconds)
+            return self.capture
+
+    def call(self, name, callback, args, kwargs):
+        capture = self.capture
+        if capture is None or not capture.active:
+            return callback(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            profile.disable()
+            capture.add(name, profile, time.perf_counter() - started)
+
+
+handler_profiler = HandlerProfiler()
@@ -0,0 +1,168 @@
+import sys
+import threading
+from datetime import datetime, timezone
+from operator import attrgetter
+
+from user_directory import to_epoch
+
+# Dictionary encoding of message types; codes are positions in this list and
+# types not seen before are appended
+MESSAGE_TYPES = ['text', 'file']
+_TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+_types_lock = threading.Lock()
+
+FILE_FIELDS = ('type', 'file_id', 'file_name', 'file_size', 'mime_type', 'duration', 'title')
+
+
+def type_code(message_type):
+    code = _TYPE_CODES.get(message_type)
+    if code is None:
+        with _types_lock:
+            code = _TYPE_CODES.get(message_type)
+            if code is None:
+                code = _TYPE_CODES[message_type] = len(MESSAGE_TYPES)
+                MESSAGE_TYPES.append(sys.intern(message_type))
+    return code
+
+
+def intern_name(value):
+    """Share one string object between all records of the same name"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def iso_timestamp(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat() if epoch is not None else None
+
+
+class Record:
+    """Read-only mapping view over a __slots__ record, so code written against
+    the old entry dicts keeps working: record['user_id'], record.get('timestamp')"""
+
+    __slots__ = ()
+    # key -> function(record) returning the value the old dict held under that key
+    FIELDS = {}
+
+    def __getitem__(self, key):
+        return self.FIELDS[key](self)
+
+    def get(self, key, default=None):
+        getter = self.FIELDS.get(key)
+        return getter(self) if getter is not None else default
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def keys(self):
+        return self.FIELDS.keys()
+
+    def to_dict(self):
+        """The entry as the plain dict it used to be, e.g. for JSON"""
+        return {key: getter(self) for key, getter in self.FIELDS.items()}
+
+
+class FileInfo(Record):
+    """Attachment of a file message; absent fields are None"""
+
+    __slots__ = FILE_FIELDS
+    FIELDS = {name: attrgetter(name) for name in FILE_FIELDS}
+
+    def __init__(self, type=None, file_id=None, file_name=None, file_size=None, mime_type=None, duration=None,
+                 title=None):
+        self.type = intern_name(type)
+        self.file_id = file_id
+        self.file_name = file_name
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.duration = duration
+        self.title = title
+
+    @classmethod
+    def from_value(cls, value):
+        if value is None or isinstance(value, FileInfo):
+            return value
+        return cls(**value) if value else None
+
+    def to_dict(self):
+        # Only the fields that were set, like the dicts built by the handlers
+        return {name: getattr(self, name) for name in FILE_FIELDS if getattr(self, name) is not None}
+
+
+class MessageRecord(Record):
+    """One logged message: integer epoch time, interned names, message type code
+    and the reply flag packed into one small int"""
+
+    __slots__ = ('user_id', 'user_name', 'username', 'message', 'time', 'kind', 'file')
+    FIELDS = {
+        'user_id': attrgetter('user_id'),
+        'user_name': attrgetter('user_name'),
+        'username': attrgetter('username'),
+        'message': attrgetter('message'),
+        'message_type': lambda record: MESSAGE_TYPES[record.kind >> 1],
+        'file_info': attrgetter('file'),
+        'timestamp': lambda record: iso_timestamp(record.time),
+        'reply_to_bot': lambda record: bool(record.kind & 1),
+    }
+
+    def __init__(self, user_id, user_name, username, message, message_type='text', file_info=None,
+                 timestamp=None, reply_to_bot=False):
+        self.user_id = user_id
+        self.user_name = intern_name(user_name)
+        self.username = intern_name(username)
+        self.message = message
+        self.time = to_epoch(timestamp)
+        self.kind = type_code(message_type or 'text') << 1 | (1 if reply_to_bot else 0)
+        self.file = FileInfo.from_value(file_info)
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry['user_id'], entry.get('user_name'), entry.get('username'), entry.get('message'),
+                   entry.get('message_type', 'text'), entry.get('file_info'), entry.get('timestamp'),
+                   entry.get('reply_to_bot', False))
+
+    def to_dict(self):
+        entry = {
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'username': self.username,
+            'message': self.message,
+            'message_type': MESSAGE_TYPES[self.kind >> 1],
+            'file_info': self.file.to_dict() if self.file is not None else None,
+            'timestamp': iso_timestamp(self.time),
+        }
+        # Only present when set, as in the dicts the handlers used to build
+        if self.kind & 1:
+            entry['reply_to_bot'] = True
+        return entry
+
+    def __repr__(self):
+        return f"MessageRecord({self.user_id}, {self['message_type']}, {self.time})"
+
+
+class FeedbackRecord(Record):
+    """One feedback entry: integer epoch time and interned names"""
+
+    __slots__ = ('user_id', 'user_name', 'username', 'rating', 'comment', 'time')
+    FIELDS = {
+        'user_id': attrgetter('user_id'),
+        'user_name': attrgetter('user_name'),
+        'username': attrgetter('username'),
+        'rating': attrgetter('rating'),
+        'comment': attrgetter('comment'),
+        'timestamp': lambda record: iso_timestamp(record.time),
+    }
+
+    def __init__(self, user_id, user_name, username, rating, comment, timestamp=None):
+        self.user_id = user_id
+        self.user_name = intern_name(user_name)
+        self.username = intern_name(username)
+        self.rating = rating
+        self.comment = comment
+        self.time = to_epoch(timestamp)
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry['user_id'], entry.get('user_name'), entry.get('username'), entry.get('rating'),
+                   entry.get('comment'), entry.get('timestamp'))
+
+    def __repr__(self):
+        return f"FeedbackRecord({self.user_id}, {self.rating}, {self.time})"
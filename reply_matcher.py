@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often the rules file is checked for changes
+RELOAD_INTERVAL = float(os.getenv('AUTO_REPLIES_RELOAD_INTERVAL', '5'))
+
+
+class Rule:
+    __slots__ = ('keyword', 'response', 'priority', 'order', 'rank')
+
+    def __init__(self, keyword, response, priority, order):
+        self.keyword = keyword
+        self.response = response
+        self.priority = priority
+        self.order = order
+        # Sort key: higher priority first, then earlier in the rules file
+        self.rank = (-priority, order)
+
+
+class Automaton:
+    """Aho-Corasick automaton over all rule keywords.
+
+    Matching walks each message once, so the cost per message does not grow
+    with the number of rules.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]  # best rule ending exactly at this state
+        self._dict_link = [0]  # next state on the fail chain that has an output
+
+        for rule in rules:
+            state = 0
+            for ch in rule.keyword:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._dict_link.append(0)
+                state = next_state
+            current = self._output[state]
+            if current is None or rule.rank < current.rank:
+                self._output[state] = rule
+
+        # Breadth-first pass to build failure and dictionary links
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                fail = self._fail[child]
+                self._dict_link[child] = fail if self._output[fail] is not None else self._dict_link[fail]
+
+    def best_match(self, text):
+        """Return the highest-ranked rule whose keyword occurs in text as whole words"""
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        best = None
+        state = 0
+        length = len(text)
+        for end, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not state:
+                continue
+
+            match_state = state if output[state] is not None else dict_link[state]
+            if not match_state:
+                continue
+            # Whole-word semantics: "hi" must not fire inside "this"
+            if end + 1 < length and _is_word_char(text[end + 1]):
+                continue
+            while match_state:
+                rule = output[match_state]
+                start = end - len(rule.keyword) + 1
+                if (start == 0 or not _is_word_char(text[start - 1])) and (best is None or rule.rank < best.rank):
+                    best = rule
+                match_state = dict_link[match_state]
+        return best
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+def parse_rules(data):
+    """Build Rule objects from {keyword: response} or a list of rule dicts"""
+    if isinstance(data, dict):
+        data = [{'keyword': keyword, 'response': response} for keyword, response in data.items()]
+    rules = []
+    for order, item in enumerate(data):
+        keyword = item['keyword'].lower().strip()
+        if not keyword:
+            continue
+        rules.append(Rule(keyword, item['response'], int(item.get('priority', 0)), order))
+    return rules
+
+
+class ReplyMatcher:
+    """Auto-reply rules compiled into one automaton and hot-reloaded from a JSON file"""
+
+    def __init__(self, path, default_rules=None, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.default_rules = default_rules or {}
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._automaton = Automaton(parse_rules(self.default_rules))
+        self.reload()
+
+    def __len__(self):
+        return len(self._automaton.rules)
+
+    def reload(self):
+        """Recompile the rules if the rules file changed since the last load"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self._mtime is not None:
+                logger.warning("Auto-reply rules file %s disappeared; keeping current rules", self.path)
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path, encoding='utf-8') as rules_file:
+                rules = parse_rules(json.load(rules_file))
+            automaton = Automaton(rules)
+        except Exception as e:
+            logger.error("Failed to load auto-reply rules from %s: %s", self.path, e)
+            self._mtime = mtime  # Don't retry a broken file until it changes again
+            return False
+
+        # Swapping one attribute keeps concurrent matches on a consistent automaton
+        self._automaton = automaton
+        self._mtime = mtime
+        logger.info("Loaded %s auto-reply rules from %s", len(rules), self.path)
+        return True
+
+    def match(self, text):
+        """Return (keyword, response) for the best rule matching text, or None"""
+        now = time.monotonic()
+        if now >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                self._next_check = now + self.reload_interval
+                self.reload()
+            finally:
+                self._lock.release()
+
+        rule = self._automaton.best_match(text.lower())
+        return (rule.keyword, rule.response) if rule else None
@@ -0,0 +1,206 @@
+import bisect
+import logging
+import math
+import os
+import re
+import struct
+import threading
+from array import array
+
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'search_index.bin')
+SAVE_INTERVAL = float(os.getenv('SEARCH_INDEX_SAVE_INTERVAL', '300'))
+# Only the newest matches are ranked, which bounds query time on very common terms
+MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', '5000'))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+MAGIC = b'BSIX1'
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def document_text(entry):
+    """Searchable text of a message_log entry: message or caption plus the file name"""
+    file_info = entry.get('file_info') or {}
+    return f"{entry.get('message') or ''} {file_info.get('file_name') or ''}"
+
+
+def _user_key(user_id):
+    return f'\x00u{user_id}'
+
+
+def _type_key(message_type):
+    return f'\x00t{message_type}'
+
+
+def _contains(postings, position):
+    index = bisect.bisect_left(postings, position)
+    return index < len(postings) and postings[index] == position
+
+
+def _term_frequency(postings, position):
+    # A term occurring n times in a message appears n times in a row in its postings
+    return bisect.bisect_right(postings, position) - bisect.bisect_left(postings, position)
+
+
+class SearchIndex:
+    """Inverted index over message_log positions, built incrementally.
+
+    Each term maps to a sorted array of the positions containing it (repeated
+    once per occurrence). The sender and message type are indexed as reserved
+    terms, so filters are just more postings to intersect. Per-position
+    timestamps and lengths back the since/until filters and BM25 ranking.
+    """
+
+    def __init__(self):
+        self.count = 0  # positions 0..count-1 are indexed
+        self.total_length = 0
+        self._postings = {}
+        self._times = array('I')
+        self._lengths = array('H')
+        self._pending = {}  # positions added ahead of count, waiting for the gap to fill
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, position, entry):
+        """Index the entry at a message_log position; entries may arrive out of order"""
+        with self._lock:
+            if position < self.count:
+                return
+            if position > self.count:
+                self._pending[position] = entry
+                return
+            self._add(entry)
+            while self.count in self._pending:
+                self._add(self._pending.pop(self.count))
+
+    def catch_up(self, entries, start):
+        """Index entries for positions start, start+1, ... (e.g. replayed history)"""
+        for position, entry in enumerate(entries, start):
+            self.add(position, entry)
+
+    def _add(self, entry):
+        position = self.count
+        tokens = tokenize(document_text(entry))
+        for token in tokens:
+            self._postings.setdefault(token, array('I')).append(position)
+        self._postings.setdefault(_user_key(entry['user_id']), array('I')).append(position)
+        self._postings.setdefault(_type_key(entry.get('message_type', 'text')), array('I')).append(position)
+        self._times.append(max(0, entry.time or 0))
+        self._lengths.append(min(len(tokens), 65535))
+        self.total_length += len(tokens)
+        self.count += 1
+
+    def search(self, query, user_id=None, message_type=None, since=None, until=None, limit=MAX_CANDIDATES):
+        """Positions of messages containing every query term, best match first.
+
+        Candidates are collected newest first and at most ``limit`` of them are
+        ranked by BM25; ties go to the newer message.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            lists = [self._postings.get(term) for term in terms]
+            if user_id is not None:
+                lists.append(self._postings.get(_user_key(user_id)))
+            if message_type is not None:
+                lists.append(self._postings.get(_type_key(message_type)))
+            if any(not postings for postings in lists):
+                return []
+            scored = [(self._postings[term], self._idf(len(self._postings[term]))) for term in terms]
+            count = self.count
+
+            # Walk the rarest list newest first and probe the others
+            lists.sort(key=len)
+            driver, others = lists[0], lists[1:]
+            times = self._times
+            matches = []
+            previous = None
+            for position in reversed(driver):
+                if position == previous:
+                    continue
+                previous = position
+                if since is not None and times[position] < since:
+                    continue
+                if until is not None and times[position] >= until:
+                    continue
+                if all(_contains(postings, position) for postings in others):
+                    matches.append(position)
+                    if len(matches) >= limit:
+                        break
+
+            average = (self.total_length / count) if count else 1.0
+            lengths = self._lengths
+            scores = {}
+            for position in matches:
+                norm = K1 * (1 - B + B * lengths[position] / (average or 1.0))
+                score = 0.0
+                for postings, idf in scored:
+                    tf = _term_frequency(postings, position)
+                    score += idf * tf * (K1 + 1) / (tf + norm)
+                scores[position] = score
+        matches.sort(key=lambda position: (-scores[position], -position))
+        return matches
+
+    def _idf(self, document_frequency):
+        return math.log(1 + (self.count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def save(self, path=SEARCH_INDEX_PATH):
+        """Write the index atomically so a restart only indexes messages logged after this"""
+        temporary = path + '.tmp'
+        # Copy under the lock (memory copies only) and write after releasing it,
+        # so record_message is not held up for the whole file write
+        with self._lock:
+            count, total_length = self.count, self.total_length
+            times, lengths = self._times[:], self._lengths[:]
+            postings_by_term = [(term, postings[:]) for term, postings in self._postings.items()]
+        with open(temporary, 'wb') as index_file:
+            index_file.write(MAGIC)
+            index_file.write(struct.pack('<QQI', count, total_length, len(postings_by_term)))
+            times.tofile(index_file)
+            lengths.tofile(index_file)
+            for term, postings in postings_by_term:
+                key = term.encode('utf-8')
+                index_file.write(struct.pack('<HI', len(key), len(postings)))
+                index_file.write(key)
+                postings.tofile(index_file)
+        os.replace(temporary, path)
+        logger.info("Saved search index covering %s messages to %s", count, path)
+
+    @classmethod
+    def load(cls, path=SEARCH_INDEX_PATH):
+        """Read a saved index; returns an empty index if there is none or it is unreadable"""
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        try:
+            with open(path, 'rb') as index_file:
+                if index_file.read(len(MAGIC)) != MAGIC:
+                    raise ValueError('not a search index file')
+                count, total_length, terms = struct.unpack('<QQI', index_file.read(20))
+                index._times.fromfile(index_file, count)
+                index._lengths.fromfile(index_file, count)
+                for _ in range(terms):
+                    key_length, size = struct.unpack('<HI', index_file.read(6))
+                    postings = array('I')
+                    term = index_file.read(key_length).decode('utf-8')
+                    postings.fromfile(index_file, size)
+                    index._postings[term] = postings
+            index.count = count
+            index.total_length = total_length
+            logger.info("Loaded search index covering %s messages from %s", count, path)
+            return index
+        except Exception as e:
+            logger.error("Failed to load search index from %s, rebuilding: %s", path, e)
+            return cls()
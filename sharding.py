@@ -0,0 +1,217 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from telegram import Update
+from telegram.ext import Dispatcher, JobQueue, Updater
+from dispatch import ProgressQueue, create_bot
+
+logger = logging.getLogger(__name__)
+
+# Sharded deployment: one coordinator process receives updates and routes each
+# user's updates to one of SHARD_WORKERS worker processes (0 or 1 = single process)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '0'))
+SHARD_QUEUE_DEPTH = int(os.getenv('SHARD_QUEUE_DEPTH', '1024'))
+# How often the coordinator pulls what the workers wrote to the shared store
+SHARD_FOLLOW_INTERVAL = float(os.getenv('SHARD_FOLLOW_INTERVAL', '1'))
+REPORT_INTERVAL = 0.25
+
+
+def shard_of(user_id, count):
+    """Shard that owns a user; stable across processes and restarts"""
+    return user_id % count
+
+
+class ShardPool:
+    """Worker processes, each fed its own bounded queue of updates and tasks.
+
+    Workers send progress back on a shared results queue: how many updates
+    they have processed and the state of their part of each broadcast.
+    """
+
+    def __init__(self, count, target, args=(), queue_depth=SHARD_QUEUE_DEPTH):
+        # Spawn rather than fork: the coordinator already runs threads and holds connections
+        context = multiprocessing.get_context('spawn')
+        self.count = count
+        self.queues = [context.Queue(queue_depth) for _ in range(count)]
+        self.results = context.Queue()
+        self.processed = [0] * count
+        self.ready = threading.Event()  # set once every worker has reported in
+        self._reported = set()
+        self._jobs = {}  # job_id -> (BroadcastJob, baseline counts, {shard: (sent, failed, retries, done)})
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.processes = [
+            context.Process(target=target, args=(index, count, self.queues[index], self.results) + tuple(args),
+                            name=f'ShardWorker-{index}', daemon=True)
+            for index in range(count)
+        ]
+        self._listener = threading.Thread(target=self._listen, name='ShardResults')
+        self._listener.daemon = True
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        self._listener.start()
+        logger.info("Started %s shard workers", self.count)
+        return self
+
+    def route(self, user_id, update_data):
+        """Queue an update for the worker that owns the user; blocks while that worker is backed up"""
+        self.queues[shard_of(user_id, self.count)].put(('update', update_data))
+
+    def broadcast(self, job, recipients, specs):
+        """Split a broadcast across the workers that own its recipients.
+
+        specs are (bot_method_name, kwargs) pairs; progress lands on job.
+        """
+        by_shard = {}
+        for chat_id in recipients:
+            by_shard.setdefault(shard_of(chat_id, self.count), []).append(chat_id)
+        # Persistent jobs keep their id so workers can checkpoint deliveries against it
+        job_id = job.job_id if job.job_id is not None else f"local-{next(self._job_ids)}"
+        # A resumed job already counts recipients handled before the restart
+        baseline = (job.sent, job.failed, job.retries)
+        with self._lock:
+            self._jobs[job_id] = (job, baseline, {shard: (0, 0, 0, False) for shard in by_shard})
+        if not by_shard:
+            job.done.set()
+        for shard, chat_ids in by_shard.items():
+            self.queues[shard].put(('broadcast', job_id, job.title, chat_ids, specs))
+        return job
+
+    def cancel(self, job_id):
+        """Ask every worker to skip the remaining recipients of a broadcast"""
+        for updates in self.queues:
+            updates.put(('cancel', job_id))
+
+    def stop(self, timeout=30):
+        """Let workers drain their queues, then wait for them to exit"""
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("%s did not stop in %ss; terminating", process.name, timeout)
+                process.terminate()
+        self.results.put(None)
+        self._listener.join(timeout)
+
+    def _listen(self):
+        for message in iter(self.results.get, None):
+            try:
+                if message[0] == 'processed':
+                    _, shard, processed = message
+                    self.processed[shard] = processed
+                    if not self.ready.is_set():
+                        self._reported.add(shard)
+                        if len(self._reported) == self.count:
+                            self.ready.set()
+                elif message[0] == 'broadcast':
+                    self._record_broadcast(*message[1:])
+            except Exception as e:
+                logger.error("Bad message from shard worker: %s", e)
+
+    def _record_broadcast(self, job_id, shard, sent, failed, retries, done):
+        with self._lock:
+            if job_id not in self._jobs:
+                return
+            job, baseline, shards = self._jobs[job_id]
+            shards[shard] = (sent, failed, retries, done)
+            totals = [base + sum(counts) for base, counts in zip(baseline, zip(*shards.values()))]
+            finished = all(state[3] for state in shards.values())
+            if finished:
+                del self._jobs[job_id]
+        job.set_counts(totals[0], totals[1], totals[2])
+        if finished:
+            job.finished_at = time.time()
+            job.done.set()
+
+
+class ShardRouter(Dispatcher):
+    """Dispatcher of the coordinator process: updates for which is_local(update)
+    is false are routed to the shard worker owning their user instead of
+    being handled here."""
+
+    def __init__(self, *args, pool, is_local, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+        self.is_local = is_local
+
+    def process_update(self, update):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None or self.is_local(update):
+            return super().process_update(update)
+        self.pool.route(user.id, update.to_dict())
+
+
+def create_sharded_updater(token, pool, is_local, base_url=None):
+    """Build the coordinator's Updater, whose dispatcher routes updates to the pool"""
+    bot = create_bot(token, base_url=base_url)
+    job_queue = JobQueue()
+    dispatcher = ShardRouter(
+        bot,
+        ProgressQueue(),
+        job_queue=job_queue,
+        exception_event=threading.Event(),
+        use_context=True,
+        pool=pool,
+        is_local=is_local
+    )
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)
+
+
+def serve_shard(index, updates, results, dispatcher, run_broadcast, cancel_broadcast):
+    """Main loop of a worker process: handle routed updates and broadcast parts
+    until the coordinator sends None.
+
+    run_broadcast(job_id, title, chat_ids, specs, report) starts this shard's part
+    of a broadcast and calls report(job) with its BroadcastJob on progress and
+    when done; cancel_broadcast(job_id) stops it.
+    """
+    executor = getattr(dispatcher, 'executor', None)
+    processed = 0
+    next_report = time.monotonic() + REPORT_INTERVAL
+
+    def report_processed():
+        pending = executor.depth if executor is not None else 0
+        results.put(('processed', index, processed - pending))
+
+    # The first report tells the coordinator this worker is up
+    report_processed()
+
+    while True:
+        try:
+            item = updates.get(timeout=REPORT_INTERVAL)
+        except queue.Empty:
+            item = ()
+        if item is None:
+            break
+
+        if item and item[0] == 'update':
+            try:
+                dispatcher.process_update(Update.de_json(item[1], dispatcher.bot))
+            except Exception:
+                logger.exception("Shard %s failed to process an update", index)
+            processed += 1
+        elif item and item[0] == 'broadcast':
+            _, job_id, title, chat_ids, specs = item
+
+            def report(job, job_id=job_id):
+                results.put(('broadcast', job_id, index, job.sent, job.failed, job.retries, job.done.is_set()))
+
+            run_broadcast(job_id, title, chat_ids, specs, report)
+        elif item and item[0] == 'cancel':
+            cancel_broadcast(item[1])
+
+        if time.monotonic() >= next_report:
+            next_report = time.monotonic() + REPORT_INTERVAL
+            report_processed()
+
+    if executor is not None:
+        executor.shutdown()
+    report_processed()
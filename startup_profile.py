@@ -0,0 +1,98 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# How many of the slowest imports the profile lists
+TOP_IMPORTS = 15
+
+
+class StartupProfile:
+    """Wall-clock breakdown of process startup: named phases plus top-level imports.
+
+    Phases may run concurrently on different threads, so their durations can
+    add up to more than the total time to ready.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ready_after = None
+        self.phases = {}
+        self.imports = {}
+        self._lock = threading.Lock()
+        self._import = None
+        self._depth = threading.local()
+        self._thread = None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+
+    def mark_ready(self):
+        """Record the time from process start to ready; only the first call counts"""
+        with self._lock:
+            if self.ready_after is None:
+                self.ready_after = time.perf_counter() - self.started
+
+    def start_import_timing(self):
+        """Time every module first imported on this thread from now on, by top-level import"""
+        self._import = builtins.__import__
+        self._thread = threading.get_ident()
+        builtins.__import__ = self._timed_import
+
+    def stop_import_timing(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._import or builtins.__import__
+        depth = getattr(self._depth, 'value', 0)
+        # Only the outermost import of a module not loaded yet is timed; nested
+        # imports are included in it
+        if depth or level or name in sys.modules or threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+        self._depth.value = depth + 1
+        started = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            self._depth.value = depth
+            with self._lock:
+                self.imports[name] = time.perf_counter() - started
+
+    def snapshot(self):
+        """Profile as plain data for /health, durations in milliseconds"""
+        with self._lock:
+            slowest = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)[:TOP_IMPORTS]
+            return {
+                'ready_after_ms': round(self.ready_after * 1000, 1) if self.ready_after is not None else None,
+                'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+                'imports_ms': {name: round(seconds * 1000, 1) for name, seconds in slowest},
+                'imports_total_ms': round(sum(self.imports.values()) * 1000, 1)
+            }
+
+    def report(self):
+        """Human readable profile for the console"""
+        data = self.snapshot()
+        lines = [f"⏱ Startup profile (ready after {data['ready_after_ms']} ms)"]
+        lines.append("  Phases:")
+        for name, ms in data['phases_ms'].items():
+            lines.append(f"    {name:<28}{ms:>10.1f} ms")
+        lines.append(f"  Slowest imports ({data['imports_total_ms']} ms in total):")
+        for name, ms in data['imports_ms'].items():
+            lines.append(f"    {name:<28}{ms:>10.1f} ms")
+        return '\n'.join(lines)
+
+
+# Created on first import, which main.py does before anything else
+profile = StartupProfile()
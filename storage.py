@@ -0,0 +1,460 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from records import MessageRecord, FeedbackRecord
+
+logger = logging.getLogger(__name__)
+
+# Storage configuration
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')  # 'sqlite' or 'memory'
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'bot_data.db')
+BATCH_SIZE = int(os.getenv('STORAGE_BATCH_SIZE', '1000'))
+FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '0.05'))  # Max delay before a group commit
+CHECKPOINT_INTERVAL = float(os.getenv('STORAGE_CHECKPOINT_INTERVAL', '60'))
+# A failed batch is retried with doubling delays up to this cap before it is given up
+WRITE_RETRIES = int(os.getenv('STORAGE_WRITE_RETRIES', '10'))
+WRITE_RETRY_MAX_DELAY = float(os.getenv('STORAGE_WRITE_RETRY_MAX_DELAY', '5'))
+
+MESSAGE_COLUMNS = ('user_id', 'user_name', 'username', 'message', 'message_type',
+                   'file_info', 'timestamp', 'reply_to_bot')
+FEEDBACK_COLUMNS = ('user_id', 'user_name', 'username', 'rating', 'comment', 'timestamp')
+USER_COLUMNS = ('user_id', 'user_name', 'username', 'first_seen', 'last_seen', 'message_count')
+BROADCAST_COLUMNS = ('id', 'title', 'specs', 'chat_id', 'status', 'total', 'sent', 'failed', 'retries',
+                     'created_at', 'finished_at', 'answers_upto')
+
+# Delivery state of one broadcast recipient
+DELIVERY_PENDING = 0
+DELIVERY_SENT = 1
+DELIVERY_FAILED = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER, user_name TEXT, username TEXT, message TEXT,
+    message_type TEXT, file_info TEXT, timestamp TEXT, reply_to_bot INTEGER,
+    status INTEGER DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER, user_name TEXT, username TEXT, rating INTEGER,
+    comment TEXT, timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    user_name TEXT, username TEXT, first_seen INTEGER, last_seen INTEGER,
+    message_count INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY,
+    title TEXT, specs TEXT, chat_id INTEGER, status TEXT, total INTEGER,
+    sent INTEGER DEFAULT 0, failed INTEGER DEFAULT 0, retries INTEGER DEFAULT 0,
+    created_at INTEGER, finished_at INTEGER, answers_upto INTEGER
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id INTEGER, chat_id INTEGER, state INTEGER DEFAULT 0,
+    PRIMARY KEY (broadcast_id, chat_id)
+) WITHOUT ROWID;
+"""
+
+UPSERT_USER = """
+INSERT INTO users (user_id, user_name, username, first_seen, last_seen, message_count)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    user_name = excluded.user_name,
+    username = excluded.username,
+    first_seen = COALESCE(users.first_seen, excluded.first_seen),
+    last_seen = COALESCE(excluded.last_seen, users.last_seen),
+    message_count = excluded.message_count
+"""
+
+
+class MemoryStorage:
+    """Storage backend that keeps nothing; state lives only in memory"""
+
+    _broadcast_ids = itertools.count(1)
+    # Why message writes were stopped after a lost batch, or None while they are persisted
+    failed = None
+    # Called with that reason once, from the writer thread
+    on_failure = None
+
+    def load_users(self, seen_since=None):
+        """Return persisted users as (user_id, user_name, username, first_seen, last_seen, message_count) rows,
+        optionally only those last seen at or after the epoch seen_since"""
+        return []
+
+    def load_feedback(self, after=0):
+        """Return persisted feedback entries with id > after in insertion order"""
+        return []
+
+    def last_message_id(self):
+        """Id of the newest persisted message; ids count up from 1 in insertion order"""
+        return 0
+
+    def iter_messages(self, after=0, upto=None, chunk_size=10000):
+        """Yield persisted messages with after < id <= upto in insertion order, in chunks"""
+        return iter(())
+
+    def load_message_statuses(self):
+        """Return (message id, status) of every persisted message that is no longer open"""
+        return []
+
+    def update_message_status(self, message_id, status):
+        pass
+
+    def load_broadcasts(self, status=None, limit=None):
+        """Return persisted broadcast jobs as dicts keyed by BROADCAST_COLUMNS, newest first"""
+        return []
+
+    def load_broadcast(self, broadcast_id):
+        """Return one persisted broadcast job, or None"""
+        return None
+
+    def pending_recipients(self, broadcast_id):
+        """Chat ids of a broadcast's recipients that have not been delivered to yet"""
+        return []
+
+    def delivered_recipients(self, broadcast_id):
+        """Chat ids of a broadcast's recipients it was sent to successfully"""
+        return []
+
+    def delivery_counts(self, broadcast_id):
+        """(sent, failed) recipients of a broadcast, counted from their delivery states"""
+        return 0, 0
+
+    def create_broadcast(self, title, specs, chat_id, recipients, answers_upto=None):
+        """Persist a new broadcast job with all its recipients pending; returns its id.
+
+        answers_upto marks a reply to open messages: recipients' open messages
+        before that log position are answered once they are sent to.
+        """
+        return next(self._broadcast_ids)
+
+    def record_delivery(self, broadcast_id, chat_id, ok):
+        pass
+
+    def update_broadcast(self, broadcast_id, status, sent, failed, retries, finished_at=None):
+        pass
+
+    def append_message(self, entry):
+        pass
+
+    def append_feedback(self, entry):
+        pass
+
+    def upsert_user(self, record):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(MemoryStorage):
+    """SQLite (WAL mode) backend with a background group-commit writer.
+
+    Handlers only enqueue writes; a single writer thread drains the queue and
+    commits whole batches in one transaction, so no handler waits on fsync.
+    The WAL is checkpointed periodically so startup only replays its tail.
+    """
+
+    def __init__(self, path=STORAGE_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self._queue = queue.Queue()
+        self._conn = self._connect()
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._writer = threading.Thread(target=self._write_loop, name='StorageWriter')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _connect(self):
+        # Several processes may share the database in sharded mode; wait out their commits
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # NORMAL only syncs at checkpoints in WAL mode, which is what makes batching cheap
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA wal_autocheckpoint=0')
+        return conn
+
+    def _migrate(self):
+        """Add columns introduced after a database was first created"""
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(users)')}
+        if 'message_count' not in columns:
+            self._conn.execute('ALTER TABLE users ADD COLUMN message_count INTEGER DEFAULT 0')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(messages)')}
+        if 'status' not in columns:
+            # Messages logged before statuses existed start out open
+            self._conn.execute('ALTER TABLE messages ADD COLUMN status INTEGER DEFAULT 1')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(broadcasts)')}
+        if 'answers_upto' not in columns:
+            self._conn.execute('ALTER TABLE broadcasts ADD COLUMN answers_upto INTEGER')
+        # Lets the closed statuses load from the index alone, without reading message rows
+        self._conn.execute('CREATE INDEX IF NOT EXISTS messages_status ON messages (status)')
+
+    def _read(self, sql, params=()):
+        # Reads get their own connection so they can run beside the writer thread,
+        # and see rows committed by other processes sharing the database
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def load_users(self, seen_since=None):
+        if seen_since is None:
+            return self._read(f"SELECT {', '.join(USER_COLUMNS)} FROM users")
+        return self._read(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE last_seen >= ?", (seen_since,))
+
+    def load_feedback(self, after=0):
+        return [FeedbackRecord(*row) for row in self._read(
+            f"SELECT {', '.join(FEEDBACK_COLUMNS)} FROM feedback WHERE id > ? ORDER BY id", (after,))]
+
+    def _broadcasts(self, where='', params=(), limit=None):
+        sql = f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts {where} ORDER BY id DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        broadcasts = []
+        for row in self._read(sql, params):
+            broadcast = dict(zip(BROADCAST_COLUMNS, row))
+            broadcast['specs'] = [tuple(spec) for spec in json.loads(broadcast['specs'])]
+            broadcasts.append(broadcast)
+        return broadcasts
+
+    def load_broadcasts(self, status=None, limit=None):
+        if status is None:
+            return self._broadcasts(limit=limit)
+        return self._broadcasts('WHERE status = ?', (status,), limit)
+
+    def load_broadcast(self, broadcast_id):
+        broadcasts = self._broadcasts('WHERE id = ?', (broadcast_id,))
+        return broadcasts[0] if broadcasts else None
+
+    def pending_recipients(self, broadcast_id):
+        return [row[0] for row in self._read(
+            "SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND state = ?",
+            (broadcast_id, DELIVERY_PENDING))]
+
+    def delivered_recipients(self, broadcast_id):
+        return [row[0] for row in self._read(
+            "SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND state = ?",
+            (broadcast_id, DELIVERY_SENT))]
+
+    def delivery_counts(self, broadcast_id):
+        counts = dict(self._read(
+            "SELECT state, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY state",
+            (broadcast_id,)))
+        return counts.get(DELIVERY_SENT, 0), counts.get(DELIVERY_FAILED, 0)
+
+    def create_broadcast(self, title, specs, chat_id, recipients, answers_upto=None):
+        # Written right away rather than through the queue: the caller needs the id,
+        # and every recipient must be on disk before the first delivery is recorded
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO broadcasts (title, specs, chat_id, status, total, created_at, answers_upto) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (title, json.dumps(specs), chat_id, 'running', len(recipients), int(time.time()), answers_upto))
+                broadcast_id = cursor.lastrowid
+                conn.executemany(
+                    "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, chat_id) VALUES (?, ?)",
+                    ((broadcast_id, chat_id) for chat_id in recipients))
+            return broadcast_id
+        finally:
+            conn.close()
+
+    def record_delivery(self, broadcast_id, chat_id, ok):
+        self._queue.put(('deliveries', (DELIVERY_SENT if ok else DELIVERY_FAILED, broadcast_id, chat_id)))
+
+    def update_broadcast(self, broadcast_id, status, sent, failed, retries, finished_at=None):
+        self._queue.put(('broadcasts', (status, sent, failed, retries, finished_at, broadcast_id)))
+
+    def load_message_statuses(self):
+        # Open is the default and the rare case over time, so only the closed ones are read
+        return self._read("SELECT id, status FROM messages WHERE status > 1")
+
+    def update_message_status(self, message_id, status):
+        self._queue.put(('statuses', (status, message_id)))
+
+    def last_message_id(self):
+        return self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+
+    def iter_messages(self, after=0, upto=None, chunk_size=10000):
+        # Separate read connection so restoring history never blocks the writer
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE id > ? AND id <= ? ORDER BY id",
+                (after, upto if upto is not None else 2 ** 63 - 1))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [MessageRecord(user_id, user_name, username, message, message_type,
+                                     json.loads(file_info) if file_info else None, timestamp, bool(reply_to_bot))
+                       for user_id, user_name, username, message, message_type, file_info, timestamp, reply_to_bot
+                       in rows]
+        finally:
+            conn.close()
+
+    def append_message(self, entry):
+        file_info = entry.get('file_info')
+        self._queue.put(('messages', (
+            entry['user_id'], entry['user_name'], entry['username'], entry['message'],
+            entry.get('message_type', 'text'), json.dumps(file_info.to_dict()) if file_info else None,
+            entry.get('timestamp'), 1 if entry.get('reply_to_bot') else 0
+        )))
+
+    def append_feedback(self, entry):
+        self._queue.put(('feedback', tuple(entry.get(column) for column in FEEDBACK_COLUMNS)))
+
+    def upsert_user(self, record):
+        self._queue.put(('users', (
+            record.user_id, record.user_name, record.username,
+            record.first_seen, record.last_seen, record.message_count
+        )))
+
+    def flush(self):
+        """Block until every write queued so far has been committed"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        done.wait()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._checkpoint()
+        self._conn.close()
+
+    def _write_loop(self):
+        last_checkpoint = time.monotonic()
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.checkpoint_interval))
+            except queue.Empty:
+                pass
+
+            # Give concurrent writers a brief window to join this commit
+            deadline = time.monotonic() + self.flush_interval
+            while batch and batch[-1] is not None and batch[-1][0] != 'flush' and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            stop = self._commit(batch)
+
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                self._checkpoint()
+                last_checkpoint = time.monotonic()
+            if stop:
+                return
+
+    def _commit(self, batch):
+        """Write one batch in a single transaction; return True on shutdown"""
+        rows = {'messages': [], 'feedback': [], 'users': [], 'deliveries': [], 'broadcasts': [], 'statuses': []}
+        waiters = []
+        stop = False
+        for item in batch:
+            if item is None:
+                stop = True
+            elif item[0] == 'flush':
+                waiters.append(item[1])
+            elif item[0] == 'messages' and self.failed is not None:
+                # After a lost message batch these rows would be stored under the wrong ids
+                continue
+            else:
+                rows[item[0]].append(item[1])
+
+        try:
+            # Message ids double as log positions (id = position + 1), so a lost
+            # batch would shift every later row; retry rather than drop it
+            attempt = 0
+            while any(rows.values()):
+                try:
+                    self._write_rows(rows)
+                    break
+                except Exception as e:
+                    if self._conn.in_transaction:
+                        self._conn.execute('ROLLBACK')
+                    attempt += 1
+                    if attempt > WRITE_RETRIES:
+                        logger.error("Storage write failed for batch of %s items, giving up after %s attempts: %s",
+                                     len(batch), attempt, e)
+                        if rows['messages']:
+                            self._fail(f"lost a batch of {len(rows['messages'])} messages: {e}")
+                        break
+                    delay = min(WRITE_RETRY_MAX_DELAY, 0.1 * 2 ** (attempt - 1))
+                    logger.warning("Storage write failed for batch of %s items, retrying in %.1fs: %s",
+                                   len(batch), delay, e)
+                    time.sleep(delay)
+        finally:
+            for waiter in waiters:
+                waiter.set()
+        return stop
+
+    def _fail(self, reason):
+        """Stop persisting messages, so the stored log stays a correct prefix of the real one"""
+        self.failed = reason
+        logger.critical("Storage %s; no further messages will be persisted until restart", reason)
+        if self.on_failure is not None:
+            try:
+                self.on_failure(reason)
+            except Exception as e:
+                logger.error("Storage failure callback failed: %s", e)
+
+    def _write_rows(self, rows):
+        """Write grouped rows in a single transaction"""
+        self._conn.execute('BEGIN')
+        if rows['messages']:
+            self._conn.executemany(
+                f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}) VALUES ({', '.join('?' * len(MESSAGE_COLUMNS))})",
+                rows['messages'])
+        if rows['feedback']:
+            self._conn.executemany(
+                f"INSERT INTO feedback ({', '.join(FEEDBACK_COLUMNS)}) VALUES ({', '.join('?' * len(FEEDBACK_COLUMNS))})",
+                rows['feedback'])
+        if rows['statuses']:
+            self._conn.executemany("UPDATE messages SET status = ? WHERE id = ?", rows['statuses'])
+        if rows['users']:
+            self._conn.executemany(UPSERT_USER, rows['users'])
+        if rows['deliveries']:
+            self._conn.executemany(
+                "UPDATE broadcast_recipients SET state = ? WHERE broadcast_id = ? AND chat_id = ?",
+                rows['deliveries'])
+        if rows['broadcasts']:
+            self._conn.executemany(
+                "UPDATE broadcasts SET status = ?, sent = ?, failed = ?, retries = ?, "
+                "finished_at = COALESCE(?, finished_at) WHERE id = ?",
+                rows['broadcasts'])
+        self._conn.execute('COMMIT')
+
+    def _checkpoint(self):
+        """Fold the WAL back into the database so restarts replay only a short tail"""
+        try:
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except Exception as e:
+            logger.warning("Storage checkpoint failed: %s", e)
+
+
+def create_storage(backend=STORAGE_BACKEND, path=STORAGE_PATH):
+    """Create the configured storage backend"""
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(path)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Long polls return at least every ~12s (10s timeout plus read latency), so a
+# minute without a successful getUpdates means polling is stuck or dead
+POLL_STALL_AFTER = float(os.getenv('WATCHDOG_POLL_STALL_AFTER', '60'))
+# Updates waiting this long without the dispatcher finishing any means a hung handler
+DISPATCH_STALL_AFTER = float(os.getenv('WATCHDOG_DISPATCH_STALL_AFTER', '300'))
+CHECK_INTERVAL = float(os.getenv('WATCHDOG_CHECK_INTERVAL', '5'))
+STOP_TIMEOUT = 15
+# Wait between restarts while they do not help, doubling up to the maximum
+RESTART_BACKOFF = 60
+MAX_RESTART_BACKOFF = 900
+
+
+class UpdaterWatchdog:
+    """Runs the bot's Updater and replaces it in-process when it stops making progress.
+
+    build() returns a fresh Updater with handlers registered and start(updater)
+    starts receiving updates, returning 'polling' or 'webhook'. The watchdog
+    publishes progress to status (a keep_alive.BotStatus) on every check.
+    """
+
+    def __init__(self, build, start, status, poll_stall_after=POLL_STALL_AFTER,
+                 dispatch_stall_after=DISPATCH_STALL_AFTER, interval=CHECK_INTERVAL):
+        self.build = build
+        self.start_updater = start
+        self.status = status
+        self.poll_stall_after = poll_stall_after
+        self.dispatch_stall_after = dispatch_stall_after
+        self.interval = interval
+        self.updater = None
+        self.mode = None
+        self.restarts = 0
+        self._started_at = 0.0
+        self._next_restart = 0.0
+        self._backoff = RESTART_BACKOFF
+        self._stop = threading.Event()
+
+    def start(self, updater=None):
+        """Start receiving updates on updater, or on a freshly built one"""
+        self.updater = updater or self.build()
+        self._run(self.updater)
+        return self.updater
+
+    def _run(self, updater):
+        self._started_at = time.time()
+        self.mode = self.start_updater(updater)
+
+    def check(self):
+        """Publish progress timestamps and return why the Updater is stalled, or None"""
+        now = time.time()
+        update_queue = self.updater.update_queue
+        last_poll = metrics.api_last_success.get('getUpdates')
+        last_processed = getattr(update_queue, 'last_done', None)
+        # A fresh Updater gets a full grace period before it can be called stalled
+        since_poll = now - max(last_poll or 0, self._started_at)
+        since_processed = now - max(last_processed or 0, self._started_at)
+
+        reason = None
+        if self.mode == 'polling' and since_poll > self.poll_stall_after:
+            reason = f"no successful getUpdates for {int(since_poll)}s"
+        elif update_queue.unfinished_tasks and since_processed > self.dispatch_stall_after:
+            reason = f"{update_queue.unfinished_tasks} updates waiting, none processed for {int(since_processed)}s"
+        self.status.update(last_poll=last_poll, last_processed=last_processed, stalled=reason)
+        return reason
+
+    def restart(self, reason):
+        """Replace the Updater with a fresh one, carrying over undelivered updates"""
+        old = self.updater
+        logger.error("Updater stalled (%s); restarting it in-process", reason)
+        self.status.update(status='restarting')
+
+        # The polling loop exits after its current getUpdates; stop() may hang
+        # on a stuck handler, so it gets a bounded wait on its own thread
+        old.running = False
+        stopper = threading.Thread(target=old.stop, name='UpdaterStop')
+        stopper.daemon = True
+        stopper.start()
+        stopper.join(STOP_TIMEOUT)
+        if stopper.is_alive():
+            logger.warning("Old updater did not stop within %ss; abandoning its threads", STOP_TIMEOUT)
+
+        new = self.build()
+        # Continue after the updates the old poller already confirmed
+        new.last_update_id = old.last_update_id
+        moved = 0
+        while True:
+            try:
+                new.update_queue.put(old.update_queue.get_nowait())
+                moved += 1
+            except queue.Empty:
+                break
+
+        self.updater = new
+        self._run(new)
+        self.restarts += 1
+        self.status.increment('restarts')
+        self.status.update(status='running')
+        logger.info("Updater restarted (%s so far), %s queued updates carried over", self.restarts, moved)
+
+    def idle(self, stop_signals=(signal.SIGINT, signal.SIGTERM, signal.SIGABRT)):
+        """Block like Updater.idle(), checking for stalls, then stop the current Updater"""
+        for signum in stop_signals:
+            signal.signal(signum, lambda signum, frame: self._stop.set())
+
+        while not self._stop.wait(self.interval):
+            try:
+                reason = self.check()
+                if reason is None:
+                    self._backoff = RESTART_BACKOFF
+                elif time.time() >= self._next_restart:
+                    self.restart(reason)
+                    # Back off while restarts do not help, e.g. during a network outage
+                    self._next_restart = time.time() + self._backoff
+                    self._backoff = min(self._backoff * 2, MAX_RESTART_BACKOFF)
+            except Exception as e:
+                logger.error("Watchdog check failed: %s", e)
+
+        logger.info("Stop signal received, stopping the updater")
+        self.updater.stop()
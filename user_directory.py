@@ -0,0 +1,279 @@
+import itertools
+import re
+import threading
+import time
+from datetime import datetime
+
+HOUR = 3600
+# Seconds per unit in segment durations such as '7d'
+DURATION_UNITS = {'m': 60, 'h': HOUR, 'd': 86400, 'w': 7 * 86400}
+RATING_OPS = {
+    '<=': lambda rating, value: rating <= value,
+    '>=': lambda rating, value: rating >= value,
+    '<': lambda rating, value: rating < value,
+    '>': lambda rating, value: rating > value,
+    '=': lambda rating, value: rating == value,
+}
+
+
+def to_epoch(value):
+    """Convert a datetime, ISO string or number to integer epoch seconds"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return int(value)
+
+
+class UserRecord:
+    """Compact per-user record; timestamps are integer epoch seconds"""
+
+    __slots__ = ('user_id', 'user_name', 'username', 'first_seen', 'last_seen', 'message_count')
+
+    def __init__(self, user_id, user_name=None, username=None, first_seen=None, last_seen=None, message_count=0):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.username = username
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.message_count = message_count
+
+    def __repr__(self):
+        return f"UserRecord({self.user_id}, {self.user_name!r}, @{self.username})"
+
+
+def parse_segment(args):
+    """Split leading '--active 7d', '--asked', '--rated<=2' and '--no-username' flags off args.
+
+    Returns (segment, remaining args) where segment holds the keyword
+    arguments for UserDirectory.segment().
+    """
+    segment = {}
+    args = list(args)
+    while args and args[0].startswith('--'):
+        flag = args.pop(0).lower()
+        if flag == '--active':
+            match = re.fullmatch(r'(\d+)([mhdw])', args.pop(0).lower() if args else '')
+            if not match:
+                raise ValueError("--active needs a duration such as 12h, 7d or 4w")
+            segment['active_within'] = int(match.group(1)) * DURATION_UNITS[match.group(2)]
+        elif flag == '--asked':
+            segment['asked'] = True
+        elif flag == '--no-username':
+            segment['no_username'] = True
+        elif flag.startswith('--rated'):
+            match = re.fullmatch(r'--rated(<=|>=|<|>|=)([1-5])', flag)
+            if not match:
+                raise ValueError("--rated needs a comparison such as --rated<=2 or --rated=5")
+            segment['rated'] = (match.group(1), int(match.group(2)))
+        else:
+            raise ValueError(f"Unknown segment flag '{flag}'")
+    return segment, args
+
+
+def describe_segment(segment):
+    """Short human readable form of a segment, e.g. 'active 7d, asked'"""
+    parts = []
+    if 'active_within' in segment:
+        seconds = segment['active_within']
+        unit = next(unit for unit in ('d', 'h', 'm') if seconds % DURATION_UNITS[unit] == 0)
+        parts.append(f"active {seconds // DURATION_UNITS[unit]}{unit}")
+    if segment.get('asked'):
+        parts.append("asked")
+    if 'rated' in segment:
+        parts.append(f"rated{segment['rated'][0]}{segment['rated'][1]}")
+    if segment.get('no_username'):
+        parts.append("no username")
+    return ', '.join(parts) or "all users"
+
+
+class UserDirectory:
+    """Registry of known users with an O(1) case-insensitive username index.
+
+    Broadcast segments are served from indexes kept up to date on every
+    write: users bucketed by the hour of their last_seen, and sets of users
+    who asked something, who have no username and by their latest rating.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._by_username = {}
+        self._by_hour = {}  # hour of last_seen -> set of user ids
+        self._asked = set()
+        self._no_username = set()
+        self._ratings = {}  # user_id -> latest rating
+        self._by_rating = {}  # rating -> set of user ids
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def __bool__(self):
+        return bool(self._users)
+
+    def keys(self):
+        return self._users.keys()
+
+    def values(self):
+        return self._users.values()
+
+    def get(self, user_id):
+        """Return the UserRecord for user_id, or None"""
+        return self._users.get(user_id)
+
+    def find_by_username(self, username):
+        """Return the UserRecord for @username (case-insensitive), or None"""
+        if not username:
+            return None
+        user_id = self._by_username.get(username.lstrip('@').lower())
+        return self._users.get(user_id) if user_id is not None else None
+
+    def touch(self, user_id, user_name, username, seen=None, count_message=False):
+        """Merge a sighting of a user into its record in place and return the record.
+
+        first_seen is kept from the first sighting, last_seen moves forward and
+        the username index follows username changes.
+        """
+        seen = to_epoch(seen)
+        with self._lock:
+            record = self._users.get(user_id)
+            if record is None:
+                record = UserRecord(user_id, first_seen=seen)
+                self._users[user_id] = record
+                self._no_username.add(user_id)
+            elif record.first_seen is None or (seen is not None and seen < record.first_seen):
+                record.first_seen = seen
+
+            if seen is not None and (record.last_seen is None or seen > record.last_seen):
+                self._move_hour(user_id, record.last_seen, seen)
+                record.last_seen = seen
+            if count_message:
+                record.message_count += 1
+            record.user_name = user_name
+            if username != record.username:
+                self._reindex(record, username)
+        return record
+
+    def restore(self, rows):
+        """Bulk-load (user_id, user_name, username, first_seen, last_seen, message_count) rows"""
+        with self._lock:
+            for user_id, user_name, username, first_seen, last_seen, message_count in rows:
+                previous = self._users.get(user_id)
+                record = UserRecord(user_id, user_name, None, to_epoch(first_seen),
+                                    to_epoch(last_seen), message_count or 0)
+                if previous is not None:
+                    # Re-restored (sharded followers); drop the old record from the indexes
+                    record.username = previous.username
+                    self._move_hour(user_id, previous.last_seen, record.last_seen)
+                else:
+                    self._move_hour(user_id, None, record.last_seen)
+                    self._no_username.add(user_id)
+                self._users[user_id] = record
+                self._reindex(record, username)
+
+    def _move_hour(self, user_id, old_seen, new_seen):
+        old_hour = old_seen // HOUR if old_seen is not None else None
+        new_hour = new_seen // HOUR if new_seen is not None else None
+        if old_hour == new_hour:
+            return
+        if old_hour is not None:
+            bucket = self._by_hour.get(old_hour)
+            if bucket is not None:
+                bucket.discard(user_id)
+                if not bucket:
+                    del self._by_hour[old_hour]
+        if new_hour is not None:
+            self._by_hour.setdefault(new_hour, set()).add(user_id)
+
+    def mark_asked(self, user_id):
+        """Record that the user logged a message for the admin (/ask or a file)"""
+        with self._lock:
+            self._asked.add(user_id)
+
+    def rate(self, user_id, rating):
+        """Record the user's latest feedback rating"""
+        with self._lock:
+            previous = self._ratings.get(user_id)
+            if previous == rating:
+                return
+            if previous is not None:
+                self._by_rating[previous].discard(user_id)
+            self._ratings[user_id] = rating
+            self._by_rating.setdefault(rating, set()).add(user_id)
+
+    def _active(self, since):
+        """(buckets entirely after since, the bucket holding since) under the lock"""
+        first = since // HOUR
+        return [users for hour, users in self._by_hour.items() if hour > first], self._by_hour.get(first, ())
+
+    def _active_list(self, since):
+        buckets, boundary = self._active(since)
+        # Every user is in exactly one bucket, so the buckets just chain together;
+        # only the bucket holding the cutoff needs a per-user check
+        active = list(itertools.chain.from_iterable(buckets))
+        active.extend(user_id for user_id in boundary if self._users[user_id].last_seen >= since)
+        return active
+
+    def active_since(self, since):
+        """Ids of users last seen at or after the epoch since"""
+        with self._lock:
+            return self._active_list(since)
+
+    def segment(self, active_within=None, asked=False, rated=None, no_username=False, now=None):
+        """Ids of users matching every given criterion, resolved from the segment indexes.
+
+        rated is an (operator, rating) pair such as ('<=', 2) matched against
+        each user's latest rating.
+        """
+        since = int(now if now is not None else time.time()) - active_within if active_within is not None else None
+        with self._lock:
+            sets = []
+            if asked:
+                sets.append(self._asked)
+            if no_username:
+                sets.append(self._no_username)
+            if rated is not None:
+                op, value = rated
+                sets.append(set().union(*(users for rating, users in self._by_rating.items()
+                                          if RATING_OPS[op](rating, value))))
+            if not sets:
+                return self._active_list(since) if since is not None else list(self._users)
+            # Intersect starting from the smallest set
+            sets.sort(key=len)
+            matched = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+            if since is None:
+                return list(matched)
+            buckets, boundary = self._active(since)
+            if len(matched) <= sum(map(len, buckets)) + len(boundary):
+                # Fewer candidates than active users: check each candidate's last_seen.
+                # Ratings can name users the registry has not seen yet; they have no last_seen
+                users = self._users
+                return [user_id for user_id in matched
+                        if user_id in users and (users[user_id].last_seen or 0) >= since]
+            return list(matched.intersection(self._active_list(since)))
+
+    def _reindex(self, record, username):
+        if record.username:
+            key = record.username.lower()
+            if self._by_username.get(key) == record.user_id:
+                del self._by_username[key]
+        if username:
+            self._no_username.discard(record.user_id)
+        else:
+            self._no_username.add(record.user_id)
+        record.username = username
+        if username:
+            key = username.lower()
+            # Reuse the username string itself as the key when it is already lowercase
+            if key == username:
+                key = username
+            # Telegram usernames are unique, so the latest holder wins
+            self._by_username[key] = record.user_id